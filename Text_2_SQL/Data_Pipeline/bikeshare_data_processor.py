@@ -5,78 +5,148 @@ import datetime as dt
 import requests 
 import zipfile
 import io 
+import hashlib
 import plotly.express as px
 import matplotlib.pyplot as plt 
 import time
 import math
 import itertools
 import data_cleaning  # Import the class directly
+from download_engine import Download_Engine
+from resource_cache import Resource_Cache
+from stream_pipeline import Streaming_Pipeline
+from parallel_loader import Parallel_Loader
+from incremental_ingest import Incremental_Ingestor
+from instrumentation import Run_Profiler
 from glob import glob
-import psutil  # For memory monitoring
 import gc  # For garbage collection
 import json
 
 
- 
+# Parsing members on a process pool only pays off for large archives on machines with spare cores:
+# below this the worker start-up and Arrow round trip cost more than they save
+PARALLEL_MIN_BYTES = 512 * 1024**2  # uncompressed CSV bytes
+PARALLEL_MIN_WORKERS = 4
+
 
 class Get_BikeShareData:    
     """Class to interact with the Bike Share API and process data"""
     def __init__(self, base_url="https://ckan0.cf.opendata.inter.prod-toronto.ca",
-                 station_url='https://tor.publicbikesystem.net/ube/gbfs/v1/en/station_information'):
+                 station_url='https://tor.publicbikesystem.net/ube/gbfs/v1/en/station_information',
+                 download_dir='downloads', max_workers=4,
+                 cache_dir='cache', cache_max_bytes=5 * 1024**3, profiler=None):
         """Initialize BikeShareAPI with base URLs for data access"""
+        self.profiler = profiler or Run_Profiler(enabled=False)
         self.base_url = base_url
         self.station_url = station_url
-        self.schema_path = os.path.join(os.path.dirname(__file__), 'table_schema.json')
+        self.downloader = Download_Engine(download_dir=download_dir, max_workers=max_workers)
+        self.cache = Resource_Cache(cache_dir=cache_dir, max_bytes=cache_max_bytes) if cache_dir else None
+        self.resource_ids = {}  # archive url -> CKAN resource id
+        self.resource_versions = {}  # archive url -> CKAN last_modified
+        self.schema_path = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'table_schema.json')
 
     def bikeshare_api(self, limit=2):
         """Retrieve bike share data URLs from the API"""
+        with self.profiler.stage('discover') as stats:
+            meta_data = self._discover()
+            stats.rows += len(meta_data)
+        return meta_data[-limit:] if limit else meta_data  # Return last n URLs, or all of them
+
+    def _discover(self):
+        """List the archive URLs of every non-datastore resource"""
         url = f"{self.base_url}/api/3/action/package_show"
         params = {"id": "bike-share-toronto-ridership-data"}
-        package = requests.get(url, params=params).json()
+        session = self.downloader.session
+        if self.cache:
+            package = self.cache.get_json(session, url, key='package_show', params=params)
+        else:
+            package = session.get(url, params=params).json()
         meta_data = []
 
         for resource in package["result"]["resources"]:
             if not resource["datastore_active"]:
                 url = f"{self.base_url}/api/3/action/resource_show?id={resource['id']}"
-                resource_metadata = requests.get(url).json()
+                version = resource.get('last_modified') or resource.get('metadata_modified')
+                if self.cache:
+                    # Skip the request entirely while the resource's last_modified is unchanged
+                    resource_metadata = self.cache.get_json(session, url,
+                                                            key=f"resource_show/{resource['id']}",
+                                                            version=version)
+                else:
+                    resource_metadata = session.get(url).json()
                 meta_data.append(resource_metadata['result']['url'])
+                self.resource_ids[resource_metadata['result']['url']] = resource['id']
+                self.resource_versions[resource_metadata['result']['url']] = version
 
-        return meta_data[-limit:]  # Return last n URLs
+        return meta_data
+
+    def resource_id(self, url):
+        """CKAN resource id of an archive, or a filesystem-safe digest of its url when it was not discovered"""
+        # Used in staging directory and partition file names, so never the raw url ('https:', '/')
+        return self.resource_ids.get(url) or 'url-' + hashlib.sha1(url.encode('utf-8')).hexdigest()[:16]
+
+    def _download_cached(self, url):
+        """Download one archive through the resource cache"""
+        key = f"archive/{self.resource_id(url)}"
+        return self.cache.get_file(self.downloader, url, key)
 
     def api_download(self, urls):
-        """Download data from provided URLs"""
-        return [requests.get(url) for url in urls]
+        """Download data from provided URLs concurrently, returning local file paths"""
+        with self.profiler.stage('download') as stats:
+            if self.cache:
+                paths = self.downloader.download_many(urls, download_func=self._download_cached)
+            else:
+                paths = self.downloader.download_many(urls)
+            stats.bytes_in += sum(os.path.getsize(path) for path in paths)
+        return paths
 
-    def save_zip(self, responses):
-        """Save and process zip files from responses"""
+    def save_zip(self, paths):
+        """Open the downloaded zip files"""
         zip_files = []
-        for response in responses:
-            z = zipfile.ZipFile(io.BytesIO(response.content))
+        for path in paths:
+            z = zipfile.ZipFile(path)
             zip_files.append(z)
         return zip_files
 
+    def stream_chunks(self, zip_file, chunk_size=50000):
+        """Yield DataFrame chunks from each zip member, decoding one member at a time"""
+        for filename in zip_file.namelist():
+            if filename.endswith('/'):
+                continue  # directory entry
+            print(f"Processing file: {filename}")
+
+            # The member is decompressed incrementally, so only one chunk is held in memory
+            with zip_file.open(filename) as member:
+                for chunk in pd.read_csv(member, encoding='cp1252', chunksize=chunk_size):
+                    yield chunk
+
+    def stream_data(self, paths, chunk_size=50000):
+        """Yield DataFrame chunks across downloaded archives, opening one zip at a time"""
+        for path in paths:
+            with self.profiler.stage('unzip') as stats:
+                # Decompression itself happens lazily inside read_csv and is counted under 'parse'
+                zip_file = zipfile.ZipFile(path)
+                infos = zip_file.infolist()
+                stats.bytes_in += sum(info.compress_size for info in infos)
+                stats.bytes_out += sum(info.file_size for info in infos)
+            with zip_file:
+                yield from self.profiler.iterate('parse', self.stream_chunks(zip_file, chunk_size=chunk_size))
+
     def data_load_chunked(self, zip_file, chunk_size=50000):
         """Load data from zip file into pandas DataFrame using chunked processing"""
         all_chunks = []
         
-        for filename in zip_file.namelist():
-            print(f"Processing file: {filename}")
+        for i, chunk in enumerate(self.stream_chunks(zip_file, chunk_size=chunk_size)):
+            all_chunks.append(chunk)
+            print(f"Loaded chunk {i+1}")
             
-            # Read CSV in chunks
-            chunk_iter = pd.read_csv(zip_file.open(filename), encoding='cp1252', chunksize=chunk_size)
+            # Monitor memory usage
+            memory_usage = self.profiler.memory("Memory usage").percent
             
-            for i, chunk in enumerate(chunk_iter):
-                all_chunks.append(chunk)
-                print(f"Loaded chunk {i+1} from {filename}")
-                
-                # Monitor memory usage
-                memory_usage = psutil.virtual_memory().percent
-                print(f"Memory usage: {memory_usage:.1f}%")
-                
-                # Force garbage collection if memory usage is high
-                if memory_usage > 80:
-                    gc.collect()
-                    print("Garbage collection performed due to high memory usage")
+            # Force garbage collection if memory usage is high
+            if memory_usage > 80:
+                gc.collect()
+                print("Garbage collection performed due to high memory usage")
         
         # Combine all chunks
         if all_chunks:
@@ -90,13 +160,18 @@ class Get_BikeShareData:
     def data_load(self, zip_file):
         """Load data from zip file into pandas DataFrame - optimized version"""
         # Check available memory
-        available_memory = psutil.virtual_memory().available / (1024**3)  # GB
-        print(f"Available memory: {available_memory:.2f} GB")
+        available_memory = self.profiler.memory("Memory before load").available / (1024**3)  # GB
         
         # Use chunked loading for large files
         if available_memory < 2:  # Less than 2GB available
             print("Low memory detected. Using chunked loading...")
             return self.data_load_chunked(zip_file, chunk_size=25000)
+        members = [info for info in zip_file.infolist() if not info.filename.endswith('/')]
+        uncompressed = sum(info.file_size for info in members)
+        workers = min(len(members), os.cpu_count() or 1)
+        if zip_file.filename and uncompressed >= PARALLEL_MIN_BYTES and workers >= PARALLEL_MIN_WORKERS:
+            print(f"Parsing {uncompressed / 1024**2:.0f} MB of CSV on {workers} processes")
+            return self.data_load_parallel(zip_file.filename, max_workers=workers)
         else:
             # Original method for smaller datasets
             data_appended = pd.concat(
@@ -105,8 +180,19 @@ class Get_BikeShareData:
             )
             return data_appended
 
+    def data_load_parallel(self, path, max_workers=None):
+        """Load a downloaded zip by parsing its member files on a process pool"""
+        return Parallel_Loader(max_workers=max_workers).load(path)
+
     def get_stations(self):
         """Retrieve station information"""
+        with self.profiler.stage('station_fetch') as stats:
+            stations_df = self._fetch_stations()
+            stats.rows += len(stations_df)
+        return stations_df
+
+    def _fetch_stations(self):
+        """Download the GBFS station feed into a DataFrame"""
         response = requests.get(self.station_url).json()
         stations = []
 
@@ -129,12 +215,12 @@ class Get_BikeShareData:
         urls = self.bikeshare_api(limit=limit)
         print(f"Found {len(urls)} data sources")
         
-        # Download responses
-        responses = self.api_download(urls)
-        print("Downloaded all responses")
+        # Download archives to disk
+        paths = self.api_download(urls)
+        print("Downloaded all archives")
         
         # Process zip files
-        zips = self.save_zip(responses)
+        zips = self.save_zip(paths)
         print(f"Processed {len(zips)} zip files")
         
         # Load all data with memory monitoring
@@ -145,12 +231,14 @@ class Get_BikeShareData:
             data_append.append(data)
             
             # Monitor memory after each file
-            memory_usage = psutil.virtual_memory().percent
-            print(f"Memory usage after file {i+1}: {memory_usage:.1f}%")
+            self.profiler.memory(f"Memory usage after file {i+1}")
             
             # Force garbage collection
             gc.collect()
         
+        if self.cache:
+            self.cache.stats()
+
         # Combine all data
         if data_append:
             result = pd.concat(data_append, ignore_index=True)
@@ -172,18 +260,87 @@ class Get_BikeShareData:
             print(f"Schema file not found at {self.schema_path}")
             return None
 
-def main():
+def run_streaming(api, urls, stations, table_schema, chunk_size=250000, cleaner=None):
+    """Download, clean and write the ridership data chunk by chunk in bounded memory"""
+    cleaner = cleaner or data_cleaning.bike_share_data_clean(bucket_name=os.getenv('S3_BUCKET_NAME'), 
+                                                  df=None,
+                                                  upload_to_s3 = False,
+                                                  upload_to_GCS = True,
+                                                  output_format='parquet',
+                                                  table_schema=table_schema)
+    paths = api.api_download(urls)
+    if api.cache:
+        api.cache.stats()
+
+    pipeline = Streaming_Pipeline(api, cleaner, output_path='bike_share_data.parquet',
+                                  chunk_size=chunk_size, table_schema=table_schema)
+    output_path = pipeline.run(paths)
+    if output_path is None:
+        print("No data retrieved. Exiting.")
+        return
+
+    print("Saving data...")
+    with api.profiler.stage('upload') as stats:
+        cleaner.save_file(output_path, key='bike_share_data')
+        cleaner.save_to_s3(df=stations, key='stations_data', df_name='stations_data')
+        cleaner.save_to_GCS(df=stations, key='stations_data', df_name='stations_data')
+        cleaner.save_to_GCS(df=table_schema, key='table_schema', df_name='table_schema')
+        stats.bytes_out += os.path.getsize(output_path)
+
+    pipeline.sample(1000).to_csv('bike_share_data_sample.csv', index=False)
+
+def run_incremental(api, urls, stations, table_schema, chunk_size=250000, cleaner=None):
+    """Load only new or changed months and append them as monthly partitions"""
+    cleaner = cleaner or data_cleaning.bike_share_data_clean(bucket_name=os.getenv('S3_BUCKET_NAME'), 
+                                                  df=None,
+                                                  upload_to_s3 = False,
+                                                  upload_to_GCS = True,
+                                                  output_format='parquet',
+                                                  table_schema=table_schema)
+    ingestor = Incremental_Ingestor(api, cleaner, dataset_dir='bike_share_data',
+                                    state_path='ingestion_state.json',
+                                    chunk_size=chunk_size, table_schema=table_schema)
+    files = ingestor.run(urls)
+    if api.cache:
+        api.cache.stats()
+
+    print(f"Uploading {len(files)} new partition files...")
+    with api.profiler.stage('upload') as stats:
+        for relative_path in files:
+            key = os.path.splitext(os.path.join('bike_share_data', relative_path))[0]
+            path = os.path.join(ingestor.dataset_dir, relative_path)
+            cleaner.save_file(path, key=key)
+            stats.bytes_out += os.path.getsize(path)
+        cleaner.save_to_s3(df=stations, key='stations_data', df_name='stations_data')
+        cleaner.save_to_GCS(df=stations, key='stations_data', df_name='stations_data')
+        cleaner.save_to_GCS(df=table_schema, key='table_schema', df_name='table_schema')
+
+def main(mode='incremental', profile=None):
     """Main function with memory monitoring and error handling"""
+    # mode: 'incremental' (new months only), 'streaming' (full reload in bounded memory) or 'memory'
+    # profile: None, 'cprofile' or 'pyinstrument' (default: PIPELINE_PROFILE); a JSON stage report is always
+    # written to run_reports/
+    profiler = Run_Profiler(profile=profile or os.getenv('PIPELINE_PROFILE')).start()
     try:
         print("=== Bike Share Data Processor (Optimized) ===")
-        print(f"Initial memory usage: {psutil.virtual_memory().percent:.1f}%")
         
         # Initialize the API client
-        api = Get_BikeShareData()
+        api = Get_BikeShareData(profiler=profiler)
         
         # Get URLs
-        jsons = api.bikeshare_api(limit=2)
+        jsons = api.bikeshare_api(limit=None if mode == 'incremental' else 2)
         print(f"Retrieved {len(jsons)} data sources")
+
+        if mode in ('incremental', 'streaming'):
+            # Chunk-wise pipeline: the full dataset is never held in memory
+            stations = api.get_stations()
+            print(f"Found {len(stations)} stations")
+            if mode == 'incremental':
+                run_incremental(api, jsons, stations, api.load_schema())
+            else:
+                run_streaming(api, jsons, stations, api.load_schema())
+            print("=== Processing Complete ===")
+            return
         
         # Get the data with memory monitoring
         print("Downloading and processing data...")
@@ -194,49 +351,55 @@ def main():
             return
         
         print(f"Downloaded {len(data)} rides")
-        print(f"Memory usage after data download: {psutil.virtual_memory().percent:.1f}%")
         
         # Get station information
         print("Retrieving station information...")
         stations = api.get_stations()
         print(f"Found {len(stations)} stations")
         
+        # Schema drives the typed Parquet output
+        table_schema = api.load_schema()
+        print('Schema loaded:', table_schema)   
+
         # Initialize the data cleaner and clean the data
         print("Cleaning data...")
         cleaner = data_cleaning.bike_share_data_clean(bucket_name=os.getenv('S3_BUCKET_NAME'), 
                                                       df=data,
                                                       upload_to_s3 = False,
-                                                      upload_to_GCS = True)  # Set to True to upload to S3
+                                                      upload_to_GCS = True,  # Set to True to upload to S3
+                                                      output_format='parquet',
+                                                      table_schema=table_schema)
         print(os.getenv('S3_BUCKET_NAME'))
-        # Clean data with memory monitoring
-        table_schema = api.load_schema()
-        print('Schema loaded:', table_schema)   
 
-        data = cleaner.clean_data(data)
+        with profiler.stage('clean') as stats:
+            data = cleaner.clean_data(data)
+            stats.rows += len(data)
         print(f"Data cleaned. Final size: {len(data)} rows")
-        print(f"Memory usage after cleaning: {psutil.virtual_memory().percent:.1f}%")
         
         print('Data columns datatypes:', data.dtypes)
         print('stations columns datatypes:', stations.dtypes)
         # Save to S3
         print("data columns:", data.columns)
-        print("Saving data to S3...")
-        cleaner.save_to_s3(df=data, key='bike_share_data', df_name='bike_share_data')
-        cleaner.save_to_s3(df=stations, key='stations_data', df_name='stations_data')
-        
-        print("Saving data to GCS...")
-        cleaner.save_to_GCS(df=data, key='bike_share_data', df_name='bike_share_data')
-        cleaner.save_to_GCS(df=stations, key='stations_data', df_name='stations_data')
-        cleaner.save_to_GCS(df=table_schema, key='table_schema', df_name='table_schema')
+        with profiler.stage('upload') as stats:
+            print("Saving data to S3...")
+            cleaner.save_to_s3(df=data, key='bike_share_data', df_name='bike_share_data')
+            cleaner.save_to_s3(df=stations, key='stations_data', df_name='stations_data')
+            
+            print("Saving data to GCS...")
+            cleaner.save_to_GCS(df=data, key='bike_share_data', df_name='bike_share_data')
+            cleaner.save_to_GCS(df=stations, key='stations_data', df_name='stations_data')
+            cleaner.save_to_GCS(df=table_schema, key='table_schema', df_name='table_schema')
+            stats.rows += len(data)
         
 
         data[:1000].to_csv('bike_share_data_sample.csv', index=False)
         print("=== Processing Complete ===")
-        print(f"Final memory usage: {psutil.virtual_memory().percent:.1f}%")
                 
     except Exception as e:
         print(f"An error occurred: {e}")
-        print("Memory usage at error:", psutil.virtual_memory().percent)
+        profiler.memory("Memory usage at error")
+    finally:
+        profiler.stop()
         
 if __name__ == "__main__":
     main() 
@@ -1,19 +1,33 @@
 import boto3
 import pandas as pd
-from io import StringIO
+import numpy as np
+from io import StringIO, BytesIO
 import os 
+import json
 from datetime import datetime
 from google.cloud import storage
+import pyarrow as pa
+import pyarrow.parquet as pq
 import sys
 from dotenv import load_dotenv
 
 load_dotenv()  # Load environment variables from .env file
 
+TIME_FORMAT = "%m/%d/%Y %H:%M"  # Start Time / End Time format in the ridership CSVs
+
+# table_schema.json column types -> Arrow types used for the Parquet output
+ARROW_TYPES = {'int': pa.int64(),
+               'float': pa.float64(),
+               'timestamp': pa.timestamp('us'),
+               'varchar': pa.string()}
+
 class bike_share_data_clean:
     """Class to clean bike share data from S3"""
     def __init__(self, bucket_name, df, 
                  upload_to_s3=False, 
-                 upload_to_GCS=False):
+                 upload_to_GCS=False,
+                 output_format='csv',
+                 table_schema=None):
         self.s3 = boto3.client('s3', 
                                aws_access_key_id=os.getenv('AWS_ACCESS_KEY_ID'),
                                aws_secret_access_key=os.getenv('AWS_SECRET_ACCESS_KEY'))
@@ -24,47 +38,136 @@ class bike_share_data_clean:
         self.df = df  # Initialize the DataFrame in __init__
         self.upload_to_s3 = upload_to_s3  # Flag to control S3 upload
         self.upload_to_GCS = upload_to_GCS  # Flag to control GCS upload
+        self.output_format = output_format  # 'csv' or 'parquet'
+        self.table_schema = table_schema  # Parsed table_schema.json, drives Parquet column types
         
         self.credentials_path = os.path.join(os.path.dirname(__file__), 'GOOGLE_APPLICATION_CREDENTIALS.json')
-        self.credentials = storage.Client.from_service_account_json(self.credentials_path)
+        # Only parse credentials when GCS uploads are enabled
+        self.credentials = storage.Client.from_service_account_json(self.credentials_path) if upload_to_GCS else None
         print(f"Credentials path: {self.credentials_path}")
 
 
     
+    @staticmethod
+    def _clean_text(series, factorized=None):
+        """Strip and lowercase a text column once per distinct value, returning a categorical
+
+        factorized is pd.factorize(series) when the caller already has it.
+        """
+        codes, uniques = factorized if factorized is not None else pd.factorize(series)
+        if len(uniques) == 0:  # all missing
+            return pd.Series(pd.Categorical.from_codes(codes, categories=[]), index=series.index)
+        cleaned = pd.Index(uniques).str.strip().str.lower()
+        # Values that only differ by case or whitespace collapse into one category
+        cleaned_codes, categories = pd.factorize(cleaned)
+        codes = np.where(codes >= 0, cleaned_codes[codes], -1)
+        return pd.Series(pd.Categorical.from_codes(codes, categories=categories), index=series.index)
+
+    @staticmethod
+    def _parse_fixed_width(values):
+        """Parse zero-padded 'MM/DD/YYYY HH:MM' strings with array arithmetic, or None if any deviate"""
+        chars = np.asarray(values, dtype='U16')
+        if len(chars) == 0 or pd.Series(values).str.len().ne(16).any():
+            return None
+        digits = chars.view(np.uint32).reshape(-1, 16).astype(np.int64) - ord('0')
+        separators = digits[:, [2, 5, 10, 13]] + ord('0')
+        if not (separators == [ord('/'), ord('/'), ord(' '), ord(':')]).all():
+            return None
+
+        def number(*positions):
+            value = 0
+            for position in positions:
+                value = value * 10 + digits[:, position]
+            return value
+
+        parts = pd.DataFrame({'year': number(6, 7, 8, 9), 'month': number(0, 1), 'day': number(3, 4),
+                              'hour': number(11, 12), 'minute': number(14, 15)})
+        return pd.to_datetime(parts)
+
+    @staticmethod
+    def _parse_times(series, format=TIME_FORMAT):
+        """Parse a categorical timestamp column once per distinct value"""
+        if not isinstance(series.dtype, pd.CategoricalDtype):
+            series = series.astype('category')
+        categories = series.cat.categories
+        parsed = None
+        if format == TIME_FORMAT:
+            parsed = bike_share_data_clean._parse_fixed_width(categories)
+        if parsed is None:
+            parsed = pd.to_datetime(categories, format=format)
+        codes = series.cat.codes.to_numpy()
+        values = np.asarray(parsed, dtype='datetime64[ns]')[codes]
+        values[codes < 0] = np.datetime64('NaT')
+        return pd.Series(values, index=series.index)
+
+    @staticmethod
+    def _to_int(series, fill_value=None):
+        """Convert to int64, or nullable Int64 when missing values remain"""
+        if fill_value is not None:
+            series = series.fillna(fill_value)
+        if series.isna().any():
+            return series.astype('Int64')
+        return series.astype('int64')
+
+    @staticmethod
+    def _row_hashes(df, factorized):
+        """One uint64 per row combining every column, text columns through their factorized codes
+
+        Built column by column, so no second frame of keys is materialized.
+        """
+        hashes = np.zeros(len(df), dtype=np.uint64)
+        for col in df.columns:
+            if col in factorized:
+                column = pd.util.hash_array(factorized[col][0])
+            else:
+                column = pd.util.hash_pandas_object(df[col], index=False).to_numpy()
+            # Multiply before mixing in the next column, so equal values in different columns do not cancel
+            hashes = hashes * np.uint64(1000003) ^ column
+        return hashes
+
     def clean_data(self, df):
-        """Basic data cleaning"""
-        # Remove duplicates
-        df = df.drop_duplicates()
+        """Basic data cleaning, vectorized so it can run on the whole frame or one chunk at a time"""
+        # Remove exact duplicates before normalizing text, comparing factorized codes instead of hashing strings
+        text_cols = df.select_dtypes(include=['object', 'string']).columns
+        factorized = {col: pd.factorize(df[col]) for col in text_cols}
+        keep = ~pd.Series(self._row_hashes(df, factorized)).duplicated().to_numpy()
+        if not keep.all():
+            df = df.take(np.flatnonzero(keep))
+            factorized = {col: (codes[keep], uniques) for col, (codes, uniques) in factorized.items()}
+        else:
+            # Columns are replaced below; a shallow copy keeps the caller's frame as it was
+            df = df.copy(deep=False)
+
+        # Standardize text columns: strip whitespace and convert to lowercase
+        for col in text_cols:
+            df[col] = self._clean_text(df[col], factorized[col])
         
         # Handle missing values
         #df = df.dropna(subset=['important_column'])  # Replace with your key column
         
-        # Standardize text columns
-        text_cols = df.select_dtypes(include=['object']).columns
-
-        # Strip whitespace and convert to lowercase
-        for col in text_cols:
-            df[col] = df[col].str.strip().str.lower()
-        
         # Cleaning 'Trip Id' column which appears twice in the dataset
-        df['Trip Id'] = df['Trip Id'].fillna(value = df['ï»¿Trip Id'])
-        df['Trip Id'] = [int(i) for i in df['Trip Id']]
-        df = df.drop(columns = ['ï»¿Trip Id'])
+        if 'ï»¿Trip Id' in df.columns:
+            if 'Trip Id' in df.columns:
+                df['Trip Id'] = df['Trip Id'].fillna(value = df['ï»¿Trip Id'])
+            else:
+                df['Trip Id'] = df['ï»¿Trip Id']
+            df = df.drop(columns = ['ï»¿Trip Id'])
+        df['Trip Id'] = self._to_int(df['Trip Id'])
         
         # Convert date columns to datetime format
-        df['Start Time'] = pd.to_datetime(df['Start Time'],
-                                               format = "%m/%d/%Y %H:%M") 
-        
-        df['End Time'] = pd.to_datetime(df['End Time'],
-                                               format = "%m/%d/%Y %H:%M") 
-                                               
-        df['ym_id'] = df['Start Time'].dt.strftime('%Y-%m-%d')
-        
-        df['End Station Id'] = df['End Station Id'].fillna(9999)
-        df['Start Station Id'] = df['Start Station Id'].fillna(9999)
+        df['Start Time'] = self._parse_times(df['Start Time'])
+        df['End Time'] = self._parse_times(df['End Time'])
+
+        # Format each distinct day once instead of every ride
+        start_day = df['Start Time'].dt.floor('D')
+        codes, days = pd.factorize(start_day)
+        df['ym_id'] = pd.Categorical.from_codes(codes, categories=pd.DatetimeIndex(days).strftime('%Y-%m-%d'))
         
-        if df['End Station Id'].dtype is not int:
-            df['End Station Id'] = df['End Station Id'].astype(int)
+        df['End Station Id'] = self._to_int(df['End Station Id'], fill_value=9999)
+        df['Start Station Id'] = self._to_int(df['Start Station Id'], fill_value=9999)
+        for col in ['Bike Id', 'Trip  Duration']:
+            if col in df.columns:
+                df[col] = self._to_int(df[col])
 
         col_dict = {'Start Station Id': 'Start_Station_Id', 
                     'End Station Id': 'End_Station_Id', 
@@ -87,11 +190,81 @@ class bike_share_data_clean:
 
         return df
 
+    def clean_chunks(self, chunks):
+        """Clean an iterable of DataFrame chunks lazily"""
+        for chunk in chunks:
+            yield self.clean_data(chunk)
+
     
+    @staticmethod
+    def arrow_types(table_schema, separator='table_1'):
+        """Map column names to Arrow types using the CREATE TABLE statement in table_schema.json"""
+        types = {}
+        if not table_schema:
+            return types
+        for table in table_schema['tables']:
+            if table['separator'] != separator:
+                continue
+            statement = table['schema']
+            for column in statement[statement.index('(') + 1:statement.rindex(')')].split(','):
+                parts = column.split()
+                if len(parts) > 1 and parts[1].lower() in ARROW_TYPES:
+                    types[parts[0]] = ARROW_TYPES[parts[1].lower()]
+        return types
+
+    @staticmethod
+    def storage_type(arrow_type):
+        """Type a column is written with: strings are dictionary-encoded, everything else as declared"""
+        if pa.types.is_string(arrow_type) or pa.types.is_large_string(arrow_type):
+            # Station names, user types etc. repeat heavily, store them dictionary-encoded
+            return pa.dictionary(pa.int32(), pa.string())
+        return arrow_type
+
+    @staticmethod
+    def to_arrow(df, table_schema=None, separator='table_1'):
+        """Convert a DataFrame to an Arrow table typed by table_schema.json"""
+        types = bike_share_data_clean.arrow_types(table_schema, separator)
+        table = pa.Table.from_pandas(df, preserve_index=False)
+        fields = []
+        for field in table.schema:
+            target = types.get(field.name, field.type)
+            if pa.types.is_dictionary(target):
+                target = target.value_type  # categorical columns from clean_data
+            fields.append(pa.field(field.name, bike_share_data_clean.storage_type(target)))
+        return table.cast(pa.schema(fields))
+
+    @staticmethod
+    def to_parquet_buffer(df, table_schema=None, separator='table_1'):
+        """Write a DataFrame to an in-memory zstd-compressed Parquet buffer"""
+        buffer = BytesIO()
+        pq.write_table(bike_share_data_clean.to_arrow(df, table_schema, separator),
+                       buffer, compression='zstd')
+        buffer.seek(0)
+        return buffer
+
+    def _separator(self, key):
+        """Pick the table_schema.json entry for an upload key"""
+        return 'table_2' if key.startswith('stations') else 'table_1'
+
+    def save_file(self, path, key):
+        """Upload an already written file (e.g. the streaming pipeline's Parquet output)"""
+        extension = os.path.splitext(path)[1]
+        if self.upload_to_s3:
+            self.s3.upload_file(path, self.bucket_name, f'{key}{extension}')
+            print(f"{path} uploaded to S3")
+        if self.upload_to_GCS:
+            blob = self.credentials.bucket(self.bucket_name).blob(f'{key}{extension}')
+            blob.upload_from_filename(path)
+            print(f"{path} uploaded to GCS at {key}{extension}")
+
     def save_to_s3(self, df, key, df_name):
         if self.upload_to_s3:
-            df.to_csv('{}.csv'.format(df_name), sep=',', index=False)
-            self.s3.upload_file('{}.csv'.format(df_name),self.bucket_name,'{}.csv'.format(key))
+            if self.output_format == 'parquet':
+                buffer = self.to_parquet_buffer(df, self.table_schema, self._separator(key))
+                self.s3.upload_fileobj(buffer, self.bucket_name, '{}.parquet'.format(key))
+            else:
+                df.to_csv('{}.csv'.format(df_name), sep=',', index=False)
+                self.s3.upload_file('{}.csv'.format(df_name),self.bucket_name,'{}.csv'.format(key))
             print("Data Uploaded to S3")
         else: 
             print("Upload to S3 is disabled. Data not uploaded.")
@@ -100,20 +273,26 @@ class bike_share_data_clean:
         """Save DataFrame to Google Cloud Storage"""
         if self.upload_to_GCS: 
             print('Initializing GCS client...')
-            client = storage.Client.from_service_account_json(self.credentials_path)
+            client = self.credentials
             print('GCS client initialized.')
             
             bucket = client.bucket(self.bucket_name)
             print(f"bucket initialized: {bucket.name}")
-            if isinstance(df, pd.DataFrame) == True: 
+            if isinstance(df, pd.DataFrame) == True and self.output_format == 'parquet':
+                blob = bucket.blob(f'{key}.parquet')
+                buffer = self.to_parquet_buffer(df, self.table_schema, self._separator(key))
+                print(f"Saving data to GCS at {key}.parquet")
+                blob.upload_from_file(buffer, content_type='application/vnd.apache.parquet')
+                print(f"Data saved to GCS at {key}.parquet")
+            elif isinstance(df, pd.DataFrame) == True: 
                 blob = bucket.blob(f'{key}.csv')
                 df.to_csv('{}.csv'.format(df_name), sep=',', index=False)
                 print(f"Saving data to GCS at {key}/{df_name}.csv")
                 blob.upload_from_filename('{}.csv'.format(df_name), 'text/csv')
                 print(f"Data saved to GCS at {key}/{df_name}.csv")
             else: 
-                blob = bucket.blob(f'{key}.json)')
-                blob.upload_from_filename('{}.json'.format(key), 'application/json')
+                blob = bucket.blob(f'{key}.json')
+                blob.upload_from_string(json.dumps(df), 'application/json')
                 print("JSON Data Uploaded to GCS")
             
 
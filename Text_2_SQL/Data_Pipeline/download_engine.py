@@ -0,0 +1,134 @@
+import os
+import time
+import hashlib
+from urllib.parse import urlparse
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+
+
+class Download_Engine:
+    """Concurrent, resumable file downloader sharing one keep-alive connection pool"""
+    def __init__(self, download_dir='downloads', max_workers=4,
+                 chunk_size=1024 * 1024, max_retries=5,
+                 backoff_factor=0.5, timeout=60):
+        """Initialize the pooled session and download settings"""
+        self.download_dir = download_dir
+        self.max_workers = max_workers
+        self.chunk_size = chunk_size
+        self.max_retries = max_retries
+        self.backoff_factor = backoff_factor
+        self.timeout = timeout
+
+        # One session for every worker thread so TCP/TLS connections are reused
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=max_workers, pool_maxsize=max_workers)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+        os.makedirs(self.download_dir, exist_ok=True)
+
+    def local_path(self, url):
+        """Return the on-disk path a URL is downloaded to"""
+        filename = os.path.basename(urlparse(url).path)
+        if not filename:
+            filename = hashlib.sha1(url.encode('utf-8')).hexdigest()
+        return os.path.join(self.download_dir, filename)
+
+    def _retryable(self, error):
+        """Decide whether a failed attempt is worth retrying"""
+        if isinstance(error, requests.HTTPError):
+            status = error.response.status_code if error.response is not None else 0
+            return status == 429 or status >= 500
+        return isinstance(error, (requests.ConnectionError, requests.Timeout,
+                                  requests.exceptions.ChunkedEncodingError))
+
+    @staticmethod
+    def _validator(headers):
+        """Strong ETag, else Last-Modified, of a response: what If-Range can compare against"""
+        etag = headers.get('ETag')
+        if etag and not etag.startswith('W/'):  # If-Range only accepts strong ETags
+            return etag
+        return headers.get('Last-Modified')
+
+    @staticmethod
+    def _discard(*paths):
+        """Remove whichever of paths exist"""
+        for path in paths:
+            if os.path.exists(path):
+                os.remove(path)
+
+    def fetch(self, url, path, headers=None):
+        """Stream one URL to path, resuming a partial file with a Range request"""
+        part_path = path + '.part'
+        # Validator of the response the .part file came from, so a resume only appends to the same version
+        validator_path = part_path + '.validator'
+
+        for attempt in range(self.max_retries + 1):
+            offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+            # Conditional headers (If-None-Match / If-Modified-Since) only apply to a fresh download
+            request_headers = {'Range': f'bytes={offset}-'} if offset else dict(headers or {})
+            if offset and os.path.exists(validator_path):
+                with open(validator_path, 'r') as f:
+                    # The server answers 200 with the whole file instead of 206 if the resource changed
+                    request_headers['If-Range'] = f.read()
+            try:
+                with self.session.get(url, headers=request_headers, stream=True, timeout=self.timeout) as response:
+                    if response.status_code == 304:
+                        return response.status_code, response.headers
+                    if response.status_code == 416:
+                        # Nothing past offset: a partial file of exactly the remote size (Content-Range:
+                        # bytes */TOTAL) only missed its rename, so finish it instead of downloading again
+                        total = response.headers.get('Content-Range', '').rpartition('/')[2]
+                        if total.isdigit() and int(total) == offset:
+                            os.replace(part_path, path)
+                            self._discard(validator_path)
+                            return 200, response.headers
+                        # Partial file does not match the remote resource, start over
+                        self._discard(part_path, validator_path)
+                        raise requests.ConnectionError(f"Range not satisfiable for {url}")
+                    response.raise_for_status()
+
+                    # A 200 means the server ignored the Range header or If-Range did not match: start from zero
+                    mode = 'ab' if response.status_code == 206 else 'wb'
+                    if mode == 'wb':
+                        validator = self._validator(response.headers)
+                        if validator:
+                            with open(validator_path, 'w') as f:
+                                f.write(validator)
+                        else:
+                            self._discard(validator_path)
+                    with open(part_path, mode) as f:
+                        for chunk in response.iter_content(chunk_size=self.chunk_size):
+                            f.write(chunk)
+
+                os.replace(part_path, path)
+                self._discard(validator_path)
+                return response.status_code, response.headers
+            except requests.RequestException as e:
+                if attempt == self.max_retries or not self._retryable(e):
+                    raise
+                wait = self.backoff_factor * (2 ** attempt)
+                print(f"Download of {url} failed ({e}). Retrying in {wait:.1f}s...")
+                time.sleep(wait)
+
+    def download(self, url):
+        """Download one URL into download_dir and return its path"""
+        path = self.local_path(url)
+        self.fetch(url, path)
+        return path
+
+    def download_many(self, urls, download_func=None):
+        """Download URLs on a bounded thread pool, returning paths in input order"""
+        download_func = download_func or self.download
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            paths = list(executor.map(download_func, urls))
+        print(f"Downloaded {len(paths)} files in {time.perf_counter() - start:.2f}s "
+              f"with {self.max_workers} workers")
+        return paths
+
+    def close(self):
+        """Release pooled connections"""
+        self.session.close()
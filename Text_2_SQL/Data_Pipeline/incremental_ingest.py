@@ -0,0 +1,178 @@
+import os
+import re
+import json
+import time
+import shutil
+
+import numpy as np
+import pyarrow.parquet as pq
+
+from stream_pipeline import Streaming_Pipeline
+
+
+# Partition files written by Incremental_Ingestor: <resource_id>-<run_id>-<chunk>-<n>.parquet
+RUN_FILE = re.compile(r".+-\d{8}T\d{6}-\d{5}-\d+\.parquet$")
+
+
+class Ingestion_State:
+    """Local watermark file recording which resources and Trip_Id ranges are already loaded"""
+    def __init__(self, state_path='ingestion_state.json'):
+        """Load the state file, or start empty"""
+        self.state_path = state_path
+        self.state = {'resources': {}}
+        if os.path.exists(state_path):
+            with open(state_path, 'r') as f:
+                self.state = json.load(f)
+
+    def resource(self, resource_id):
+        """Return the recorded entry for a resource, or None"""
+        return self.state['resources'].get(resource_id)
+
+    def is_current(self, resource_id, version):
+        """True when the resource was loaded at this version and needs no work"""
+        entry = self.resource(resource_id)
+        return entry is not None and version is not None and entry.get('version') == version
+
+    def trip_id_max(self, resource_id):
+        """Highest Trip_Id already loaded from a resource"""
+        entry = self.resource(resource_id)
+        return entry['trip_id_max'] if entry and entry.get('trip_id_max') is not None else None
+
+    def watermark(self):
+        """Watermark of the whole table: changes whenever any resource is (re)loaded"""
+        versions = sorted((rid, e.get('version'), e.get('rows')) for rid, e in self.state['resources'].items())
+        return json.dumps(versions)
+
+    def record(self, resource_id, url, version, trip_id_min, trip_id_max, rows, files):
+        """Record a successfully loaded resource and persist the state atomically"""
+        entry = self.state['resources'].get(resource_id, {'rows': 0, 'files': []})
+        mins = [v for v in (entry.get('trip_id_min'), trip_id_min) if v is not None]
+        maxs = [v for v in (entry.get('trip_id_max'), trip_id_max) if v is not None]
+        entry.update({'url': url,
+                      'version': version,
+                      'trip_id_min': min(mins) if mins else None,
+                      'trip_id_max': max(maxs) if maxs else None,
+                      'rows': entry['rows'] + rows,
+                      'files': entry['files'] + files,
+                      'loaded_at': time.strftime('%Y-%m-%dT%H:%M:%S')})
+        self.state['resources'][resource_id] = entry
+
+        tmp_path = self.state_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(self.state, f, indent=2)
+        os.replace(tmp_path, self.state_path)
+
+
+class Incremental_Ingestor:
+    """Download and clean only new or changed resources, appending them as monthly partitions"""
+    def __init__(self, api, cleaner, dataset_dir='bike_share_data', state_path='ingestion_state.json',
+                 partition_cols=('month',), chunk_size=250000, table_schema=None):
+        """api is a Get_BikeShareData, cleaner a bike_share_data_clean"""
+        self.api = api
+        self.cleaner = cleaner
+        self.dataset_dir = dataset_dir
+        self.state = Ingestion_State(state_path)
+        self.partition_cols = list(partition_cols)
+        self.chunk_size = chunk_size
+        self.table_schema = table_schema
+        self.metadata_path = os.path.join(dataset_dir, '_common_metadata')
+        # Readers skip '_'-prefixed paths, so half-written runs stay invisible until they are moved in
+        self.staging_dir = os.path.join(dataset_dir, '_staging')
+        os.makedirs(dataset_dir, exist_ok=True)
+        self._recover()
+
+    def _recover(self):
+        """Drop whatever an interrupted run left behind, so the next run can reload it without duplicates"""
+        shutil.rmtree(self.staging_dir, ignore_errors=True)
+        recorded = {f for entry in self.state.state['resources'].values() for f in entry.get('files', [])}
+        removed = 0
+        for directory, subdirs, names in os.walk(self.dataset_dir):
+            for name in names:
+                file_path = os.path.relpath(os.path.join(directory, name), self.dataset_dir)
+                # Only files named by ingest_resource whose run never reached Ingestion_State.record
+                if RUN_FILE.match(name) and file_path not in recorded:
+                    os.remove(os.path.join(directory, name))
+                    removed += 1
+        if removed:
+            print(f"Removed {removed} partition files from interrupted ingestion runs")
+
+    def pending(self, urls):
+        """Return the urls whose resource is new or changed since the last run"""
+        pending = []
+        for url in urls:
+            resource_id = self.api.resource_id(url)
+            if not self.state.is_current(resource_id, self.api.resource_versions.get(url)):
+                pending.append(url)
+        return pending
+
+    def _schema(self, table, pipeline):
+        """Dataset schema fixed by the first chunk ever written and table_schema.json, stored as _common_metadata"""
+        if os.path.exists(self.metadata_path):
+            return pq.read_schema(self.metadata_path)
+        schema = pipeline.writer_schema(table)
+        pq.write_metadata(schema, self.metadata_path)
+        return schema
+
+    def ingest_resource(self, url, path, pipeline):
+        """Append the new rides of one archive to the dataset and record its watermark"""
+        resource_id = self.api.resource_id(url)
+        previous_max = self.state.trip_id_max(resource_id)
+        run_id = time.strftime('%Y%m%dT%H%M%S')
+        staging = os.path.join(self.staging_dir, f"{resource_id}-{run_id}")
+        files = []
+        rows = 0
+        trip_id_min = trip_id_max = None
+
+        for i, chunk in enumerate(pipeline.chunks([path])):
+            if previous_max is not None:
+                # Changed archive (e.g. the current year gained a month): keep only unseen rides
+                chunk = chunk[chunk['Trip_Id'] > previous_max]
+            if chunk.empty:
+                continue
+            with pipeline.profiler.stage('write') as stats:
+                if 'month' in self.partition_cols:
+                    # A directory per day meant hundreds of small files a year; ym_id stays in the files
+                    chunk = chunk.assign(month=chunk['ym_id'].astype(str).str[:7])
+                table = self.cleaner.to_arrow(chunk, self.table_schema)
+                table = pipeline.conform(table, self._schema(table, pipeline))
+
+                def visit(written_file, files=files):
+                    files.append(os.path.relpath(written_file.path, staging))
+
+                pq.write_to_dataset(table, staging, partition_cols=self.partition_cols,
+                                    basename_template=f"{resource_id}-{run_id}-{i:05d}-{{i}}.parquet",
+                                    compression='zstd', file_visitor=visit)
+                stats.rows += len(chunk)
+                stats.bytes_in += table.nbytes
+            ids = chunk['Trip_Id'].dropna().to_numpy(dtype=np.int64)
+            if len(ids):
+                trip_id_min = int(ids.min()) if trip_id_min is None else min(trip_id_min, int(ids.min()))
+                trip_id_max = int(ids.max()) if trip_id_max is None else max(trip_id_max, int(ids.max()))
+            rows += len(chunk)
+
+        # Publish the whole resource, then record it: a crash before record leaves only files _recover removes
+        for file_path in files:
+            os.makedirs(os.path.dirname(os.path.join(self.dataset_dir, file_path)), exist_ok=True)
+            os.replace(os.path.join(staging, file_path), os.path.join(self.dataset_dir, file_path))
+        shutil.rmtree(staging, ignore_errors=True)
+        self.state.record(resource_id, url, self.api.resource_versions.get(url),
+                          trip_id_min, trip_id_max, rows, files)
+        print(f"Ingested {rows} new rows from {resource_id} into {len(files)} partition files")
+        return files
+
+    def run(self, urls):
+        """Ingest every new or changed resource, returning the partition files written"""
+        start = time.perf_counter()
+        pending = self.pending(urls)
+        print(f"{len(pending)} of {len(urls)} resources are new or changed")
+        if not pending:
+            return []
+
+        paths = self.api.api_download(pending)
+        pipeline = Streaming_Pipeline(self.api, self.cleaner, chunk_size=self.chunk_size,
+                                      table_schema=self.table_schema)
+        files = []
+        for url, path in zip(pending, paths):
+            files.extend(self.ingest_resource(url, path, pipeline))
+        print(f"Incremental ingestion finished in {time.perf_counter() - start:.1f}s")
+        return files
@@ -0,0 +1,166 @@
+import os
+import json
+import time
+import cProfile
+import threading
+from contextlib import contextmanager
+
+import psutil
+
+
+class Stage_Stats:
+    """Accumulated measurements for one pipeline stage"""
+    def __init__(self, name):
+        self.name = name
+        self.calls = 0
+        self.wall_s = 0.0
+        self.child_wall_s = 0.0  # time spent in stages nested inside this one
+        self.cpu_s = 0.0
+        self.rows = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.peak_rss = 0
+
+    def to_dict(self):
+        return {'calls': self.calls,
+                'wall_s': round(self.wall_s, 4),
+                'self_wall_s': round(self.wall_s - self.child_wall_s, 4),
+                'cpu_s': round(self.cpu_s, 4),
+                'rows': self.rows,
+                'bytes_in': self.bytes_in,
+                'bytes_out': self.bytes_out,
+                'peak_rss': self.peak_rss}
+
+
+class Run_Profiler:
+    """Per-stage wall/CPU time, rows, bytes and peak RSS, written out as a JSON run report"""
+    def __init__(self, enabled=True, report_dir='run_reports', profile=None, sample_interval=0.05):
+        """profile: None, 'cprofile' or 'pyinstrument' for an optional whole-run profile dump"""
+        self.enabled = enabled
+        self.report_dir = report_dir
+        self.profile = profile
+        self.sample_interval = sample_interval
+        self.stages = {}
+        self.active = []  # stack of (Stage_Stats, start wall) for nested stages
+        self.process = psutil.Process()
+        self.peak_rss = 0
+        self.peak_memory_percent = 0.0  # system-wide, from memory() checkpoints
+        self.started = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._sampler = None
+        self._profiler = None
+
+    def _sample(self):
+        """Record current RSS against the run and every active stage"""
+        rss = self.process.memory_info().rss
+        with self._lock:
+            self.peak_rss = max(self.peak_rss, rss)
+            for stats, _ in self.active:
+                stats.peak_rss = max(stats.peak_rss, rss)
+
+    def _sample_loop(self):
+        while not self._stop.wait(self.sample_interval):
+            self._sample()
+
+    def start(self):
+        """Start the RSS sampler and the optional profiler"""
+        if not self.enabled:
+            return self
+        self.started = time.time()
+        self._start_wall = time.perf_counter()
+        self._sampler = threading.Thread(target=self._sample_loop, daemon=True)
+        self._sampler.start()
+        if self.profile == 'pyinstrument':
+            try:
+                from pyinstrument import Profiler  # optional dependency
+                self._profiler = Profiler()
+            except ImportError:
+                print("pyinstrument is not installed, falling back to cProfile")
+                self.profile = 'cprofile'
+        if self.profile == 'cprofile':
+            self._profiler = cProfile.Profile()
+            self._profiler.enable()
+        elif self.profile == 'pyinstrument':
+            self._profiler.start()
+        return self
+
+    @contextmanager
+    def stage(self, name):
+        """Time a block as one call of a named stage; the yielded stats accept rows/bytes"""
+        if not self.enabled:
+            yield Stage_Stats(name)
+            return
+        stats = self.stages.setdefault(name, Stage_Stats(name))
+        start_wall = time.perf_counter()
+        start_cpu = time.process_time()
+        with self._lock:
+            self.active.append((stats, start_wall))
+        try:
+            yield stats
+        finally:
+            elapsed = time.perf_counter() - start_wall
+            self._sample()
+            with self._lock:
+                self.active.pop()
+                if self.active:
+                    self.active[-1][0].child_wall_s += elapsed
+            stats.calls += 1
+            stats.wall_s += elapsed
+            stats.cpu_s += time.process_time() - start_cpu
+
+    def memory(self, label=None):
+        """System memory snapshot (psutil.virtual_memory) for load decisions; printed with label, kept in the report"""
+        memory = psutil.virtual_memory()
+        if self.enabled:
+            self._sample()
+            with self._lock:
+                self.peak_memory_percent = max(self.peak_memory_percent, memory.percent)
+        if label:
+            print(f"{label}: {memory.percent:.1f}% used, {memory.available / 1024**3:.2f} GB available")
+        return memory
+
+    def iterate(self, name, iterable):
+        """Wrap a generator of DataFrames so each next() counts towards a stage"""
+        iterator = iter(iterable)
+        while True:
+            with self.stage(name) as stats:
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+                stats.rows += len(item)
+                stats.bytes_out += int(item.memory_usage(deep=False).sum()) if hasattr(item, 'memory_usage') else 0
+            yield item
+
+    def report(self):
+        """Return the run report as a dict"""
+        return {'started': time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(self.started)) if self.started else None,
+                'total_wall_s': round(time.perf_counter() - self._start_wall, 4) if self.started else None,
+                'peak_rss': self.peak_rss,
+                'peak_memory_percent': self.peak_memory_percent,
+                'stages': {name: stats.to_dict() for name, stats in self.stages.items()}}
+
+    def stop(self):
+        """Stop sampling, write the JSON report (and profile dump) and return the report path"""
+        if not self.enabled or self.started is None:
+            return None
+        self._stop.set()
+        self._sampler.join()
+        self._sample()
+
+        os.makedirs(self.report_dir, exist_ok=True)
+        stamp = time.strftime('%Y%m%dT%H%M%S', time.localtime(self.started))
+        report_path = os.path.join(self.report_dir, f'run_{stamp}.json')
+        with open(report_path, 'w') as f:
+            json.dump(self.report(), f, indent=2)
+        print(f"Run report written to {report_path}")
+
+        if self.profile == 'cprofile':
+            self._profiler.disable()
+            self._profiler.dump_stats(os.path.join(self.report_dir, f'run_{stamp}.prof'))
+        elif self.profile == 'pyinstrument':
+            self._profiler.stop()
+            with open(os.path.join(self.report_dir, f'run_{stamp}.html'), 'w') as f:
+                f.write(self._profiler.output_html())
+        return report_path
@@ -0,0 +1,246 @@
+import io
+import os
+import json
+import time
+import shutil
+import hashlib
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+from synthetic_data import make_stations
+
+
+class Local_File_Server:
+    """Local HTTP stand-in for the CKAN file host with latency, throttling and Range support"""
+    def __init__(self, files, latency=0.0, bytes_per_sec=None, fail_first_after=None):
+        """files maps URL paths (e.g. '/2023.zip') to their bytes or to a local file path"""
+        self.files = files
+        self.latency = latency
+        self.bytes_per_sec = bytes_per_sec
+        self.fail_first_after = fail_first_after  # drop the first response for each path after n bytes
+        self.failed_paths = set()
+        self.requests = []
+        self.lock = threading.Lock()
+        self.server = None
+        self.thread = None
+
+    def _lookup(self, path):
+        """Return the body served at a request path, matching without the query string as a fallback"""
+        body = self.files.get(path)
+        if body is None:
+            body = self.files.get(path.split('?')[0])
+        return body
+
+    @staticmethod
+    def _etag(body):
+        if isinstance(body, bytes):
+            return '"' + hashlib.sha1(body).hexdigest() + '"'
+        stat = os.stat(body)
+        return f'"{stat.st_size:x}-{int(stat.st_mtime_ns):x}"'
+
+    def _handler(self):
+        """Build the request handler bound to this server's state"""
+        owner = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, format, *args):
+                pass
+
+            def do_GET(self):
+                body = owner._lookup(self.path)
+                with owner.lock:
+                    owner.requests.append((self.path, self.headers.get('Range')))
+                time.sleep(owner.latency)
+                if body is None:
+                    self.send_error(404)
+                    return
+
+                etag = owner._etag(body)
+                if self.headers.get('If-None-Match') == etag:
+                    self.send_response(304)
+                    self.send_header('ETag', etag)
+                    self.send_header('Content-Length', '0')
+                    self.end_headers()
+                    return
+
+                size = len(body) if isinstance(body, bytes) else os.path.getsize(body)
+                start = 0
+                status = 200
+                range_header = self.headers.get('Range')
+                if_range = self.headers.get('If-Range')
+                if range_header and if_range is not None and if_range != etag:
+                    range_header = None  # changed since the partial download: send the whole file
+                if range_header:
+                    start = int(range_header.split('=')[1].split('-')[0])
+                    if start >= size:
+                        self.send_response(416)
+                        self.send_header('Content-Range', f'bytes */{size}')
+                        self.send_header('ETag', etag)
+                        self.send_header('Content-Length', '0')
+                        self.end_headers()
+                        return
+                    status = 206
+
+                self.send_response(status)
+                self.send_header('Content-Length', str(size - start))
+                self.send_header('Accept-Ranges', 'bytes')
+                self.send_header('ETag', etag)
+                if status == 206:
+                    self.send_header('Content-Range', f'bytes {start}-{size - 1}/{size}')
+                self.end_headers()
+
+                with owner.lock:
+                    fail = owner.fail_first_after is not None and self.path not in owner.failed_paths
+                    if fail:
+                        owner.failed_paths.add(self.path)
+                limit = start + owner.fail_first_after if fail else size
+
+                # Files on disk are streamed so multi-GB archives are never held in memory
+                step = 64 * 1024
+                source = None if isinstance(body, bytes) else open(body, 'rb')
+                try:
+                    if source:
+                        source.seek(start)
+                    position = start
+                    while position < limit:
+                        n = min(step, limit - position)
+                        block = body[position:position + n] if source is None else source.read(n)
+                        if not block:
+                            break
+                        self.wfile.write(block)
+                        position += len(block)
+                        if owner.bytes_per_sec:
+                            time.sleep(len(block) / owner.bytes_per_sec)
+                finally:
+                    if source:
+                        source.close()
+                if fail:
+                    # Simulate a dropped connection part way through the body
+                    self.close_connection = True
+
+        return Handler
+
+    def url(self, path):
+        """Return the full URL of a served path"""
+        host, port = self.server.server_address
+        return f"http://{host}:{port}{path}"
+
+    def __enter__(self):
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), self._handler())
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class Local_Open_Data_Server(Local_File_Server):
+    """Local stand-in for the CKAN package/resource API, its archive host and the GBFS station feed"""
+    package_id = 'bike-share-toronto-ridership-data'
+    station_path = '/ube/gbfs/v1/en/station_information'
+
+    def __init__(self, archives, stations=None, **kwargs):
+        """archives maps file names (e.g. 'bikeshare-ridership-2023.zip') to local paths"""
+        super().__init__({}, **kwargs)
+        self.archives = dict(archives)
+        self.stations = stations or make_stations()
+
+    def publish(self, archives=None, version='v1'):
+        """(Re)build the CKAN responses for the given archives, bumping last_modified to version"""
+        if archives is not None:
+            self.archives = dict(archives)
+        resources = []
+        for name, path in self.archives.items():
+            resource_id = name.replace('.zip', '')
+            resource = {'id': resource_id,
+                        'name': name,
+                        'datastore_active': False,
+                        'last_modified': version,
+                        'url': self.url(f'/dataset/{self.package_id}/resource/{resource_id}/download/{name}')}
+            resources.append(resource)
+            self.files[f'/dataset/{self.package_id}/resource/{resource_id}/download/{name}'] = path
+            self.files[f'/api/3/action/resource_show?id={resource_id}'] = json.dumps(
+                {'success': True, 'result': resource}).encode()
+        # A datastore resource, which discovery must skip
+        resources.append({'id': 'datastore', 'name': 'readme', 'datastore_active': True, 'last_modified': version})
+        self.files['/api/3/action/package_show'] = json.dumps(
+            {'success': True, 'result': {'name': self.package_id, 'resources': resources}}).encode()
+        self.files[self.station_path] = json.dumps(self.stations).encode()
+        return self
+
+    @property
+    def base_url(self):
+        return self.url('')
+
+    @property
+    def station_url(self):
+        return self.url(self.station_path)
+
+    def __enter__(self):
+        super().__enter__()
+        return self.publish()
+
+
+class Local_Object_Store:
+    """Directory-backed stand-in for the boto3 S3 client and the google.cloud.storage Client"""
+    def __init__(self, root):
+        self.root = root
+        self.bytes_written = 0
+        self.objects = []
+
+    def _path(self, bucket, key):
+        path = os.path.join(self.root, bucket or 'default', key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        return path
+
+    def _written(self, path):
+        self.bytes_written += os.path.getsize(path)
+        self.objects.append(os.path.relpath(path, self.root))
+
+    # S3 client interface
+    def upload_file(self, Filename, Bucket, Key):
+        path = self._path(Bucket, Key)
+        shutil.copyfile(Filename, path)
+        self._written(path)
+
+    def upload_fileobj(self, Fileobj, Bucket, Key):
+        path = self._path(Bucket, Key)
+        with open(path, 'wb') as f:
+            shutil.copyfileobj(Fileobj, f)
+        self._written(path)
+
+    # GCS client interface
+    def bucket(self, name):
+        return Local_Bucket(self, name)
+
+
+class Local_Bucket:
+    """Bucket handle returned by Local_Object_Store.bucket"""
+    def __init__(self, store, name):
+        self.store = store
+        self.name = name
+
+    def blob(self, key):
+        return Local_Blob(self, key)
+
+
+class Local_Blob:
+    """Blob handle writing into the object store directory"""
+    def __init__(self, bucket, key):
+        self.bucket = bucket
+        self.name = key
+
+    def upload_from_filename(self, filename, content_type=None):
+        self.bucket.store.upload_file(filename, self.bucket.name, self.name)
+
+    def upload_from_file(self, file_obj, content_type=None):
+        self.bucket.store.upload_fileobj(file_obj, self.bucket.name, self.name)
+
+    def upload_from_string(self, data, content_type=None):
+        self.bucket.store.upload_fileobj(io.BytesIO(data.encode() if isinstance(data, str) else data),
+                                         self.bucket.name, self.name)
@@ -0,0 +1,104 @@
+import os
+import shutil
+import tempfile
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+import pyarrow as pa
+
+
+def mixed_columns(df):
+    """Object columns holding more than one type of value, e.g. ints in one read_csv block and strings in the next"""
+    return [name for name in df.columns
+            if df[name].dtype == object and pd.api.types.infer_dtype(df[name], skipna=True) not in ('string', 'empty')]
+
+
+def _text_conflicts(tables):
+    """Columns parsed as text in one member and as another type in a different member (e.g. ids vs 'unknown')"""
+    types = {}
+    for table in tables:
+        for field in table.schema:
+            types.setdefault(field.name, set()).add(field.type)
+    text = {pa.string(), pa.large_string()}
+    return {name for name, found in types.items() if found & text and found - text - {pa.null()}}
+
+
+def parse_member(zip_path, member, out_path):
+    """Parse one zip member in a worker process and write it as an Arrow IPC file
+
+    Members with mixed-type columns cannot be one Arrow type per column without changing their values,
+    so they are pickled as the DataFrame read_csv returned; the path written is returned either way.
+    """
+    with zipfile.ZipFile(zip_path) as zip_file:
+        with zip_file.open(member) as f:
+            # Same parser and options as the serial loader so the output matches exactly
+            df = pd.read_csv(f, encoding='cp1252')
+    if mixed_columns(df):
+        out_path = os.path.splitext(out_path)[0] + '.pkl'
+        df.to_pickle(out_path)
+        return out_path
+    table = pa.Table.from_pandas(df, preserve_index=False)
+
+    with pa.OSFile(out_path, 'wb') as sink:
+        with pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+    return out_path
+
+
+class Parallel_Loader:
+    """Parse the monthly CSVs of a ridership zip on a process pool"""
+    def __init__(self, max_workers=None, tmp_dir=None):
+        """max_workers defaults to the number of cores"""
+        self.max_workers = max_workers or os.cpu_count()
+        self.tmp_dir = tmp_dir
+
+    def load_tables(self, zip_path):
+        """Return one memory-mapped Arrow table per member, in archive order
+
+        Members with mixed-type columns come back as the DataFrame read_csv produced instead.
+        """
+        with zipfile.ZipFile(zip_path) as zip_file:
+            members = [name for name in zip_file.namelist() if not name.endswith('/')]
+
+        out_dir = tempfile.mkdtemp(prefix='bikeshare_arrow_', dir=self.tmp_dir)
+        try:
+            with ProcessPoolExecutor(max_workers=self.max_workers) as executor:
+                # executor.map keeps results in submission order, so output is deterministic
+                paths = list(executor.map(parse_member,
+                                          [zip_path] * len(members),
+                                          members,
+                                          [os.path.join(out_dir, f'{i:04d}.arrow') for i in range(len(members))]))
+            # Workers hand back file paths; the tables are mapped, not unpickled
+            tables = [pd.read_pickle(path) if path.endswith('.pkl')
+                      else pa.ipc.open_file(pa.memory_map(path, 'r')).read_all() for path in paths]
+        except Exception:
+            shutil.rmtree(out_dir, ignore_errors=True)
+            raise
+        self.out_dir = out_dir
+        return tables
+
+    def load(self, zip_path):
+        """Return the whole archive as one DataFrame, matching the serial loader"""
+        tables = self.load_tables(zip_path)
+        try:
+            if not tables:
+                return pd.DataFrame()
+            if any(isinstance(table, pd.DataFrame) for table in tables) or _text_conflicts(tables):
+                # Mixed types within or across members: pd.concat keeps each value as the serial loader does
+                return pd.concat([table if isinstance(table, pd.DataFrame) else table.to_pandas() for table in tables],
+                                 ignore_index=True)
+            # One Arrow concat over the mapped files and one conversion, instead of a DataFrame per member
+            # plus pd.concat copying them all again; missing columns (the BOM-mangled Trip Id) become nulls
+            table = pa.concat_tables(tables, promote_options='permissive')
+            return table.to_pandas(split_blocks=True, self_destruct=True)
+        finally:
+            del tables
+            self.cleanup()
+
+    def cleanup(self):
+        """Remove the Arrow files written by the last load"""
+        out_dir = getattr(self, 'out_dir', None)
+        if out_dir:
+            shutil.rmtree(out_dir, ignore_errors=True)
+            self.out_dir = None
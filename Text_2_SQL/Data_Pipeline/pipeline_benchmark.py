@@ -0,0 +1,554 @@
+import os
+import time
+import io
+import shutil
+import argparse
+import tempfile
+import tracemalloc
+import warnings
+import multiprocessing
+import zipfile
+
+import pandas as pd
+import pyarrow.parquet as pq
+
+from download_engine import Download_Engine
+from resource_cache import Resource_Cache
+from bikeshare_data_processor import Get_BikeShareData, run_streaming, run_incremental
+from data_cleaning import bike_share_data_clean
+from stream_pipeline import Streaming_Pipeline
+from parallel_loader import Parallel_Loader
+from incremental_ingest import Incremental_Ingestor
+from instrumentation import Run_Profiler
+from synthetic_data import make_payloads, write_synthetic_archive, write_synthetic_years
+from local_services import Local_File_Server, Local_Open_Data_Server, Local_Object_Store
+
+def benchmark_download(n_files=8, size_mb=4, latency=0.2, bytes_per_sec=20 * 1024 * 1024, workers=(1, 4, 8)):
+    """Compare serial and parallel wall time of Download_Engine against a local server"""
+    files = make_payloads(n_files, size_mb)
+    results = {}
+    with Local_File_Server(files, latency=latency, bytes_per_sec=bytes_per_sec) as server:
+        urls = [server.url(path) for path in files]
+        for n in workers:
+            download_dir = tempfile.mkdtemp(prefix='bikeshare_bench_')
+            engine = Download_Engine(download_dir=download_dir, max_workers=n)
+            start = time.perf_counter()
+            paths = engine.download_many(urls)
+            elapsed = time.perf_counter() - start
+            engine.close()
+
+            for path, body in zip(paths, files.values()):
+                with open(path, 'rb') as f:
+                    assert f.read() == body, f"Downloaded bytes differ for {path}"
+            shutil.rmtree(download_dir)
+
+            results[n] = elapsed
+            print(f"workers={n}: {elapsed:.2f}s ({n_files * size_mb / elapsed:.1f} MB/s)")
+
+    print(f"Parallel speed-up vs serial: {results[workers[0]] / results[workers[-1]]:.1f}x")
+    return results
+
+
+def check_download_resume(size_mb=2):
+    """Verify an interrupted download resumes with a Range request and matches the source"""
+    files = make_payloads(1, size_mb)
+    path, body = next(iter(files.items()))
+    download_dir = tempfile.mkdtemp(prefix='bikeshare_resume_')
+    with Local_File_Server(files, fail_first_after=len(body) // 3) as server:
+        engine = Download_Engine(download_dir=download_dir, max_workers=1,
+                                 chunk_size=64 * 1024, backoff_factor=0.01)
+        local = engine.download(server.url(path))
+        engine.close()
+        with open(local, 'rb') as f:
+            assert f.read() == body, "Resumed download does not match the source"
+        ranges = [r for p, r in server.requests if r]
+        assert ranges, "Second attempt did not send a Range header"
+
+        # A complete .part left by a crash before its rename is finished from the 416, not downloaded again
+        resumed = list(server.requests)
+        os.rename(local, local + '.part')
+        server.requests.clear()
+        engine = Download_Engine(download_dir=download_dir, max_workers=1)
+        engine.download(server.url(path))
+        with open(local, 'rb') as f:
+            assert f.read() == body, "Completed .part file does not match the source"
+        assert len(server.requests) == 1 and not os.path.exists(local + '.part'), server.requests
+        # An oversized .part (the file shrank upstream) is still discarded and downloaded in full
+        with open(local + '.part', 'wb') as f:
+            f.write(body + b'stale')
+        engine.download(server.url(path))
+        with open(local, 'rb') as f:
+            assert f.read() == body, "Oversized .part file was not replaced"
+        # A .part of an older version of the file (its ETag no longer matches) is restarted, not appended to
+        stale = make_payloads(1, size_mb, seed=7)[path]
+        with open(local + '.part', 'wb') as f:
+            f.write(stale[:len(stale) // 3])
+        with open(local + '.part.validator', 'w') as f:
+            f.write(Local_File_Server._etag(stale))
+        engine.download(server.url(path))
+        engine.close()
+        with open(local, 'rb') as f:
+            assert f.read() == body, "Resume appended to a .part file of another version"
+        assert not os.path.exists(local + '.part.validator')
+    shutil.rmtree(download_dir)
+    print(f"Resume check passed (requests: {resumed})")
+
+
+def check_cache_revalidation(n_files=3, size_mb=1):
+    """Verify a second run revalidates every archive with a 304 and moves no body bytes"""
+    files = make_payloads(n_files, size_mb)
+    work_dir = tempfile.mkdtemp(prefix='bikeshare_cache_')
+    with Local_File_Server(files) as server:
+        urls = [server.url(path) for path in files]
+        for run in range(2):
+            engine = Download_Engine(download_dir=os.path.join(work_dir, 'downloads'), max_workers=2)
+            cache = Resource_Cache(cache_dir=os.path.join(work_dir, 'cache'))
+            paths = engine.download_many(urls, download_func=lambda url: cache.get_file(engine, url, url))
+            engine.close()
+            for path, body in zip(paths, files.values()):
+                with open(path, 'rb') as f:
+                    assert f.read() == body, f"Cached bytes differ for {path}"
+            stats = cache.stats()
+        assert stats['hits'] == n_files and stats['bytes_downloaded'] == 0, "Second run was not served from cache"
+
+        # Blobs evicted while their 304 is in flight: the body is fetched again instead of failing
+        engine = Download_Engine(download_dir=os.path.join(work_dir, 'downloads'), max_workers=2)
+        fetch = engine.fetch
+
+        def fetch_after_eviction(url, path, headers=None):
+            if headers:
+                os.remove(cache._blob_path(cache.index[url]['sha256']))
+            return fetch(url, path, headers=headers)
+
+        engine.fetch = fetch_after_eviction
+        for url, body in zip(urls, files.values()):
+            with open(cache.get_file(engine, url, url), 'rb') as f:
+                assert f.read() == body, f"Refetched bytes differ for {url}"
+        engine.close()
+    shutil.rmtree(work_dir)
+    print("Cache revalidation check passed")
+
+
+def _load_concat(path, chunk_size):
+    """Whole-archive loader: every member parsed and concatenated at once"""
+    with zipfile.ZipFile(path) as zip_file:
+        return len(pd.concat([pd.read_csv(zip_file.open(name), encoding='cp1252')
+                              for name in zip_file.namelist()], ignore_index=True))
+
+
+def _load_stream(path, chunk_size):
+    """Streaming loader: one chunk alive at a time"""
+    api = Get_BikeShareData(download_dir=os.path.join(os.path.dirname(path), 'downloads'), cache_dir=None)
+    return sum(len(chunk) for chunk in api.stream_data([path], chunk_size=chunk_size))
+
+
+def _measure_loader(loader, path, chunk_size):
+    """Run a loader in a fresh process and return rows, peak traced bytes and peak RSS growth"""
+    import resource
+    baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    tracemalloc.start()
+    rows = loader(path, chunk_size)
+    traced_peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    rss_peak = (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - baseline) * 1024  # ru_maxrss is KB on Linux
+    return rows, traced_peak, rss_peak
+
+
+def benchmark_load_memory(rows_per_member=2000000, members=12, chunk_size=50000):
+    """Compare peak memory of the whole-archive loader and the streaming loader"""
+    work_dir = tempfile.mkdtemp(prefix='bikeshare_memory_')
+    path = write_synthetic_archive(os.path.join(work_dir, 'ridership-2023.zip'),
+                                   rows_per_member=rows_per_member, members=members)
+    with zipfile.ZipFile(path) as zip_file:
+        raw_bytes = sum(info.file_size for info in zip_file.infolist())
+    print(f"Synthetic archive: {os.path.getsize(path) / 1024**2:.1f} MB compressed, "
+          f"{raw_bytes / 1024**2:.1f} MB of CSV, {rows_per_member * members} rows")
+
+    results = {}
+    ctx = multiprocessing.get_context('spawn')
+    for name, loader in [('concat', _load_concat), ('stream', _load_stream)]:
+        # Separate processes so one loader's peak cannot mask the other's
+        with ctx.Pool(1) as pool:
+            rows, traced_peak, rss_peak = pool.apply(_measure_loader, (loader, path, chunk_size))
+        results[name] = {'rows': rows, 'traced_peak': traced_peak, 'rss_peak': rss_peak}
+        print(f"{name}: {rows} rows, traced peak {traced_peak / 1024**2:.1f} MB, "
+              f"RSS growth {rss_peak / 1024**2:.1f} MB")
+
+    assert results['concat']['rows'] == results['stream']['rows'], "Loaders returned different row counts"
+    shutil.rmtree(work_dir)
+    return results
+
+
+def load_synthetic_year(rows_per_member=400000, members=12, work_dir=None):
+    """Generate a synthetic year and return it loaded and cleaned"""
+    work_dir = work_dir or tempfile.mkdtemp(prefix='bikeshare_year_')
+    path = write_synthetic_archive(os.path.join(work_dir, 'ridership-2023.zip'),
+                                   rows_per_member=rows_per_member, members=members)
+    api = Get_BikeShareData(download_dir=os.path.join(work_dir, 'downloads'), cache_dir=None)
+    cleaner = bike_share_data_clean(bucket_name=None, df=None)
+    raw = pd.concat(api.stream_data([path]), ignore_index=True)
+    return api, cleaner, cleaner.clean_data(raw)
+
+
+def benchmark_output_formats(rows_per_member=400000, members=12):
+    """Compare write time, read time and size of CSV and zstd Parquet for a cleaned year"""
+    work_dir = tempfile.mkdtemp(prefix='bikeshare_formats_')
+    api, cleaner, data = load_synthetic_year(rows_per_member, members, work_dir=work_dir)
+    table_schema = api.load_schema()
+    shutil.rmtree(work_dir)
+
+    results = {}
+    start = time.perf_counter()
+    csv_bytes = data.to_csv(index=False).encode('utf-8')
+    write_time = time.perf_counter() - start
+    start = time.perf_counter()
+    pd.read_csv(io.BytesIO(csv_bytes))
+    results['csv'] = {'write_s': write_time, 'read_s': time.perf_counter() - start, 'bytes': len(csv_bytes)}
+
+    start = time.perf_counter()
+    buffer = cleaner.to_parquet_buffer(data, table_schema)
+    write_time = time.perf_counter() - start
+    start = time.perf_counter()
+    pd.read_parquet(buffer)
+    results['parquet'] = {'write_s': write_time, 'read_s': time.perf_counter() - start,
+                          'bytes': buffer.getbuffer().nbytes}
+
+    for name, r in results.items():
+        print(f"{name}: {len(data)} rows, write {r['write_s']:.2f}s, read {r['read_s']:.2f}s, "
+              f"{r['bytes'] / 1024**2:.1f} MB")
+    return results
+
+
+def legacy_clean_data(df):
+    """Row-wise clean_data implementation kept as the benchmark baseline"""
+    df = df.drop_duplicates()
+    for col in df.select_dtypes(include=['object', 'string']).columns:
+        df[col] = df[col].str.strip().str.lower()
+    df['Trip Id'] = df['Trip Id'].fillna(value=df['ï»¿Trip Id'])
+    df['Trip Id'] = [int(i) for i in df['Trip Id']]
+    df = df.drop(columns=['ï»¿Trip Id'])
+    df['Start Time'] = pd.to_datetime(df['Start Time'], format="%m/%d/%Y %H:%M")
+    df['End Time'] = pd.to_datetime(df['End Time'], format="%m/%d/%Y %H:%M")
+    df['ym_id'] = df['Start Time'].dt.strftime('%Y-%m-%d')
+    df['End Station Id'] = df['End Station Id'].fillna(9999).astype(int)
+    df['Start Station Id'] = df['Start Station Id'].fillna(9999)
+    return df
+
+
+def _time_cleaner(clean, raw):
+    """Run one cleaner on a copy of raw, returning the result, seconds and traced peak bytes"""
+    df = raw.copy()
+    tracemalloc.start()
+    start = time.perf_counter()
+    cleaned = clean(df)
+    elapsed = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return cleaned, elapsed, peak
+
+
+def benchmark_clean_data(rows_per_member=400000, members=12):
+    """Report rows/sec and peak memory of the legacy and vectorized clean_data"""
+    work_dir = tempfile.mkdtemp(prefix='bikeshare_clean_')
+    path = write_synthetic_archive(os.path.join(work_dir, 'ridership-2023.zip'),
+                                   rows_per_member=rows_per_member, members=members)
+    api = Get_BikeShareData(download_dir=os.path.join(work_dir, 'downloads'), cache_dir=None)
+    cleaner = bike_share_data_clean(bucket_name=None, df=None)
+    raw = pd.concat(api.stream_data([path]), ignore_index=True)
+    shutil.rmtree(work_dir)
+
+    # The caller's frame is left as it was, with and without duplicates to drop
+    for sample in [raw.head(10000), pd.concat([raw.head(5000), raw.head(5000)])]:
+        before = sample.copy()
+        cleaner.clean_data(sample)
+        pd.testing.assert_frame_equal(sample, before)
+    duplicated = pd.concat([raw.head(5000), raw.head(2000)], ignore_index=True)
+    assert len(cleaner.clean_data(duplicated)) == len(legacy_clean_data(duplicated.copy())) == 5000
+
+    results = {}
+    legacy, results['legacy_s'], results['legacy_peak'] = _time_cleaner(legacy_clean_data, raw)
+    cleaned, results['vectorized_s'], results['vectorized_peak'] = _time_cleaner(cleaner.clean_data, raw)
+
+    # Same rides, same values
+    assert len(legacy) == len(cleaned), "Vectorized clean_data changed the row count"
+    assert (legacy['Trip Id'].to_numpy() == cleaned['Trip_Id'].to_numpy()).all()
+    assert (legacy['ym_id'].to_numpy() == cleaned['ym_id'].astype(str).to_numpy()).all()
+    assert (legacy['Start Station Name'].to_numpy() == cleaned['Start_Station_Name'].astype(str).to_numpy()).all()
+    assert (legacy['End Time'].to_numpy() == cleaned['End_Time'].to_numpy()).all()
+
+    for name in ['legacy', 'vectorized']:
+        print(f"{name}: {len(raw) / results[name + '_s']:,.0f} rows/sec, "
+              f"peak {results[name + '_peak'] / 1024**2:.1f} MB")
+    print(f"Speed-up: {results['legacy_s'] / results['vectorized_s']:.1f}x")
+    return results
+
+
+def benchmark_streaming_pipeline(rows_per_member=400000, members=12, years=2, chunk_size=100000):
+    """Run the chunk-wise pipeline over several synthetic years and report throughput and peak memory"""
+    work_dir = tempfile.mkdtemp(prefix='bikeshare_stream_')
+    paths = [write_synthetic_archive(os.path.join(work_dir, f'ridership-{year}.zip'),
+                                     rows_per_member=rows_per_member, members=members, seed=year,
+                                     first_trip_id=10000000 + year * rows_per_member * members)
+             for year in range(years)]
+    # Re-publishing the first year must not duplicate rides across chunks
+    paths.append(paths[0])
+
+    api = Get_BikeShareData(download_dir=os.path.join(work_dir, 'downloads'), cache_dir=None)
+    cleaner = bike_share_data_clean(bucket_name=None, df=None)
+    pipeline = Streaming_Pipeline(api, cleaner, output_path=os.path.join(work_dir, 'bike_share_data.parquet'),
+                                  chunk_size=chunk_size, table_schema=api.load_schema())
+    tracemalloc.start()
+    pipeline.run(paths)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    written = pd.read_parquet(pipeline.output_path, columns=['Trip_Id'])['Trip_Id']
+    assert written.is_unique, "Streaming pipeline wrote duplicate Trip_Ids"
+    rows = pipeline.stats['rows_written']
+    print(f"streaming: {rows} rows, {rows / pipeline.stats['seconds']:,.0f} rows/sec, "
+          f"peak {peak / 1024**2:.1f} MB with chunk_size={chunk_size}")
+    shutil.rmtree(work_dir)
+    return pipeline.stats
+
+
+def _with_column(path, target, name, value):
+    """Copy a synthetic archive with one more CSV column, as when the open data portal adds a field"""
+    with zipfile.ZipFile(path) as source, zipfile.ZipFile(target, 'w', compression=zipfile.ZIP_DEFLATED) as zf:
+        for info in source.infolist():
+            df = pd.read_csv(source.open(info), encoding='cp1252')
+            df[name] = value
+            zf.writestr(info.filename, df.to_csv(index=False).encode('cp1252'))
+    return target
+
+
+def check_schema_drift(rows_per_member=2000, members=2):
+    """A column that first appears in a later archive is written if declared, and refused if not"""
+    work_dir = tempfile.mkdtemp(prefix='bikeshare_drift_')
+    first = write_synthetic_archive(os.path.join(work_dir, 'ridership-2022.zip'), rows_per_member=rows_per_member,
+                                    members=members, year=2022)
+    second = _with_column(write_synthetic_archive(os.path.join(work_dir, 'plain-2023.zip'),
+                                                  rows_per_member=rows_per_member, members=members, year=2023,
+                                                  first_trip_id=20000000),
+                          os.path.join(work_dir, 'ridership-2023.zip'), 'Model', 'ICONIC')
+    undeclared = _with_column(second, os.path.join(work_dir, 'ridership-2024.zip'), 'Colour', 'green')
+
+    api = Get_BikeShareData(download_dir=os.path.join(work_dir, 'downloads'), cache_dir=None)
+    cleaner = bike_share_data_clean(bucket_name=None, df=None)
+    pipeline = Streaming_Pipeline(api, cleaner, output_path=os.path.join(work_dir, 'bike_share_data.parquet'),
+                                  chunk_size=rows_per_member, table_schema=api.load_schema())
+    pipeline.run([first, second])
+    models = pd.read_parquet(pipeline.output_path, columns=['Model'])['Model']
+    assert models.isna().sum() == rows_per_member * members, "Archive without Model should be written as nulls"
+    assert (models.dropna() == 'iconic').sum() == rows_per_member * members, "Model values were dropped"
+
+    pipeline = Streaming_Pipeline(api, cleaner, output_path=os.path.join(work_dir, 'undeclared.parquet'),
+                                  chunk_size=rows_per_member, table_schema=api.load_schema())
+    try:
+        pipeline.run([first, undeclared])
+    except ValueError as e:
+        assert 'Colour' in str(e)
+    else:
+        raise AssertionError("An undeclared column was dropped instead of refused")
+    print("Schema drift check passed")
+    shutil.rmtree(work_dir)
+
+
+def benchmark_parallel_parse(rows_per_member=200000, members=12, workers=(1, 2, 4, 8)):
+    """Core-scaling benchmark of Parallel_Loader against the serial loader"""
+    work_dir = tempfile.mkdtemp(prefix='bikeshare_parallel_')
+    path = write_synthetic_archive(os.path.join(work_dir, 'ridership-2023.zip'),
+                                   rows_per_member=rows_per_member, members=members)
+
+    start = time.perf_counter()
+    serial = _load_serial(path)
+    results = {'serial': time.perf_counter() - start}
+    print(f"serial: {results['serial']:.2f}s")
+
+    for n in workers:
+        start = time.perf_counter()
+        parallel = Parallel_Loader(max_workers=n, tmp_dir=work_dir).load(path)
+        results[n] = time.perf_counter() - start
+        pd.testing.assert_frame_equal(serial, parallel)
+        print(f"workers={n}: {results[n]:.2f}s ({results['serial'] / results[n]:.1f}x)")
+
+    shutil.rmtree(work_dir)
+    return results
+
+
+def check_parallel_mixed_types(rows_per_member=200000, members=3):
+    """Parallel_Loader matches the serial loader when a column mixes ids and text within or across members"""
+    work_dir = tempfile.mkdtemp(prefix='bikeshare_mixed_')
+    path = write_synthetic_archive(os.path.join(work_dir, 'ridership-2023.zip'),
+                                   rows_per_member=rows_per_member, members=members)
+    mixed = os.path.join(work_dir, 'mixed-2023.zip')
+    with zipfile.ZipFile(path) as source, zipfile.ZipFile(mixed, 'w', compression=zipfile.ZIP_DEFLATED) as zf:
+        for i, info in enumerate(source.infolist()):
+            df = pd.read_csv(source.open(info), encoding='cp1252')
+            if i == 0:
+                # Text late in a member: read_csv parses ints in early blocks and strings in later ones
+                df['Bike Id'] = df['Bike Id'].astype(object)
+                df.loc[len(df) - 10:, 'Bike Id'] = 'unknown'
+            elif i == 1:
+                # A whole member of text ids next to members of int ids
+                df['End Station Id'] = 'station-' + df['End Station Id'].astype(str)
+            zf.writestr(info.filename, df.to_csv(index=False).encode('cp1252'))
+
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', pd.errors.DtypeWarning)
+        serial = _load_serial(mixed)
+        parallel = Parallel_Loader(max_workers=2, tmp_dir=work_dir).load(mixed)
+    pd.testing.assert_frame_equal(serial, parallel)
+    print("Parallel loader mixed-type check passed")
+    shutil.rmtree(work_dir)
+
+
+def _load_serial(path):
+    """The serial data_load path: every member parsed in turn on one core"""
+    with zipfile.ZipFile(path) as zip_file:
+        return pd.concat([pd.read_csv(zip_file.open(name), encoding='cp1252')
+                          for name in zip_file.namelist()], ignore_index=True)
+
+
+def benchmark_incremental_ingest(rows_per_member=100000, members=12, years=3):
+    """Show nightly runtime staying flat: each run only processes the year that was added or changed"""
+    work_dir = tempfile.mkdtemp(prefix='bikeshare_incremental_')
+    files = {}
+    for year in range(years):
+        path = write_synthetic_archive(os.path.join(work_dir, f'ridership-{year}.zip'),
+                                       rows_per_member=rows_per_member, members=members, seed=year,
+                                       first_trip_id=10000000 + year * rows_per_member * members)
+        with open(path, 'rb') as f:
+            files[f'/bikeshare-ridership-{2020 + year}.zip'] = f.read()
+
+    api = Get_BikeShareData(download_dir=os.path.join(work_dir, 'downloads'), cache_dir=None)
+    cleaner = bike_share_data_clean(bucket_name=None, df=None)
+    dataset_dir = os.path.join(work_dir, 'bike_share_data')
+    timings = []
+    with Local_File_Server(files) as server:
+        published = []
+        for run, path in enumerate(list(files) + [None]):
+            if path is not None:
+                published.append(path)  # one new year appears before each nightly run
+            urls = [server.url(p) for p in published]
+            for i, (url, p) in enumerate(zip(urls, published)):
+                if i < years - 1:  # the last year has no CKAN id, as for archives listed outside the package
+                    api.resource_ids[url] = p.strip('/').replace('.zip', '')
+                api.resource_versions[url] = 'v1'
+
+            ingestor = Incremental_Ingestor(api, cleaner, dataset_dir=dataset_dir,
+                                            state_path=os.path.join(work_dir, 'ingestion_state.json'),
+                                            table_schema=api.load_schema())
+            if run == 0:
+                # Crash after every chunk is written but before the watermark is saved; the rerun must not
+                # append those rides a second time
+                def crash(*args, **kwargs):
+                    raise RuntimeError("simulated crash")
+                ingestor.state.record = crash
+                try:
+                    ingestor.run(urls)
+                except RuntimeError:
+                    pass
+                ingestor = Incremental_Ingestor(api, cleaner, dataset_dir=dataset_dir,
+                                                state_path=os.path.join(work_dir, 'ingestion_state.json'),
+                                                table_schema=api.load_schema())
+            start = time.perf_counter()
+            ingestor.run(urls)
+            timings.append(time.perf_counter() - start)
+            print(f"run {run + 1}: {len(published)} resources published, {timings[-1]:.2f}s")
+
+    for directory, _, names in os.walk(dataset_dir):
+        assert ':' not in os.path.relpath(directory, dataset_dir), f"Url leaked into a path: {directory}"
+    table = pq.read_table(dataset_dir)
+    assert table.num_rows == years * rows_per_member * members, "Dataset row count does not match the archives"
+    assert pd.Series(table.column('Trip_Id').to_numpy()).is_unique, "Incremental runs duplicated rides"
+    # One directory per month, and the day stays available in the files
+    months = {name for name in os.listdir(dataset_dir) if name.startswith('month=')}
+    days = pd.Series(table.column('ym_id').to_pandas().astype(str))
+    assert len(months) == days.str[:7].nunique(), "Dataset is not partitioned by month"
+    print(f"{sum(len(ingestor.state.resource(rid)['files']) for rid in ingestor.state.state['resources'])} "
+          f"partition files in {len(months)} month directories for {days.nunique()} days")
+    shutil.rmtree(work_dir)
+    return timings
+
+
+def benchmark_end_to_end(total_rows=1000000, mode='streaming', chunk_size=250000, rows_per_year=5000000,
+                         report_dir='run_reports'):
+    """Run the whole pipeline against local CKAN, GBFS and object-store stand-ins and report per-stage throughput"""
+    work_dir = tempfile.mkdtemp(prefix='bikeshare_e2e_')
+    report_dir = os.path.abspath(report_dir)
+    archive_dir = os.path.join(work_dir, 'archives')
+    os.makedirs(archive_dir)
+    start = time.perf_counter()
+    paths = write_synthetic_years(archive_dir, total_rows, rows_per_year=rows_per_year)
+    print(f"Generated {total_rows} rows in {len(paths)} archives in {time.perf_counter() - start:.1f}s")
+
+    cwd = os.getcwd()
+    archives = {os.path.basename(path): path for path in paths}
+    store = Local_Object_Store(os.path.join(work_dir, 'object_store'))
+    profiler = Run_Profiler(report_dir=report_dir).start()
+    try:
+        with Local_Open_Data_Server(archives) as server:
+            api = Get_BikeShareData(base_url=server.base_url, station_url=server.station_url,
+                                    download_dir=os.path.join(work_dir, 'downloads'),
+                                    cache_dir=os.path.join(work_dir, 'cache'), profiler=profiler)
+            table_schema = api.load_schema()
+            # Uploads go to the local object store instead of S3/GCS
+            cleaner = bike_share_data_clean(bucket_name='bikeshare', df=None, output_format='parquet',
+                                            table_schema=table_schema)
+            cleaner.s3 = cleaner.credentials = store
+            cleaner.upload_to_s3 = cleaner.upload_to_GCS = True
+
+            urls = api.bikeshare_api(limit=None)
+            stations = api.get_stations()
+            os.chdir(work_dir)  # the pipeline writes its outputs relative to the working directory
+            if mode == 'incremental':
+                run_incremental(api, urls, stations, table_schema, chunk_size=chunk_size, cleaner=cleaner)
+            else:
+                run_streaming(api, urls, stations, table_schema, chunk_size=chunk_size, cleaner=cleaner)
+    finally:
+        os.chdir(cwd)
+        report = profiler.report()
+        report_path = profiler.stop()
+
+    stages = report['stages']
+    assert stages['parse']['rows'] == stages['write']['rows'], "Rows were lost between parsing and writing"
+    assert store.objects, "Nothing was uploaded to the object store"
+
+    print(f"\n{mode} pipeline, {stages['write']['rows']} rows, peak RSS {report['peak_rss'] / 1024**2:.0f} MB")
+    print(f"{'stage':<14}{'self s':>9}{'rows/s':>12}{'MB/s':>9}{'peak RSS MB':>13}")
+    for name, stats in stages.items():
+        seconds = stats['self_wall_s'] or 1e-9
+        mb = max(stats['bytes_in'], stats['bytes_out']) / 1024**2
+        rows_per_s = f"{stats['rows'] / seconds:,.0f}" if stats['rows'] else '-'
+        mb_per_s = f"{mb / seconds:.1f}" if mb else '-'
+        print(f"{name:<14}{stats['self_wall_s']:>9.2f}{rows_per_s:>12}{mb_per_s:>9}"
+              f"{stats['peak_rss'] / 1024**2:>13.0f}")
+    print(f"Uploaded {store.bytes_written / 1024**2:.1f} MB to the object store; report at {report_path}")
+    shutil.rmtree(work_dir)
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Data pipeline benchmarks")
+    parser.add_argument('--suite', choices=['micro', 'e2e', 'all'], default='micro',
+                        help="micro: per-component checks and benchmarks; e2e: whole pipeline on synthetic data")
+    parser.add_argument('--rows', type=int, nargs='+', default=[1000000, 10000000, 50000000],
+                        help="dataset sizes for the end-to-end suite")
+    parser.add_argument('--mode', choices=['streaming', 'incremental'], default='streaming')
+    args = parser.parse_args()
+
+    if args.suite in ('micro', 'all'):
+        check_download_resume()
+        check_cache_revalidation()
+        benchmark_load_memory()
+        benchmark_output_formats()
+        benchmark_clean_data()
+        benchmark_streaming_pipeline()
+        check_schema_drift()
+        benchmark_parallel_parse()
+        check_parallel_mixed_types()
+        benchmark_incremental_ingest()
+        benchmark_download()
+    if args.suite in ('e2e', 'all'):
+        for rows in args.rows:
+            benchmark_end_to_end(total_rows=rows, mode=args.mode)
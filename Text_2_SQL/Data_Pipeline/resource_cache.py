@@ -0,0 +1,170 @@
+import os
+import json
+import time
+import hashlib
+import threading
+
+
+class Resource_Cache:
+    """On-disk, content-addressed cache for CKAN metadata and ridership archives"""
+    def __init__(self, cache_dir='cache', max_bytes=5 * 1024**3):
+        """Load the cache index from disk"""
+        # Entries are keyed by CKAN resource id and keep the ETag / Last-Modified of the
+        # stored copy; blobs are stored once per sha256 and evicted LRU past max_bytes
+        self.cache_dir = cache_dir
+        self.objects_dir = os.path.join(cache_dir, 'objects')
+        self.tmp_dir = os.path.join(cache_dir, 'tmp')
+        self.index_path = os.path.join(cache_dir, 'index.json')
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+
+        # Counters reported at the end of every run
+        self.hits = 0
+        self.misses = 0
+        self.bytes_downloaded = 0
+        self.bytes_saved = 0
+
+        os.makedirs(self.objects_dir, exist_ok=True)
+        os.makedirs(self.tmp_dir, exist_ok=True)
+        self.index = {}
+        if os.path.exists(self.index_path):
+            with open(self.index_path, 'r') as f:
+                self.index = json.load(f)
+
+    def _blob_path(self, digest):
+        """Return the path of a stored blob"""
+        return os.path.join(self.objects_dir, digest)
+
+    def _save_index(self):
+        """Atomically persist the index (caller holds the lock)"""
+        tmp_path = self.index_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(self.index, f)
+        os.replace(tmp_path, self.index_path)
+
+    def _lookup(self, key):
+        """Return the entry for key if its blob is still on disk"""
+        entry = self.index.get(key)
+        if entry and os.path.exists(self._blob_path(entry['sha256'])):
+            return entry
+        return None
+
+    def _conditional_headers(self, entry):
+        """Build If-None-Match / If-Modified-Since headers for a cached entry"""
+        headers = {}
+        if entry and entry.get('etag'):
+            headers['If-None-Match'] = entry['etag']
+        if entry and entry.get('last_modified'):
+            headers['If-Modified-Since'] = entry['last_modified']
+        return headers
+
+    def _record_hit(self, key, entry):
+        """Count a hit and mark the entry as recently used"""
+        with self.lock:
+            self.hits += 1
+            self.bytes_saved += entry['size']
+            entry['last_access'] = time.time()
+            self._save_index()
+        return self._blob_path(entry['sha256'])
+
+    def _store_file(self, key, src_path, etag=None, last_modified=None, version=None):
+        """Move a freshly downloaded file into the object store and index it"""
+        sha = hashlib.sha256()
+        with open(src_path, 'rb') as f:
+            for block in iter(lambda: f.read(1024 * 1024), b''):
+                sha.update(block)
+        digest = sha.hexdigest()
+        size = os.path.getsize(src_path)
+
+        blob_path = self._blob_path(digest)
+        if os.path.exists(blob_path):
+            os.remove(src_path)  # identical content already stored
+        else:
+            os.replace(src_path, blob_path)
+
+        with self.lock:
+            self.misses += 1
+            self.bytes_downloaded += size
+            self.index[key] = {'sha256': digest,
+                               'size': size,
+                               'etag': etag,
+                               'last_modified': last_modified,
+                               'version': version,
+                               'last_access': time.time()}
+            self._evict(keep=key)
+            self._save_index()
+        return blob_path
+
+    def _evict(self, keep=None):
+        """Drop least recently used entries until the cache fits max_bytes (caller holds the lock)"""
+        sizes = {}
+        for entry in self.index.values():
+            sizes[entry['sha256']] = entry['size']
+        total = sum(sizes.values())
+
+        for key in sorted(self.index, key=lambda k: self.index[k]['last_access']):
+            if total <= self.max_bytes:
+                break
+            if key == keep:
+                continue
+            digest = self.index.pop(key)['sha256']
+            if not any(e['sha256'] == digest for e in self.index.values()):
+                total -= sizes[digest]
+                if os.path.exists(self._blob_path(digest)):
+                    os.remove(self._blob_path(digest))
+                print(f"Evicted {key} from cache")
+
+    def get_json(self, session, url, key, version=None, params=None):
+        """Return a JSON API response, served from cache when version or validators match"""
+        entry = self._lookup(key)
+        if entry and version is not None and entry.get('version') == version:
+            # Resource unchanged upstream, no request needed
+            path = self._record_hit(key, entry)
+            with open(path, 'r') as f:
+                return json.load(f)
+
+        response = session.get(url, params=params, headers=self._conditional_headers(entry))
+        if response.status_code == 304:
+            entry = self._lookup(key)  # the blob may have been evicted while revalidating
+            if entry:
+                path = self._record_hit(key, entry)
+                with open(path, 'r') as f:
+                    return json.load(f)
+            # Nothing cached to serve: fetch the body again without validators
+            response = session.get(url, params=params)
+        response.raise_for_status()
+
+        tmp_path = os.path.join(self.tmp_dir, hashlib.sha1(key.encode('utf-8')).hexdigest() + '.json')
+        with open(tmp_path, 'wb') as f:
+            f.write(response.content)
+        self._store_file(key, tmp_path,
+                         etag=response.headers.get('ETag'),
+                         last_modified=response.headers.get('Last-Modified'),
+                         version=version)
+        return response.json()
+
+    def get_file(self, downloader, url, key):
+        """Return a local path for url, revalidating a cached copy with a conditional GET"""
+        entry = self._lookup(key)
+        tmp_path = os.path.join(self.tmp_dir, hashlib.sha1(key.encode('utf-8')).hexdigest())
+        status, headers = downloader.fetch(url, tmp_path, headers=self._conditional_headers(entry))
+        if status == 304:
+            entry = self._lookup(key)  # the blob may have been evicted while revalidating
+            if entry:
+                return self._record_hit(key, entry)
+            # Nothing cached to serve (index lost or evicted): tmp_path was never written, fetch the body
+            status, headers = downloader.fetch(url, tmp_path)
+        return self._store_file(key, tmp_path,
+                                etag=headers.get('ETag'),
+                                last_modified=headers.get('Last-Modified'))
+
+    def stats(self):
+        """Return and print cache hit/miss counters"""
+        stats = {'hits': self.hits,
+                 'misses': self.misses,
+                 'bytes_downloaded': self.bytes_downloaded,
+                 'bytes_saved': self.bytes_saved}
+        print(f"Cache hits: {self.hits}, misses: {self.misses}, "
+              f"downloaded: {self.bytes_downloaded / 1024**2:.1f} MB, "
+              f"saved: {self.bytes_saved / 1024**2:.1f} MB")
+        return stats
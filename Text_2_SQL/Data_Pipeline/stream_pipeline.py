@@ -0,0 +1,161 @@
+import time
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+
+class Trip_Id_Set:
+    """Compact bitmap set of Trip_Ids used to drop duplicates across chunks"""
+    def __init__(self, max_bytes=256 * 1024**2):
+        """Start with an empty bitmap; it grows to cover the Trip_Id range seen, up to max_bytes"""
+        # Trip_Ids are dense sequential integers, so one bit per possible id
+        # (a few MB for tens of millions of rides) beats a Python set by ~100x
+        self.base = None
+        self.bits = np.zeros(0, dtype=np.uint8)
+        self.count = 0
+        # The bitmap only covers a window of max_bytes * 8 ids around the first ids seen; corrupt or
+        # outlying ids (e.g. 1e12) go to a hash set instead of sizing the bitmap to the whole span
+        self.max_span = max_bytes * 8
+        self.window = None
+        self.outliers = set()
+
+    def _in_window(self, ids):
+        if self.window is None:
+            # Centred on the median, so a stray id in the first chunk cannot anchor the window
+            low = int(np.median(ids)) - self.max_span // 2
+            self.window = (low, low + self.max_span)
+        return (ids >= self.window[0]) & (ids < self.window[1])
+
+    def _ensure_range(self, low, high):
+        """Grow the bitmap so that [low, high] is addressable"""
+        if self.base is None:
+            self.base = low - low % 8
+        if low < self.base:
+            pad = (self.base - low + 7) // 8
+            self.bits = np.concatenate([np.zeros(pad, dtype=np.uint8), self.bits])
+            self.base -= pad * 8
+        needed = (high - self.base) // 8 + 1
+        if needed > len(self.bits):
+            limit = (self.window[1] - self.base) // 8 + 1
+            grown = np.zeros(min(max(needed, 2 * len(self.bits)), limit), dtype=np.uint8)
+            grown[:len(self.bits)] = self.bits
+            self.bits = grown
+
+    def _add_dense(self, ids):
+        self._ensure_range(int(ids.min()), int(ids.max()))
+        offsets = ids - self.base
+        byte = offsets >> 3
+        bit = (offsets & 7).astype(np.uint8)
+        seen = (self.bits[byte] >> bit) & 1
+
+        first = np.zeros(len(ids), dtype=bool)
+        first[np.unique(ids, return_index=True)[1]] = True
+        new = (seen == 0) & first
+
+        np.bitwise_or.at(self.bits, byte[new], np.left_shift(1, bit[new]).astype(np.uint8))
+        return new
+
+    def add_new(self, ids):
+        """Mark ids as seen and return a mask of the ones not seen before (first occurrence only)"""
+        ids = np.asarray(ids, dtype=np.int64)
+        if len(ids) == 0:
+            return np.zeros(0, dtype=bool)
+        dense = self._in_window(ids)
+        new = np.zeros(len(ids), dtype=bool)
+        if dense.any():
+            new[dense] = self._add_dense(ids[dense])
+        for i in np.flatnonzero(~dense):
+            trip_id = int(ids[i])
+            if trip_id not in self.outliers:
+                self.outliers.add(trip_id)
+                new[i] = True
+        self.count += int(new.sum())
+        return new
+
+    def __len__(self):
+        return self.count
+
+
+class Streaming_Pipeline:
+    """Load, clean, deduplicate and write ridership archives one chunk at a time"""
+    def __init__(self, api, cleaner, output_path='bike_share_data.parquet',
+                 chunk_size=250000, table_schema=None):
+        """api is a Get_BikeShareData, cleaner a bike_share_data_clean"""
+        self.api = api
+        self.cleaner = cleaner
+        self.output_path = output_path
+        self.chunk_size = chunk_size
+        self.table_schema = table_schema
+        self.seen = Trip_Id_Set()
+        self.stats = {}
+        self.profiler = api.profiler
+
+    def _deduplicate(self, chunk):
+        """Drop rides whose Trip_Id was already written by an earlier chunk"""
+        ids = chunk['Trip_Id']
+        keep = np.ones(len(chunk), dtype=bool)
+        valid = ids.notna().to_numpy()
+        keep[valid] = self.seen.add_new(ids[valid].astype('int64').to_numpy())
+        return chunk[keep]
+
+    def writer_schema(self, table):
+        """First chunk's schema plus the columns table_schema.json declares that it lacks (e.g. Model)"""
+        declared = self.cleaner.arrow_types(self.table_schema)
+        missing = [pa.field(name, self.cleaner.storage_type(arrow_type))
+                   for name, arrow_type in declared.items() if name not in table.column_names]
+        return pa.schema(list(table.schema) + missing)
+
+    @staticmethod
+    def conform(table, schema):
+        """Reorder and cast a chunk's Arrow table to the writer schema, filling missing columns with nulls"""
+        extra = set(table.column_names) - set(schema.names)
+        if extra:
+            # Dropping them would silently lose data that first appears in a later archive
+            raise ValueError(f"Columns {sorted(extra)} are not in the output schema; "
+                             f"declare them in table_schema.json")
+        columns = []
+        for field in schema:
+            if field.name in table.column_names:
+                columns.append(table.column(field.name).cast(field.type))
+            else:
+                columns.append(pa.nulls(len(table), type=field.type))
+        return pa.Table.from_arrays(columns, schema=schema)
+
+    def chunks(self, paths):
+        """Yield cleaned, deduplicated DataFrame chunks"""
+        raw_chunks = self.api.stream_data(paths, chunk_size=self.chunk_size)
+        for chunk in self.profiler.iterate('clean', self.cleaner.clean_chunks(raw_chunks)):
+            yield self._deduplicate(chunk)
+
+    def run(self, paths):
+        """Stream every archive into one zstd Parquet file, returning its path"""
+        start = time.perf_counter()
+        writer = None
+        rows = 0
+        try:
+            for chunk in self.chunks(paths):
+                with self.profiler.stage('write') as stats:
+                    table = self.cleaner.to_arrow(chunk, self.table_schema)
+                    if writer is None:
+                        writer = pq.ParquetWriter(self.output_path, self.writer_schema(table), compression='zstd')
+                    table = self.conform(table, writer.schema)
+                    writer.write_table(table)
+                    stats.rows += len(chunk)
+                    stats.bytes_in += table.nbytes
+                rows += len(chunk)
+        finally:
+            if writer is not None:
+                writer.close()
+
+        self.stats = {'rows_written': rows,
+                      'unique_trip_ids': len(self.seen),
+                      'seconds': time.perf_counter() - start}
+        print(f"Streamed {rows} rows to {self.output_path} in {self.stats['seconds']:.1f}s")
+        return self.output_path if writer is not None else None
+
+    def sample(self, n=1000):
+        """Return the first n rows of the written output"""
+        batch = next(pq.ParquetFile(self.output_path).iter_batches(batch_size=n), None)
+        return batch.to_pandas() if batch is not None else pd.DataFrame()
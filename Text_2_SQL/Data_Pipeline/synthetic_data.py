@@ -0,0 +1,103 @@
+import os
+import random
+import zipfile
+
+import numpy as np
+import pandas as pd
+
+
+# Column layout of the Toronto ridership CSVs, including the double space in 'Trip  Duration'
+RIDERSHIP_COLUMNS = ['Trip Id', 'Trip  Duration', 'Start Station Id', 'Start Time', 'Start Station Name',
+                     'End Station Id', 'End Time', 'End Station Name', 'Bike Id', 'User Type']
+STATION_IDS = np.arange(7000, 7700)
+
+
+def station_name(station_id):
+    """Deterministic station name for an id"""
+    streets = ['Bay St', 'Queen St W', 'King St E', 'Spadina Ave', 'College St', 'Dundas St W']
+    return f"{streets[station_id % len(streets)]} / Station {station_id}"
+
+
+def make_payloads(n_files, size_mb, seed=1947):
+    """Build deterministic pseudo-random file bodies"""
+    rng = random.Random(seed)
+    return {f'/bikeshare-ridership-{2015 + i}.zip': rng.randbytes(int(size_mb * 1024 * 1024))
+            for i in range(n_files)}
+
+
+def make_stations(seed=1947):
+    """Return a GBFS station_information document for the synthetic stations"""
+    rng = np.random.default_rng(seed)
+    stations = [{'station_id': str(station_id),
+                 'name': station_name(station_id),
+                 'lat': round(43.64 + rng.normal(0, 0.03), 6),
+                 'lon': round(-79.39 + rng.normal(0, 0.05), 6)}
+                for station_id in STATION_IDS]
+    return {'last_updated': 0, 'ttl': 10, 'data': {'stations': stations}}
+
+
+def write_synthetic_archive(path, rows_per_member=100000, members=12, block_rows=250000, seed=1947,
+                            first_trip_id=10000000, year=2023, missing_station_rate=0.001):
+    """Write a ridership-shaped zip of monthly cp1252 CSVs without holding it in memory"""
+    rng = np.random.default_rng(seed)
+    trip_id = first_trip_id
+    with zipfile.ZipFile(path, 'w', compression=zipfile.ZIP_DEFLATED) as zf:
+        for member_no in range(1, members + 1):
+            month = (member_no - 1) % 12 + 1
+            with zf.open(f'Bike share ridership {year}-{month:02d}.csv', 'w') as member:
+                if member_no % 2 == 0:
+                    # Some months carry a UTF-8 BOM that cp1252 decodes into 'ï»¿Trip Id'
+                    member.write(b'\xef\xbb\xbf')
+                member.write((','.join(RIDERSHIP_COLUMNS) + '\r\n').encode('cp1252'))
+
+                written = 0
+                while written < rows_per_member:
+                    n = min(block_rows, rows_per_member - written)
+                    start = pd.Timestamp(year, month, 1) + pd.to_timedelta(
+                        np.sort(rng.integers(0, 28 * 24 * 60, n)), unit='min')
+                    duration = rng.integers(60, 7200, n)
+                    end = start + pd.to_timedelta(duration, unit='s')
+                    start_station = rng.choice(STATION_IDS, n)
+                    end_station = rng.choice(STATION_IDS, n).astype(float)
+                    # A few rides end at an unknown station, as in the real extracts
+                    end_station[rng.random(n) < missing_station_rate] = np.nan
+                    start_names = np.array([station_name(i) for i in STATION_IDS], dtype=object)[start_station - 7000]
+                    # Inconsistent case and padding that clean_data normalises
+                    upper = rng.random(n) < 0.1
+                    start_names[upper] = [f" {name.upper()} " for name in start_names[upper]]
+                    block = pd.DataFrame({
+                        'Trip Id': np.arange(trip_id, trip_id + n),
+                        'Trip  Duration': duration,
+                        'Start Station Id': start_station,
+                        'Start Time': start.strftime('%m/%d/%Y %H:%M'),
+                        'Start Station Name': start_names,
+                        'End Station Id': pd.array(end_station).astype('Int64'),
+                        'End Time': end.strftime('%m/%d/%Y %H:%M'),
+                        'End Station Name': [station_name(int(i)) if i == i else '' for i in end_station],
+                        'Bike Id': rng.integers(1, 8000, n),
+                        'User Type': rng.choice(['Annual Member', 'Casual Member'], n, p=[0.7, 0.3]),
+                    })
+                    member.write(block.to_csv(index=False, header=False, lineterminator='\r\n').encode('cp1252'))
+                    trip_id += n
+                    written += n
+    return path
+
+
+def write_synthetic_years(work_dir, total_rows, rows_per_year=5000000, seed=1947, first_year=2017):
+    """Split total_rows into yearly archives of twelve monthly members, returning their paths"""
+    paths = []
+    first_trip_id = 10000000
+    year = first_year
+    remaining = total_rows
+    while remaining > 0:
+        rows = min(rows_per_year, remaining)
+        rows_per_member = -(-rows // 12)
+        path = os.path.join(work_dir, f'bikeshare-ridership-{year}.zip')
+        write_synthetic_archive(path, rows_per_member=rows_per_member, members=12,
+                                seed=seed + year, first_trip_id=first_trip_id, year=year)
+        paths.append(path)
+        first_trip_id += rows_per_member * 12
+        remaining -= rows_per_member * 12
+        year += 1
+    return paths
+
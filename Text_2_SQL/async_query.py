@@ -0,0 +1,210 @@
+import re
+import time
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+from schema_context import question_scope
+
+
+TEXT_TO_SQL_PROMPT = (
+    "Given an input question, create a syntactically correct {dialect} query to run that answers it. "
+    "Only use the columns listed in the schema below and never select all columns.\n"
+    "Use the following format:\n"
+    "Question: Question here\nSQLQuery: SQL Query to run\n\n"
+    "Schema:\n{schema}\n\n"
+    "{examples}"
+    "Question: {question}\nSQLQuery: "
+)
+SYNTHESIS_PROMPT = (
+    "Given an input question, synthesize a response from the query results.\n"
+    "Question: {question}\nSQL: {sql}\nSQL Response: {result}\nResponse: "
+)
+
+
+def parse_sql(text):
+    """Pull the SQL statement out of an LLM completion"""
+    text = text.split('SQLResult:')[0]
+    if 'SQLQuery:' in text:
+        text = text.split('SQLQuery:', 1)[1]
+    text = re.sub(r"^```(sql)?|```$", "", text.strip(), flags=re.I | re.M)
+    return text.strip().rstrip(';')
+
+
+class Rate_Limiter:
+    """Async token bucket: at most rate calls per second, with bursts up to burst"""
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.burst = burst or max(1, int(rate))
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class Async_Query_Runner:
+    """Answer many questions concurrently: LLM calls and SQL executions overlap, bounded and rate limited"""
+    def __init__(self, llm, sql_database, tables=('bikeshare_data',), concurrency=8, sql_concurrency=4,
+                 llm_rate=None, timeout=120, synthesize_response=True, cache=None, dialect=None,
+                 schema_context=None, guard=None, few_shot=None):
+        """llm needs acomplete(prompt); sql_database needs run_sql(sql) and get_single_table_info(name)"""
+        self.llm = llm
+        self.sql_database = sql_database
+        self.tables = list(tables)
+        self.concurrency = concurrency
+        self.sql_concurrency = sql_concurrency
+        self.llm_rate = llm_rate  # LLM requests per second across all questions, None for unlimited
+        self.timeout = timeout  # seconds per question
+        self.synthesize_response = synthesize_response
+        self.cache = cache  # optional query_cache.Query_Cache
+        self.dialect = dialect or sql_database.engine.dialect.name
+        # Question-specific context from table_schema.json when the database carries one
+        self.schema_context = schema_context or getattr(sql_database, 'schema_context', None)
+        # sql_guard.SQL_Guard for databases that do not check generated SQL themselves
+        self.guard = guard
+        self.few_shot = few_shot  # optional few_shot.Few_Shot_Store of verified question/SQL pairs
+        self._schema = None
+
+    def schema(self, question=None):
+        """Table context for the text-to-SQL prompt; reflected schemas are built once per runner"""
+        if self.schema_context:
+            with question_scope(question):
+                return '\n\n'.join(self.schema_context.table_info(table) if table in self.schema_context
+                                   else self.sql_database.get_single_table_info(table) for table in self.tables)
+        if self._schema is None:
+            self._schema = '\n\n'.join(self.sql_database.get_single_table_info(table) for table in self.tables)
+        return self._schema
+
+    def _execute(self, sql):
+        """Check and run one statement; blocking (dry run and warehouse round trips), so called on the executor
+
+        A database with its own guard checks (and routes) inside run_sql; self.guard only applies to one
+        without, and then checks the SQL before the database routes it, as Streaming_Query_Runner does.
+        """
+        prepare_sql = getattr(self.sql_database, 'prepare_sql', None)
+        if self.guard and not getattr(self.sql_database, 'guard', None):
+            sql, _ = self.guard.check(sql, route=prepare_sql)
+            if prepare_sql:
+                result, metadata = self.sql_database.run_sql(sql, prepared=True)
+                return sql, result, metadata
+        result, metadata = self.sql_database.run_sql(sql)
+        return sql, result, metadata
+
+    async def _complete(self, prompt, limiter):
+        if limiter:
+            await limiter.acquire()
+        response = await self.llm.acomplete(prompt)
+        return response.text
+
+    async def _answer(self, question, timings, limiter, sql_slots, executor):
+        """Generate SQL, execute it and synthesize an answer for one question"""
+        if self.cache:
+            # Semantic lookups embed the question over the network, so they run off the event loop too
+            entry, tier = await asyncio.to_thread(self.cache.get, question)
+            if entry is not None:
+                timings['cache'] = tier
+                return {'sql': entry['sql'], 'rows': entry['result'], 'answer': str(entry['response'])}
+
+        start = time.perf_counter()
+        matches, sql = [], None
+        if self.few_shot:
+            # Embedding lookups block on the network, so they run off the event loop
+            matches = await asyncio.to_thread(self.few_shot.search, question)
+            sql = self.few_shot.reusable_sql(question, matches)
+            timings['few_shot'] = 'reused' if sql else len(matches)
+        if sql is None:
+            prompt = TEXT_TO_SQL_PROMPT.format(dialect=self.dialect, schema=self.schema(question), question=question,
+                                               examples=self.few_shot.prompt(matches) if self.few_shot else '')
+            timings['prompt'] = time.perf_counter() - start
+
+            start = time.perf_counter()
+            sql = parse_sql(await self._complete(prompt, limiter))
+        timings['generate_sql'] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        async with sql_slots:
+            # The warehouse client is blocking, so it runs on a dedicated thread pool
+            sql, result, metadata = await asyncio.get_running_loop().run_in_executor(executor, self._execute, sql)
+        rows = metadata.get('result', result)
+        timings['execute'] = time.perf_counter() - start
+
+        answer = result
+        if self.synthesize_response:
+            start = time.perf_counter()
+            answer = await self._complete(SYNTHESIS_PROMPT.format(question=question, sql=sql, result=result),
+                                          limiter)
+            timings['synthesize'] = time.perf_counter() - start
+
+        if self.cache:
+            await asyncio.to_thread(self.cache.put, question, sql, rows, answer)
+        return {'sql': sql, 'rows': rows, 'answer': answer}
+
+    async def _run_one(self, question, slots, limiter, sql_slots, executor):
+        timings = {}
+        queued = time.perf_counter()
+        async with slots:
+            timings['queue'] = time.perf_counter() - queued
+            start = time.perf_counter()
+            try:
+                result = await asyncio.wait_for(self._answer(question, timings, limiter, sql_slots, executor),
+                                                self.timeout)
+                error = None
+            except asyncio.TimeoutError:
+                result, error = {}, f"timed out after {self.timeout}s"
+            except Exception as e:
+                result, error = {}, f"{type(e).__name__}: {e}"
+            timings['total'] = time.perf_counter() - start
+        return {'question': question,
+                'sql': result.get('sql'),
+                'rows': result.get('rows'),
+                'answer': result.get('answer'),
+                'error': error,
+                'timings': timings}
+
+    async def aquery_many(self, questions):
+        """Answer every question, returning one result dict per question in input order"""
+        slots = asyncio.Semaphore(self.concurrency)
+        sql_slots = asyncio.Semaphore(self.sql_concurrency)
+        limiter = Rate_Limiter(self.llm_rate) if self.llm_rate else None
+        with ThreadPoolExecutor(max_workers=self.sql_concurrency) as executor:
+            # gather keeps results in the order the questions were given
+            return await asyncio.gather(*[self._run_one(q, slots, limiter, sql_slots, executor)
+                                          for q in questions])
+
+    def query_many(self, questions):
+        """Blocking wrapper around aquery_many for scripts"""
+        return asyncio.run(self.aquery_many(questions))
+
+    @staticmethod
+    def summary(results, elapsed, verbose=True):
+        """Return (and print, if verbose) throughput, latency percentiles, error count and mean per-stage timings
+
+        Latency is end to end: the time a question waited for a concurrency slot plus the time it ran.
+        """
+        stages = {}
+        for result in results:
+            for stage, seconds in result['timings'].items():
+                if isinstance(seconds, float):
+                    stages.setdefault(stage, []).append(seconds)
+        latencies = sorted(result['timings'].get('queue', 0.0) + result['timings'].get('total', 0.0)
+                           for result in results) or [0.0]
+        stats = {'questions': len(results),
+                 'qps': len(results) / elapsed,
+                 'p50': latencies[int(0.50 * (len(latencies) - 1))],
+                 'p95': latencies[int(0.95 * (len(latencies) - 1))],
+                 'errors': sum(1 for result in results if result['error']),
+                 'stages': {stage: sum(v) / len(v) for stage, v in stages.items()}}
+        if verbose:
+            print(f"{len(results)} questions in {elapsed:.2f}s ({stats['qps']:.1f} q/s), p50 {stats['p50']:.3f}s, "
+                  f"p95 {stats['p95']:.3f}s, {stats['errors']} errors")
+            print('mean stage seconds: ' + ', '.join(f"{stage} {v:.3f}" for stage, v in stats['stages'].items()))
+        return stats
@@ -0,0 +1,211 @@
+import os
+import re
+import json
+import hashlib
+import argparse
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+import numpy as np
+
+from query_cache import normalize_question
+
+
+STORE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'few_shot_store')
+EXAMPLES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'few_shot_examples.json')
+
+# Few-shot block for the question being answered, appended to the table context by Routed_SQLDatabase
+current_examples = ContextVar('current_examples', default='')
+
+
+class Embedding_Cache:
+    """Batched, memoized wrapper around an embedding function; returns unit-length float32 vectors"""
+    def __init__(self, embed_fn, max_entries=4096, batch_size=64):
+        self.embed_fn = embed_fn
+        self.max_entries = max_entries
+        self.batch_size = batch_size
+        self.vectors = OrderedDict()  # sha256 of text -> vector, least recently used first
+        self.lock = threading.Lock()
+        self.calls = 0
+
+    def __call__(self, texts):
+        keys = [hashlib.sha256(t.encode()).hexdigest() for t in texts]
+        with self.lock:
+            missing = list(OrderedDict.fromkeys(t for t, k in zip(texts, keys) if k not in self.vectors))
+        # One embedding request per batch of unseen texts instead of one per text
+        for i in range(0, len(missing), self.batch_size):
+            batch = missing[i:i + self.batch_size]
+            vectors = np.asarray(self.embed_fn(batch), dtype=np.float32)
+            vectors /= np.linalg.norm(vectors, axis=1, keepdims=True).clip(min=1e-12)
+            self.calls += 1
+            with self.lock:
+                for t, vector in zip(batch, vectors):
+                    self.vectors[hashlib.sha256(t.encode()).hexdigest()] = vector
+        with self.lock:
+            result = []
+            for key in keys:
+                self.vectors.move_to_end(key)
+                result.append(self.vectors[key])
+            while len(self.vectors) > self.max_entries:
+                self.vectors.popitem(last=False)
+        return result
+
+
+class Few_Shot_Store:
+    """Persistent verified question -> SQL pairs behind a FAISS HNSW index, for few-shot prompts and SQL reuse"""
+    def __init__(self, path=STORE_PATH, embed_fn=None, top_k=3, reuse_threshold=0.95, hnsw_neighbors=32):
+        """embed_fn maps a list of strings to vectors; wrap it in Embedding_Cache to batch and memoize calls"""
+        self.path = path
+        self.embed_fn = embed_fn
+        self.top_k = top_k
+        self.reuse_threshold = reuse_threshold
+        self.hnsw_neighbors = hnsw_neighbors
+        self.examples = []  # FAISS id -> {'question', 'sql'}
+        self.keys = {}  # normalized question -> FAISS id
+        self.index = None
+        self.lock = threading.Lock()
+        self.reused = 0
+        self._load()
+
+    def _load(self):
+        """Read the index and its examples if the store has been saved before"""
+        examples_path = os.path.join(self.path, 'examples.json')
+        if not os.path.exists(examples_path):
+            return
+        import faiss
+        with open(examples_path, 'r') as f:
+            self.examples = json.load(f)
+        self.keys = {normalize_question(e['question']): i for i, e in enumerate(self.examples)}
+        self.index = faiss.read_index(os.path.join(self.path, 'index.faiss'))
+        print(f"Loaded {len(self.examples)} few-shot examples from {self.path}")
+
+    def save(self):
+        os.makedirs(self.path, exist_ok=True)
+        import faiss
+        with self.lock:
+            faiss.write_index(self.index, os.path.join(self.path, 'index.faiss'))
+            with open(os.path.join(self.path, 'examples.json'), 'w') as f:
+                json.dump(self.examples, f, indent=2)
+
+    def add(self, pairs):
+        """Add verified (question, sql) pairs; a known question only has its SQL replaced"""
+        import faiss
+        latest = OrderedDict()
+        for question, sql in pairs:
+            latest[normalize_question(question)] = (question, sql)  # a repeated question keeps its last SQL
+        with self.lock:
+            unseen = [key for key in latest if key not in self.keys]
+        # Embedding is a network call, so it happens outside the lock
+        vectors = {}
+        if unseen:
+            embedded = np.stack(self.embed_fn(unseen)).astype(np.float32)
+            embedded /= np.linalg.norm(embedded, axis=1, keepdims=True).clip(min=1e-12)
+            vectors = dict(zip(unseen, embedded))
+        added = []
+        with self.lock:
+            # Ids, examples and index rows are assigned together, so concurrent adds cannot interleave them
+            for key, (question, sql) in latest.items():
+                if key in self.keys:
+                    self.examples[self.keys[key]]['sql'] = sql
+                else:
+                    self.keys[key] = len(self.examples)
+                    self.examples.append({'question': question, 'sql': sql})
+                    added.append(vectors[key])
+            if added:
+                if self.index is None:
+                    # Inner product on unit vectors is cosine similarity
+                    self.index = faiss.IndexHNSWFlat(len(added[0]), self.hnsw_neighbors, faiss.METRIC_INNER_PRODUCT)
+                self.index.add(np.stack(added))
+        return len(added)
+
+    def search(self, question, k=None):
+        """Closest stored pairs as dicts with question, sql and cosine similarity, best first"""
+        if self.index is None or not self.examples:
+            return []
+        vector = np.asarray(self.embed_fn([normalize_question(question)])[0], dtype=np.float32)
+        vector = vector / (np.linalg.norm(vector) or 1.0)
+        with self.lock:
+            scores, ids = self.index.search(vector[None, :], min(k or self.top_k, len(self.examples)))
+        return [dict(self.examples[i], similarity=float(s)) for s, i in zip(scores[0], ids[0]) if i >= 0]
+
+    def reusable_sql(self, question, matches):
+        """Stored SQL that can run as is: a near-identical question asking about the same numbers"""
+        if not matches or matches[0]['similarity'] < self.reuse_threshold:
+            return None
+        # "trips in 2023" must never run the SQL stored for "trips in 2024"
+        if re.findall(r'\d+', normalize_question(question)) != \
+                re.findall(r'\d+', normalize_question(matches[0]['question'])):
+            return None
+        self.reused += 1
+        return matches[0]['sql']
+
+    @staticmethod
+    def prompt(matches):
+        """Few-shot block in the Question/SQLQuery format of the text-to-SQL prompt"""
+        if not matches:
+            return ''
+        return 'Examples of verified queries:\n' + \
+            ''.join(f"Question: {m['question']}\nSQLQuery: {m['sql']}\n\n" for m in matches)
+
+    def load_examples(self, examples_path=EXAMPLES_PATH):
+        """Add the pairs in a JSON list of {"question", "sql"} objects"""
+        with open(examples_path, 'r') as f:
+            return self.add([(e['question'], e['sql']) for e in json.load(f)])
+
+
+@contextmanager
+def examples_scope(examples):
+    """Publish the few-shot block to table context lookups made while answering a question"""
+    token = current_examples.set(examples)
+    try:
+        yield
+    finally:
+        current_examples.reset(token)
+
+
+class Few_Shot_Query_Engine:
+    """Wrap a query engine: inject the closest verified pairs into the prompt, or run a stored query outright"""
+    def __init__(self, query_engine, store, sql_database, llm=None):
+        self.query_engine = query_engine
+        self.store = store
+        self.sql_database = sql_database
+        self.llm = llm  # synthesizes answers for reused SQL; without it the raw result is returned
+
+    def _reuse(self, question, sql):
+        from llama_index.core.base.response.schema import Response
+        from async_query import SYNTHESIS_PROMPT
+        result, metadata = self.sql_database.run_sql(sql)
+        answer = self.llm.complete(SYNTHESIS_PROMPT.format(question=question, sql=sql, result=result)).text \
+            if self.llm else result
+        print(f"Reused verified SQL: {sql}")
+        return Response(response=answer, metadata={'sql_query': sql, 'result': metadata.get('result')})
+
+    def query(self, question):
+        matches = self.store.search(str(question))
+        sql = self.store.reusable_sql(str(question), matches)
+        if sql:
+            return self._reuse(str(question), sql)
+        with examples_scope(self.store.prompt(matches)):
+            return self.query_engine.query(question)
+
+    def __getattr__(self, name):
+        return getattr(self.query_engine, name)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load verified question/SQL pairs into the few-shot store")
+    parser.add_argument('--examples', default=EXAMPLES_PATH)
+    parser.add_argument('--store', default=os.getenv('FEW_SHOT_PATH', STORE_PATH))
+    args = parser.parse_args()
+
+    from dotenv import load_dotenv
+    from chromadb.utils import embedding_functions
+    load_dotenv()
+    embed_fn = Embedding_Cache(embedding_functions.GoogleGenerativeAiEmbeddingFunction(
+        api_key=os.getenv('GOOGLE_AI_STUDIO_API_KEY')))
+    store = Few_Shot_Store(args.store, embed_fn=embed_fn)
+    added = store.load_examples(args.examples)
+    store.save()
+    print(f"Added {added} pairs, {len(store.examples)} in {args.store} ({embed_fn.calls} embedding calls)")
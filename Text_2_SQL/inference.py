@@ -1,13 +1,12 @@
 #%% 
 from dotenv import load_dotenv
-import pandas as pd
 from rag_pipeline_init import RAGPipeline_init
 from rag_pipeline_call import RAGPipeline_call
 #%%
 load_dotenv()
 
-#Initializing RAG pipeline
-Rag_Pipline_initialization = RAGPipeline_init()
+#Initializing RAG pipeline (one warm instance per process; clients are built on first use)
+Rag_Pipline_initialization = RAGPipeline_init.shared()
 sql_engine = Rag_Pipline_initialization.sql_alchemy_connect()
 llm, embedding_model, query_engine = Rag_Pipline_initialization.llm_init(sql_database=sql_engine)
 #%%
@@ -0,0 +1,166 @@
+import os
+import re
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+
+def normalize_question(question):
+    """Normalize a question for exact-match lookup: case, whitespace and trailing punctuation"""
+    question = re.sub(r'\s+', ' ', question.strip().lower())
+    return question.rstrip(' ?.!')
+
+
+def state_watermark(state_path):
+    """Watermark callable for the data pipeline's ingestion_state.json, re-read only when the file changes"""
+    seen = {'stat': None, 'watermark': None}
+
+    def watermark():
+        try:
+            stat = os.stat(state_path)
+        except FileNotFoundError:
+            return None
+        key = (stat.st_mtime_ns, stat.st_size)
+        if key != seen['stat']:
+            with open(state_path, 'rb') as f:
+                seen['watermark'] = hashlib.sha256(f.read()).hexdigest()
+            seen['stat'] = key
+        return seen['watermark']
+
+    return watermark
+
+
+class Query_Cache:
+    """Two-tier (exact, then embedding-similarity) cache of generated SQL and results with TTL and LRU eviction"""
+    def __init__(self, max_entries=256, ttl=3600, embed_fn=None, similarity_threshold=0.92, watermark_fn=None):
+        """embed_fn maps a list of strings to vectors (e.g. the chromadb Google embedding function)"""
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.embed_fn = embed_fn
+        self.similarity_threshold = similarity_threshold
+        self.watermark_fn = watermark_fn
+        self.watermark = watermark_fn() if watermark_fn else None
+        self.entries = OrderedDict()  # normalized question -> entry, least recently used first
+        # Vectors computed by get() for questions that missed, reused by the put() that usually follows
+        self.miss_vectors = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = {'exact': 0, 'semantic': 0}
+        self.misses = 0
+
+    def _check_watermark(self):
+        """Drop every entry when the table has been reloaded since they were cached"""
+        if not self.watermark_fn:
+            return
+        watermark = self.watermark_fn()
+        if watermark != self.watermark:
+            if self.entries:
+                print(f"Ingestion watermark changed, invalidating {len(self.entries)} cached queries")
+            self.entries.clear()
+            self.watermark = watermark
+
+    def _expired(self, entry):
+        return self.ttl is not None and time.time() - entry['created'] > self.ttl
+
+    def _embed(self, question):
+        vector = np.asarray(self.embed_fn([question])[0], dtype=np.float32)
+        return vector / (np.linalg.norm(vector) or 1.0)
+
+    def _semantic_match(self, key, vector):
+        """Most similar live entry above the threshold whose numbers (years, counts) match the question"""
+        numbers = re.findall(r'\d+', key)
+        best, best_score = None, self.similarity_threshold
+        for other, entry in self.entries.items():
+            if entry['vector'] is None or re.findall(r'\d+', other) != numbers:
+                continue  # "trips in 2023" must never answer "trips in 2024"
+            score = float(vector @ entry['vector'])
+            if score >= best_score:
+                best, best_score = other, score
+        return best
+
+    def get(self, question):
+        """Return (entry, tier) for a cached question, or (None, None) on a miss"""
+        key = normalize_question(question)
+        vector = None
+        with self.lock:
+            self._check_watermark()
+            tier = 'exact'
+            entry = self.entries.get(key)
+        if entry is None and self.embed_fn and self.entries:
+            vector = self._embed(key)
+            with self.lock:
+                match = self._semantic_match(key, vector)
+                entry = self.entries.get(match) if match else None
+                key, tier = match, 'semantic'
+        with self.lock:
+            if entry is not None and self._expired(entry):
+                self.entries.pop(key, None)
+                entry = None
+            if entry is None:
+                self.misses += 1
+                if vector is not None:
+                    self.miss_vectors[normalize_question(question)] = vector
+                    while len(self.miss_vectors) > self.max_entries:
+                        self.miss_vectors.popitem(last=False)
+                return None, None
+            self.entries.move_to_end(key)
+            self.hits[tier] += 1
+        return entry, tier
+
+    def put(self, question, sql, result, response):
+        """Store the generated SQL, its result set and the synthesized response for a question"""
+        key = normalize_question(question)
+        with self.lock:
+            vector = self.miss_vectors.pop(key, None)
+        if vector is None and self.embed_fn:
+            vector = self._embed(key)
+        with self.lock:
+            self._check_watermark()
+            self.entries[key] = {'question': question,
+                                 'sql': sql,
+                                 'result': result,
+                                 'response': response,
+                                 'vector': vector,
+                                 'created': time.time()}
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.miss_vectors.clear()
+
+    def stats(self):
+        """Print and return hit/miss counts"""
+        stats = {'entries': len(self.entries), 'exact_hits': self.hits['exact'],
+                 'semantic_hits': self.hits['semantic'], 'misses': self.misses}
+        print(f"Query cache: {stats['entries']} entries, exact hits: {stats['exact_hits']}, "
+              f"semantic hits: {stats['semantic_hits']}, misses: {stats['misses']}")
+        return stats
+
+
+class Cached_Query_Engine:
+    """Wrap an NLSQLTableQueryEngine so repeated or paraphrased questions skip the LLM and the warehouse"""
+    def __init__(self, query_engine, cache):
+        self.query_engine = query_engine
+        self.cache = cache
+
+    def query(self, question):
+        """Answer from the cache when possible, otherwise query the engine and cache its SQL and result"""
+        start = time.perf_counter()
+        entry, tier = self.cache.get(question)
+        if entry is not None:
+            print(f"Query cache {tier} hit in {(time.perf_counter() - start) * 1000:.1f} ms: {entry['sql']}")
+            return entry['response']
+
+        response = self.query_engine.query(question)
+        metadata = getattr(response, 'metadata', None) or {}
+        self.cache.put(question, metadata.get('sql_query'), metadata.get('result'), response)
+        return response
+
+    def __getattr__(self, name):
+        # Everything else (prompts, retrievers, aquery, ...) goes to the wrapped engine
+        return getattr(self.query_engine, name)
@@ -1,17 +1,11 @@
-
 import os 
-from sqlalchemy.engine import create_engine
-from sqlalchemy import text
-from functools import reduce
-
-from IPython.display import Markdown, display
-import pandas as pd
-from google.oauth2 import service_account
+import time
 
 from dotenv import load_dotenv
 
-from llama_index.core.llms import ChatMessage
-from rag_pipeline_init import RAGPipeline_init
+from rag_pipeline_init import RAGPipeline_init, load_credentials
+from async_query import Async_Query_Runner
+from result_stream import Streaming_Query_Runner
 
 load_dotenv()  # Load environment variables from .env file
 
@@ -20,7 +14,6 @@ class RAGPipeline_call:
     def __init__(self):
         """Initialize the RAG pipeline with necessary configurations"""
         self.credentials_path = os.path.join(os.path.dirname(__file__), 'GOOGLE_APPLICATION_CREDENTIALS.json') #Place GCP credentials in the same directory 
-        self.credentials = service_account.Credentials.from_service_account_file(self.credentials_path)
         
         self.oath_api_path = os.path.join(os.path.dirname(__file__), 'oauth_api.json')
         #self.oath_api = service_account.Credentials.from_service_account_file(self.oath_api_path)
@@ -31,12 +24,37 @@ class RAGPipeline_call:
         self.table_id = os.getenv('TABLE_ID')  # Table ID from environment variable
         self.dataset_url = os.getenv('DATASET_URL')  # Dataset URL from environment variable
         print("dataset_url:", self.dataset_url)
+
+    @property
+    def credentials(self):
+        """Service account credentials, parsed once per process and shared with RAGPipeline_init"""
+        return load_credentials(self.credentials_path)
     
     
     def llm_call(self, system_prompt, user_prompt, llm):
         """Call the LLM with the provided prompts"""
+        from llama_index.core.llms import ChatMessage
         messages = [ChatMessage(role="system", content=system_prompt),
                     ChatMessage(role="user", content=user_prompt)]
         response = llm.chat(messages)
         return response
 
+    async def allm_call(self, system_prompt, user_prompt, llm):
+        """Async version of llm_call"""
+        from llama_index.core.llms import ChatMessage
+        messages = [ChatMessage(role="system", content=system_prompt),
+                    ChatMessage(role="user", content=user_prompt)]
+        return await llm.achat(messages)
+
+    async def aquery_many(self, questions, llm, sql_database, concurrency=8, verbose=True, **kwargs):
+        """Answer a batch of questions concurrently; results come back in order with per-stage timings"""
+        start = time.perf_counter()
+        runner = Async_Query_Runner(llm, sql_database, concurrency=concurrency, **kwargs)
+        results = await runner.aquery_many(questions)
+        if verbose:
+            runner.summary(results, time.perf_counter() - start)
+        return results
+
+    def stream_query(self, question, llm, sql_database, **kwargs):
+        """Answer one question as it is produced: SQL, row batches straight from the cursor, then answer tokens"""
+        return Streaming_Query_Runner(llm, sql_database, **kwargs).stream(question)
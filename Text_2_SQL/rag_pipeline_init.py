@@ -1,24 +1,17 @@
 #%%
-from llama_index.core import SQLDatabase, VectorStoreIndex
-import os 
-from sqlalchemy import MetaData, Table, Select, Column, Integer, String, DateTime, TIMESTAMP, Float  # SQLAlchemy for database operations
-from sqlalchemy.engine import create_engine
+import os
+from functools import lru_cache
 from sqlalchemy import text
-import pandas as pd  # Data manipulation library 
-from functools import reduce
-import sys
-from IPython.display import Markdown, display
-import pandas as pd
-import vertexai
-from google.oauth2 import service_account
-from google.cloud import bigquery
-from google.cloud import storage
-from llama_index.llms.google_genai import GoogleGenAI
 from dotenv import load_dotenv
-import chromadb
-from chromadb.utils import embedding_functions
-from llama_index.core.query_engine import NLSQLTableQueryEngine
-from llama_index.core.llms import ChatMessage
+from query_cache import Query_Cache, Cached_Query_Engine, state_watermark
+from rollups import Rollup_Manager, Query_Router
+from sql_backends import get_backend
+from schema_context import Schema_Context, Schema_Query_Engine
+from sql_guard import SQL_Guard
+from few_shot import Embedding_Cache, Few_Shot_Store, Few_Shot_Query_Engine, current_examples
+
+# vertexai, google.cloud, chromadb and llama_index take seconds to import, so they are
+# imported inside the methods that need them rather than at module load
 
 
 #%%
@@ -27,69 +20,215 @@ from llama_index.core.llms import ChatMessage
 load_dotenv()  # Load environment variables from .env file
 
 
+@lru_cache(maxsize=None)
+def load_credentials(credentials_path):
+    """Parse a service account file once per process, shared by RAGPipeline_init and RAGPipeline_call"""
+    from google.oauth2 import service_account
+    return service_account.Credentials.from_service_account_file(credentials_path)
+
+
+@lru_cache(maxsize=None)
+def routed_sql_database_class():
+    """Build Routed_SQLDatabase on first use so llama_index is only imported when a database is connected"""
+    from llama_index.core import SQLDatabase
+
+    class Routed_SQLDatabase(SQLDatabase):
+        """SQLDatabase that redirects generated SQL to the smallest rollup table able to answer it"""
+        def __init__(self, engine, router=None, schema_context=None, guard=None, **kwargs):
+            super().__init__(engine, **kwargs)
+            self.router = router
+            self.schema_context = schema_context
+            self.guard = guard
+
+        def get_single_table_info(self, table_name):
+            # Compact, question-specific context from table_schema.json instead of reflecting every query
+            if self.schema_context and table_name in self.schema_context:
+                info = self.schema_context.table_info(table_name)
+            else:
+                info = super().get_single_table_info(table_name)
+            # Verified question/SQL pairs closest to the question, set by Few_Shot_Query_Engine
+            examples = current_examples.get()
+            return f"{info}\n\n{examples.rstrip()}" if examples else info
+
+        def _route(self, command):
+            command, rollup = self.router.route(command)
+            if rollup:
+                print(f"Routed query to rollup {rollup}: {command}")
+            return command
+
+        def prepare_sql(self, command):
+            """Generated SQL as it will run: guarded on the ride table, then routed to a rollup if possible"""
+            route = self._route if self.router else None
+            if self.guard:
+                # Raises SQL_Guard_Error, which the query engine reports back instead of running the scan
+                command, _ = self.guard.check(command, route=route)
+            elif route:
+                command = route(command)
+            return command
+
+        def run_sql(self, command, prepared=False):
+            """prepared=True runs SQL that already went through prepare_sql, so it is not routed twice"""
+            return super().run_sql(command if prepared else self.prepare_sql(command))
+
+    return Routed_SQLDatabase
 
 
 class RAGPipeline_init:
-    def __init__(self):
-        """Initialize the RAG pipeline with necessary configurations"""
-        self.credentials_path = os.path.join(os.path.dirname(__file__), 'GOOGLE_APPLICATION_CREDENTIALS.json') #Place GCP credentials in the same directory 
-        self.credentials = service_account.Credentials.from_service_account_file(self.credentials_path)
-        
+    _shared = None  # process-wide warm instance, see shared()
+
+    def __init__(self, backend=None, llm=None, embedding_function=None):
+        """Initialize the RAG pipeline with necessary configurations
+
+        backend, llm and embedding_function replace the configured warehouse, Gemini and Google embeddings,
+        e.g. with the local stand-ins in text2sql_benchmark.py.
+        """
+        self.credentials_path = os.path.join(os.path.dirname(__file__), 'GOOGLE_APPLICATION_CREDENTIALS.json') #Place GCP credentials in the same directory
+
         self.oath_api_path = os.path.join(os.path.dirname(__file__), 'oauth_api.json')
-    
+
         self.bucket_name = os.getenv('GCS_BUCKET_NAME')  # GCS bucket name from environment variable
         self.project_id = os.getenv('PROJECT_ID')  # Project ID from environment variable
         self.dataset_id = os.getenv('DATASET_ID')  # Dataset ID from environment variable
         self.table_id = os.getenv('TABLE_ID')  # Table ID from environment variable
         self.dataset_url = os.getenv('DATASET_URL')  # Dataset URL from environment variable
-        self.google_ef = embedding_functions.GoogleGenerativeAiEmbeddingFunction(api_key=os.getenv('GOOGLE_AI_STUDIO_API_KEY'))
+        # SQL_BACKEND=duckdb runs against the local Parquet output instead of BigQuery
+        self.backend = backend or get_backend(project_id=self.project_id, dataset_id=self.dataset_id,
+                                              credentials_path=self.credentials_path)
+        # Ingestion state written by the data pipeline; cached answers are dropped whenever it changes
+        self.ingestion_state_path = os.getenv('INGESTION_STATE_PATH') or \
+            os.path.join(os.path.dirname(__file__), 'Data_Pipeline', 'ingestion_state.json')
+        # Clients below are created on first use and then reused
+        self._google_ef = embedding_function
+        self._llm = llm
+        self._embeddings = None
+        self._few_shot_store = None
+        self._sql_database = None
+        self._llm_components = {}
         print("dataset_url:", self.dataset_url)
 
-    def sql_alchemy_connect(self):
-
-        bqengine = create_engine(f"bigquery://{self.project_id}/{self.dataset_id}", 
-                                 credentials_path=self.credentials_path)
-        
-        sql_database = SQLDatabase(bqengine)
-
-        print("Connected to BigQuery using SQLAlchemy")
-        with bqengine.connect() as con:
-            rows = con.execute(text(f"SELECT * from {self.project_id}.{self.dataset_id}.bikeshare_data LIMIT 20"))
-            for row in rows:
-                if row is None:
+    @classmethod
+    def shared(cls):
+        """Return the process-wide instance, so clients and connections are built once and stay warm"""
+        if cls._shared is None:
+            cls._shared = cls()
+        return cls._shared
+
+    @property
+    def credentials(self):
+        """Service account credentials, only needed (and parsed) when talking to GCP"""
+        return load_credentials(self.credentials_path) if self.backend.name == 'bigquery' else None
+
+    @property
+    def google_ef(self):
+        if self._google_ef is None:
+            from chromadb.utils import embedding_functions
+            self._google_ef = embedding_functions.GoogleGenerativeAiEmbeddingFunction(api_key=os.getenv('GOOGLE_AI_STUDIO_API_KEY'))
+        return self._google_ef
+
+    @property
+    def llm(self):
+        """Gemini through llama_index, shared by every query engine built by llm_init"""
+        if self._llm is None:
+            from llama_index.llms.google_genai import GoogleGenAI
+            model_kwargs={
+                    "max_tokens": 10000,
+                    "temperature": 0.2
+                }
+            self._llm = GoogleGenAI(model = "gemini-2.5-flash",
+                        api_key=os.getenv('GOOGLE_AI_STUDIO_API_KEY'),
+                        **model_kwargs
+                        )
+        return self._llm
+
+    @property
+    def embeddings(self):
+        """google_ef behind a batching, memoizing cache shared by the query cache and the few-shot store"""
+        if self._embeddings is None:
+            self._embeddings = Embedding_Cache(self.google_ef)
+        return self._embeddings
+
+    @property
+    def few_shot_store(self):
+        """Verified question/SQL pairs saved by `python few_shot.py`, or None when the store is empty or disabled"""
+        if os.getenv('USE_FEW_SHOT', '1') == '0':
+            return None
+        if self._few_shot_store is None:
+            path = os.getenv('FEW_SHOT_PATH') or os.path.join(os.path.dirname(__file__), 'few_shot_store')
+            self._few_shot_store = Few_Shot_Store(path, embed_fn=self.embeddings,
+                                                  reuse_threshold=float(os.getenv('FEW_SHOT_REUSE_THRESHOLD', 0.95)))
+        return self._few_shot_store if self._few_shot_store.examples else None
+
+    def sql_alchemy_connect(self, probe=False):
+        """Connect the configured SQL backend (SQL_BACKEND=bigquery|duckdb) and wrap it for llama_index"""
+        if self._sql_database is not None:
+            return self._sql_database
+        engine = self.backend.create_engine()
+
+        # Set USE_ROLLUPS=0 to always scan bikeshare_data
+        router = Query_Router(Rollup_Manager(engine)) if os.getenv('USE_ROLLUPS', '1') != '0' else None
+        schema_context = Schema_Context(token_budget=int(os.getenv('SCHEMA_TOKEN_BUDGET', 300)))
+        # Budgets for generated SQL; SQL_RECENT_DAYS bounds row-level scans that have no Start_Time filter
+        guard = SQL_Guard(estimator=self.backend.cost_estimator(engine) if os.getenv('SQL_DRY_RUN', '1') != '0'
+                          else None,
+                          dialect=self.backend.name,
+                          max_bytes=float(os.getenv('SQL_MAX_GB', 10)) * 1024**3,
+                          max_rows=int(os.getenv('SQL_MAX_ROWS', 1000)),
+                          recent_days=int(os.getenv('SQL_RECENT_DAYS', 0)) or None)
+        sql_database = routed_sql_database_class()(engine, router=router, schema_context=schema_context,
+                                                   guard=guard, view_support=self.backend.view_support)
+
+        print(f"Connected to {self.backend.name} using SQLAlchemy")
+        if probe:
+            with engine.connect() as con:
+                rows = con.execute(text(f"SELECT * from {self.backend.table('bikeshare_data')} LIMIT 5")).fetchall()
+                if not rows:
                     print("No data found in the table.")
-                else: 
+                for row in rows:
                     print(row)
-            print("Executed SQL query successfully",rows)
+        self._sql_database = sql_database
         return sql_database
 
     def vertexai_connect(self, project_id, location):
         """Connect to Vertex AI"""
+        import vertexai
         vertexai.init(project=self.credentials['project_id'])
         print("Connected to Vertex AI")
 
-    
 
-    def llm_init(self, sql_database): 
-        
-        model_kwargs={
-                "max_tokens": 10000,
-                "temperature": 0.2
-            }
 
-        llm = GoogleGenAI(model = "gemini-2.5-flash",
-                    api_key=os.getenv('GOOGLE_AI_STUDIO_API_KEY'),
-                    **model_kwargs
-                    )
-       
+    def llm_init(self, sql_database, cache=True):
+        """Build the LLM and query engine for a database once; later calls return the same objects"""
+        key = (id(sql_database), cache)
+        if key in self._llm_components:
+            return self._llm_components[key]
+        from llama_index.core.query_engine import NLSQLTableQueryEngine
+
+        llm = self.llm
         query_engine = NLSQLTableQueryEngine(sql_database=sql_database,
                                              llm=llm,
                                              embed_model=self.google_ef,
                                              tables=['bikeshare_data'],
-                                             synthesize_response=True, 
-                                             verbose = True)  
+                                             synthesize_response=True,
+                                             verbose = True)
+        # Lets the table context retrieve the columns relevant to each question
+        query_engine = Schema_Query_Engine(query_engine)
+        if self.few_shot_store:
+            # Closest verified pairs become few-shot examples; near-identical questions run the stored SQL
+            query_engine = Few_Shot_Query_Engine(query_engine, self.few_shot_store, sql_database, llm)
+        if cache:
+            # Exact and embedding-similarity cache of generated SQL and results in front of the engine
+            query_cache = Query_Cache(max_entries=int(os.getenv('QUERY_CACHE_SIZE', 256)),
+                                      ttl=int(os.getenv('QUERY_CACHE_TTL', 3600)),
+                                      embed_fn=self.embeddings,
+                                      watermark_fn=state_watermark(self.ingestion_state_path))
+            query_engine = Cached_Query_Engine(query_engine, query_cache)
         #llm = Bedrock(model_id="anthropic.claude-3-5-sonnet-20240620-v1:0", model_kwargs=model_kwargs)
-        return llm, self.google_ef, query_engine
-    
+        self._llm_components[key] = (llm, self.google_ef, query_engine)
+        return self._llm_components[key]
+
+    def query_engine(self, cache=True):
+        """Connected database, LLM and query engine in one call, built on first use"""
+        return self.llm_init(self.sql_alchemy_connect(), cache=cache)
+
 
 # %%
@@ -0,0 +1,134 @@
+import time
+from numbers import Number
+
+from sqlalchemy import text
+
+from async_query import TEXT_TO_SQL_PROMPT, SYNTHESIS_PROMPT, parse_sql
+from schema_context import question_scope
+
+
+def stream_rows(engine, sql, batch_size=10000):
+    """Yield (column names, list of row tuples) batches as the cursor produces them, never the whole result"""
+    with engine.connect() as con:
+        result = con.execution_options(stream_results=True, yield_per=batch_size).execute(text(sql))
+        keys = list(result.keys())
+        for batch in result.partitions(batch_size):
+            yield keys, [tuple(row) for row in batch]
+
+
+def to_record_batch(keys, rows):
+    """Arrow RecordBatch from one batch of row tuples"""
+    import pyarrow as pa
+    columns = list(zip(*rows)) if rows else [[] for _ in keys]
+    return pa.RecordBatch.from_arrays([pa.array(column) for column in columns], names=keys)
+
+
+class Result_Summary:
+    """Bounded digest of a streamed result (row count, sample rows, numeric ranges) for the synthesis prompt"""
+    def __init__(self, sample_rows=20):
+        self.sample_rows = sample_rows
+        self.keys = []
+        self.rows = 0
+        self.sample = []
+        self.ranges = {}  # column -> [min, max, sum, count]
+
+    def update(self, keys, rows):
+        self.keys = keys
+        self.rows += len(rows)
+        self.sample.extend(rows[:self.sample_rows - len(self.sample)])
+        for i, key in enumerate(keys):
+            values = [row[i] for row in rows if isinstance(row[i], Number) and not isinstance(row[i], bool)]
+            if values:
+                low, high, total, count = self.ranges.get(key, [min(values), max(values), 0, 0])
+                self.ranges[key] = [min(low, min(values)), max(high, max(values)), total + sum(values),
+                                    count + len(values)]
+
+    def text(self):
+        lines = [f"{self.rows} rows with columns {', '.join(self.keys)}"]
+        if self.rows <= len(self.sample):
+            return '\n'.join(lines + [f"Rows: {self.sample}"])
+        lines.append(f"First {len(self.sample)} rows: {self.sample}")
+        for key, (low, high, total, count) in self.ranges.items():
+            lines.append(f"{key}: min {low}, max {high}, mean {total / count:.2f}")
+        return '\n'.join(lines)
+
+
+class Streaming_Query_Runner:
+    """Answer one question as a stream: SQL first, then row batches as they arrive, then answer tokens"""
+    def __init__(self, llm, sql_database, tables=('bikeshare_data',), batch_size=10000, sample_rows=20,
+                 arrow=False, synthesize_response=True, dialect=None, schema_context=None, guard=None,
+                 few_shot=None):
+        """llm needs complete(prompt) and, for token streaming, stream_complete(prompt)"""
+        self.llm = llm
+        self.sql_database = sql_database
+        self.tables = list(tables)
+        self.batch_size = batch_size
+        self.sample_rows = sample_rows
+        self.arrow = arrow  # yield pyarrow RecordBatches instead of lists of tuples
+        self.synthesize_response = synthesize_response
+        self.dialect = dialect or sql_database.engine.dialect.name
+        self.schema_context = schema_context or getattr(sql_database, 'schema_context', None)
+        self.guard = guard
+        self.few_shot = few_shot
+
+    def schema(self, question):
+        with question_scope(question):
+            return '\n\n'.join(self.schema_context.table_info(table)
+                               if self.schema_context and table in self.schema_context
+                               else self.sql_database.get_single_table_info(table) for table in self.tables)
+
+    def prepare(self, sql):
+        """Route and check the SQL the same way run_sql would, without executing it
+
+        A database with its own guard checks inside prepare_sql; self.guard only applies to one without,
+        and then checks the SQL before the database routes it, so each statement is guarded exactly once.
+        """
+        prepare_sql = getattr(self.sql_database, 'prepare_sql', None)
+        if self.guard and not getattr(self.sql_database, 'guard', None):
+            sql, _ = self.guard.check(sql, route=prepare_sql)
+            return sql
+        return prepare_sql(sql) if prepare_sql else sql
+
+    def _tokens(self, prompt):
+        """Answer text deltas as the LLM produces them; LLMs without streaming yield one chunk"""
+        if hasattr(self.llm, 'stream_complete'):
+            for chunk in self.llm.stream_complete(prompt):
+                if chunk.delta:
+                    yield chunk.delta
+        else:
+            yield self.llm.complete(prompt).text
+
+    def stream(self, question):
+        """Yield (kind, value) events: ('sql', str), ('rows', batch)..., ('token', str)..., ('timings', dict)"""
+        timings = {}
+        start = time.perf_counter()
+        matches = self.few_shot.search(question) if self.few_shot else []
+        sql = self.few_shot.reusable_sql(question, matches) if self.few_shot else None
+        if sql is None:
+            completion = self.llm.complete(TEXT_TO_SQL_PROMPT.format(
+                dialect=self.dialect, schema=self.schema(question), question=question,
+                examples=self.few_shot.prompt(matches) if self.few_shot else ''))
+            sql = parse_sql(completion.text)
+        sql = self.prepare(sql)
+        timings['generate_sql'] = time.perf_counter() - start
+        yield 'sql', sql
+
+        summary = Result_Summary(self.sample_rows)
+        for keys, rows in stream_rows(self.sql_database.engine, sql, self.batch_size):
+            timings.setdefault('first_row', time.perf_counter() - start)
+            summary.update(keys, rows)
+            yield 'rows', to_record_batch(keys, rows) if self.arrow else rows
+        timings['execute'] = time.perf_counter() - start - timings['generate_sql']
+        timings['rows'] = summary.rows
+
+        if self.synthesize_response:
+            # Only the bounded summary goes to the LLM, however many rows were streamed
+            synthesis_start = time.perf_counter()
+            result = summary.text()
+            timings['summary_chars'] = len(result)
+            for token in self._tokens(SYNTHESIS_PROMPT.format(question=question, sql=sql, result=result)):
+                timings.setdefault('first_token', time.perf_counter() - start)
+                yield 'token', token
+            timings['synthesize'] = time.perf_counter() - synthesis_start
+        timings['total'] = time.perf_counter() - start
+        yield 'timings', timings
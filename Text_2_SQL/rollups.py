@@ -0,0 +1,294 @@
+import os
+import re
+import time
+import argparse
+
+from sqlalchemy import text, inspect
+from sqlalchemy.engine import create_engine
+
+
+# Time bucket, per dialect, that each rollup stores in place of Start_Time
+BUCKETS = {
+    'duckdb': {'hour': "date_trunc('hour', Start_Time)",
+               'day': "date_trunc('day', Start_Time)",
+               'month': "date_trunc('month', Start_Time)"},
+    'bigquery': {'hour': "TIMESTAMP_TRUNC(Start_Time, HOUR)",
+                 'day': "TIMESTAMP_TRUNC(Start_Time, DAY)",
+                 'month': "TIMESTAMP_TRUNC(Start_Time, MONTH)"},
+    'sqlite': {'hour': "strftime('%Y-%m-%d %H:00:00', Start_Time)",
+               'day': "datetime(Start_Time, 'start of day')",
+               'month': "datetime(Start_Time, 'start of month')"},
+}
+PERCENTILE = {
+    'duckdb': "quantile_cont(Trip_Duration, {q})",
+    'bigquery': "APPROX_QUANTILES(Trip_Duration, 100)[OFFSET({p})]",
+}
+
+# Summary tables kept next to bikeshare_data, smallest first
+ROLLUPS = [
+    {'name': 'bikeshare_monthly_user_type',
+     'grain': 'month',
+     'dimensions': ['User_Type'],
+     'percentiles': False},
+    {'name': 'bikeshare_hourly_duration',
+     'grain': 'hour',
+     'dimensions': [],
+     'percentiles': True},
+    {'name': 'bikeshare_daily_station_pairs',
+     'grain': 'day',
+     'dimensions': ['ym_id', 'Start_Station_Id', 'Start_Station_Name', 'End_Station_Id', 'End_Station_Name'],
+     'percentiles': False},
+]
+# Columns every rollup stores besides its time bucket and dimensions
+MEASURES = ['trips', 'total_duration', 'duration_trips', 'min_duration', 'max_duration']
+SOURCE_COLUMNS = ['Trip_Id', 'Trip_Duration', 'Start_Station_Id', 'Start_Time', 'Start_Station_Name',
+                  'End_Station_Id', 'End_Time', 'End_Station_Name', 'Bike_Id', 'User_Type', 'Model', 'ym_id']
+GRAIN_ORDER = ['hour', 'day', 'month', 'year']
+# Coarsest grain a rollup may have to still answer an expression at this unit
+UNIT_GRAIN = {'year': 'month', 'isoyear': 'day', 'quarter': 'month', 'month': 'month',
+              'week': 'day', 'isoweek': 'day', 'day': 'day', 'date': 'day', 'dayofweek': 'day', 'dow': 'day',
+              'dayofyear': 'day', 'doy': 'day', 'hour': 'hour'}
+
+
+class Rollup_Manager:
+    """Build and incrementally maintain the ridership rollup tables"""
+    def __init__(self, engine, source='bikeshare_data', prefix=''):
+        """prefix qualifies table names, e.g. 'project.dataset.' on BigQuery"""
+        self.engine = engine
+        self.dialect = engine.dialect.name
+        self.source = source
+        self.prefix = prefix
+        self.buckets = BUCKETS[self.dialect]
+        self.rollups = ROLLUPS
+        self.percentiles = self.dialect in PERCENTILE  # SQLite has no percentile aggregate
+        self.sizes = {}  # rollup name -> row count after the last refresh
+
+    def select_sql(self, rollup, since=None):
+        """Aggregation query producing a rollup's rows, optionally only from the bucket containing since"""
+        bucket = self.buckets[rollup['grain']]
+        columns = [f"{bucket} AS Start_Time"] + rollup['dimensions']
+        measures = ["COUNT(*) AS trips",
+                    "SUM(Trip_Duration) AS total_duration",
+                    "COUNT(Trip_Duration) AS duration_trips",  # AVG divides by rides with a duration
+                    "MIN(Trip_Duration) AS min_duration",
+                    "MAX(Trip_Duration) AS max_duration"]
+        if rollup['percentiles'] and self.percentiles:
+            percentile = PERCENTILE[self.dialect]
+            measures += [f"{percentile.format(q=p / 100, p=p)} AS p{p}_duration" for p in (50, 90, 95)]
+        where = f" WHERE {bucket} >= :since" if since is not None else ""
+        group_by = ', '.join(str(i + 1) for i in range(len(columns)))
+        return (f"SELECT {', '.join(columns + measures)} FROM {self.prefix}{self.source}{where} "
+                f"GROUP BY {group_by}")
+
+    def _bucket_start(self, con, rollup, since):
+        """Start of the bucket containing since, in the database's own representation"""
+        bucket = self.buckets[rollup['grain']].replace('Start_Time', ':since')
+        if self.dialect == 'duckdb':
+            bucket = bucket.replace(':since', 'CAST(:since AS TIMESTAMP)')
+        elif self.dialect == 'bigquery':
+            bucket = bucket.replace(':since', 'TIMESTAMP(:since)')
+        return con.execute(text(f"SELECT {bucket}"), {'since': str(since)}).scalar()
+
+    def current(self):
+        """Names of the rollup tables that exist and already hold every measure"""
+        inspector = inspect(self.engine)
+        existing = set(inspector.get_table_names())
+        return {rollup['name'] for rollup in self.rollups if rollup['name'] in existing and
+                set(MEASURES) <= {c['name'].lower() for c in inspector.get_columns(rollup['name'])}}
+
+    def refresh(self, since=None, rebuild=False):
+        """Recompute every rollup from the bucket containing since onwards (default: the newest bucket)"""
+        existing = self.current()  # tables from before a measure was added are rebuilt
+        for rollup in self.rollups:
+            start = time.perf_counter()
+            table = f"{self.prefix}{rollup['name']}"
+            with self.engine.begin() as con:
+                if rebuild or rollup['name'] not in existing:
+                    con.execute(text(f"DROP TABLE IF EXISTS {table}"))
+                    con.execute(text(f"CREATE TABLE {table} AS {self.select_sql(rollup)}"))
+                else:
+                    # Only the buckets touched by newly ingested rides are recomputed
+                    start_from = since or con.execute(text(f"SELECT MAX(Start_Time) FROM {table}")).scalar()
+                    if start_from is not None:
+                        start_from = self._bucket_start(con, rollup, start_from)
+                        con.execute(text(f"DELETE FROM {table} WHERE Start_Time >= :since"), {'since': start_from})
+                    con.execute(text(f"INSERT INTO {table} {self.select_sql(rollup, since=start_from)}"),
+                                {'since': start_from} if start_from is not None else {})
+                self.sizes[rollup['name']] = con.execute(text(f"SELECT COUNT(*) FROM {table}")).scalar()
+            print(f"Refreshed {table}: {self.sizes[rollup['name']]} rows in {time.perf_counter() - start:.2f}s")
+        return self.sizes
+
+
+def _identifier(column):
+    """Pattern for a column name bare or quoted as "x", `x` or [x]; match it with re.I"""
+    return rf"""(?:{column}|"{column}"|`{column}`|\[{column}\])"""
+
+
+class Query_Router:
+    """Redirect generated SQL over bikeshare_data to the smallest rollup table that can answer it"""
+    def __init__(self, manager):
+        self.manager = manager
+        self.source = manager.source
+        self.enabled = None  # resolved on first use, once the rollup tables are known to exist
+        self.routed = {}
+        self.passed_through = 0
+
+    def _available(self):
+        if self.enabled is None:
+            existing = self.manager.current()
+            self.enabled = [r for r in self.manager.rollups if r['name'] in existing]
+            if self.enabled and not self.manager.sizes:
+                with self.manager.engine.connect() as con:
+                    for rollup in self.enabled:
+                        self.manager.sizes[rollup['name']] = con.execute(
+                            text(f"SELECT COUNT(*) FROM {self.manager.prefix}{rollup['name']}")).scalar()
+            self.enabled.sort(key=lambda r: self.manager.sizes.get(r['name'], 0))
+        return self.enabled
+
+    @staticmethod
+    def _literal_grain(literal):
+        """Finest grain a timestamp literal is aligned to"""
+        match = re.fullmatch(r"(\d{4})(?:-(\d{2}))?(?:-(\d{2}))?(?:[ T](\d{2}):(\d{2})(?::(\d{2}))?)?", literal)
+        if not match:
+            return None
+        _, month, day, hour, minute, second = match.groups()
+        if (minute or '00') != '00' or (second or '00') != '00':
+            return None
+        if hour and hour != '00':
+            return 'hour'
+        if day and day != '01':
+            return 'day'
+        if month and month != '01':
+            return 'month'
+        return 'year'
+
+    @staticmethod
+    def _format_grain(fmt):
+        """Finest grain a strftime-style format string exposes"""
+        if re.search(r'%[HIMSpT]', fmt):
+            return 'hour' if not re.search(r'%[MST]', fmt) else None
+        if re.search(r'%[djaAwuUVWFDe]', fmt):
+            return 'day'
+        return 'month'
+
+    def _start_time_grain(self, sql, match):
+        """Coarsest rollup grain that answers this use of Start_Time exactly, or None"""
+        before, after = sql[:match.start()], sql[match.end():]
+        extract = re.search(r"EXTRACT\s*\(\s*(\w+)\s+FROM\s*$", before, re.I)
+        if extract:
+            return UNIT_GRAIN.get(extract.group(1).lower())
+        if re.search(r"\bDATE\s*\(\s*$", before, re.I) and re.match(r"\s*\)", after):
+            return 'day'
+        trunc = re.search(r"date_trunc\s*\(\s*'(\w+)'\s*,\s*$", before, re.I)
+        if trunc:
+            return UNIT_GRAIN.get(trunc.group(1).lower())
+        trunc = re.match(r"\s*,\s*(\w+)\s*\)", after)
+        if trunc and re.search(r"\b(TIMESTAMP_TRUNC|DATETIME_TRUNC|DATE_TRUNC)\s*\(\s*(DATE\s*\(\s*)?$", before, re.I):
+            return UNIT_GRAIN.get(trunc.group(1).lower())
+        fmt = re.search(r"\b(strftime|FORMAT_TIMESTAMP|FORMAT_DATETIME|FORMAT_DATE)\s*\(\s*'([^']*)'\s*,\s*$", before, re.I)
+        if fmt:
+            return self._format_grain(fmt.group(2))
+        fmt = re.match(r"\s*,\s*'([^']*)'\s*\)", after)
+        if fmt and re.search(r"\bstrftime\s*\(\s*$", before, re.I):
+            return self._format_grain(fmt.group(1))
+        # Half-open ranges on bucket-aligned literals: Start_Time >= '2024-01-01' AND Start_Time < '2025-01-01'
+        compare = re.match(r"\s*(>=|<)\s*(?:TIMESTAMP\s*)?'([^']*)'", after, re.I)
+        if compare:
+            return self._literal_grain(compare.group(2))
+        compare = re.search(r"'([^']*)'\s*(<=|>)\s*$", before)
+        if compare:
+            return self._literal_grain(compare.group(1))
+        return None
+
+    def _rewrite(self, sql, rollup):
+        """Return sql rewritten against rollup, or None if the rollup cannot answer it exactly"""
+        grain = GRAIN_ORDER.index(rollup['grain'])
+        is_hour_bucket = rollup['grain'] == 'hour'
+        # A rollup holds one row per bucket, not per ride: raw projections must read the ride table
+        if re.search(r"\bSELECT\s+(?:DISTINCT\s+)?(?:\w+\.)?\*|,\s*(?:\w+\.)?\*", sql, re.I):
+            return None
+
+        duration = _identifier('Trip_Duration')
+        # COALESCE: COUNT over no rows is 0, but SUM over no rollup rows is NULL
+        rewritten = re.sub(rf"COUNT\s*\(\s*(\*|1|{_identifier('Trip_Id')})\s*\)", "COALESCE(SUM(trips), 0)", sql,
+                           flags=re.I)
+        rewritten = re.sub(rf"SUM\s*\(\s*{duration}\s*\)", "SUM(total_duration)", rewritten, flags=re.I)
+        rewritten = re.sub(rf"AVG\s*\(\s*{duration}\s*\)", "(SUM(total_duration) * 1.0 / SUM(duration_trips))",
+                           rewritten, flags=re.I)
+        rewritten = re.sub(rf"MIN\s*\(\s*{duration}\s*\)", "MIN(min_duration)", rewritten, flags=re.I)
+        rewritten = re.sub(rf"MAX\s*\(\s*{duration}\s*\)", "MAX(max_duration)", rewritten, flags=re.I)
+        if rollup['percentiles'] and self.manager.percentiles:
+            for p in (50, 90, 95):
+                patterns = [rf"quantile_cont\s*\(\s*{duration}\s*,\s*0?\.{p // 10}{p % 10 or ''}\s*\)",
+                            rf"APPROX_QUANTILES\s*\(\s*{duration}\s*,\s*100\s*\)\s*\[\s*OFFSET\s*\(\s*{p}\s*\)\s*\]"]
+                if p == 50:
+                    patterns.append(rf"median\s*\(\s*{duration}\s*\)")
+                for pattern in patterns:
+                    rewritten = re.sub(pattern, f"MAX(p{p}_duration)", rewritten, flags=re.I)
+        if rewritten == sql and not re.search(r"\bGROUP\s+BY\b|\bSELECT\s+DISTINCT\b", sql, re.I):
+            return None  # no translated aggregate and no grouping: a per-ride projection
+        # Aggregates left untranslated would count or sum rollup rows instead of rides
+        if re.search(r"\bCOUNT\s*\(\s*(?!DISTINCT\b)|\bAVG\s*\(|\bSUM\s*\(\s*(?!(trips|total_duration|duration_trips)\s*\))",
+                     rewritten, re.I):
+            return None
+
+        # Every remaining column, in any case and quoted or not, must be a rollup dimension, or Start_Time
+        # used at a compatible grain; anything else is missing from the rollup and must read the ride table
+        allowed = {column.lower() for column in rollup['dimensions']}
+        for column in SOURCE_COLUMNS:
+            for match in re.finditer(rf"(?<![\w.]){_identifier(column)}(?![\w.])", rewritten, re.I):
+                if column.lower() in allowed or rewritten[:match.start()].count("'") % 2:
+                    continue  # dimension, or text inside a string literal
+                if column != 'Start_Time':
+                    return None
+                needed = self._start_time_grain(rewritten, match)
+                if needed is None or GRAIN_ORDER.index(needed) < grain:
+                    return None
+        if 'p50_duration' in rewritten or 'p90_duration' in rewritten or 'p95_duration' in rewritten:
+            # Percentiles cannot be re-aggregated: each group must be exactly one hourly bucket
+            if not is_hour_bucket or not re.search(
+                    r"GROUP\s+BY.*(date_trunc\s*\(\s*'hour'|TIMESTAMP_TRUNC\s*\(\s*Start_Time\s*,\s*HOUR)",
+                    rewritten, re.I | re.S):
+                return None
+        return re.sub(rf"\b((?:[\w-]+\.)*){self.source}\b", rf"\g<1>{rollup['name']}", rewritten, count=1)
+
+    def route(self, sql):
+        """Return (sql, rollup name) with sql redirected to the smallest covering rollup, else (sql, None)"""
+        stripped = sql.strip().rstrip(';')
+        # Only single-table aggregations over the ride table are candidates
+        if not re.search(rf"\bFROM\s+`?(?:[\w-]+\.)*{self.source}`?(\s+(AS\s+)?\w+)?\s*(WHERE|GROUP|ORDER|LIMIT|$)",
+                         stripped, re.I) or re.search(r"\b(JOIN|UNION|OVER)\b|\(\s*SELECT", stripped, re.I):
+            self.passed_through += 1
+            return sql, None
+        alias = re.search(rf"\bFROM\s+`?(?:[\w-]+\.)*{self.source}`?\s+(?:AS\s+)?(?!WHERE|GROUP|ORDER|LIMIT)(\w+)",
+                          stripped, re.I)
+        if alias:
+            stripped = re.sub(rf"\b{alias.group(1)}\.", "", stripped)
+            stripped = re.sub(rf"(\b{self.source}`?)\s+(AS\s+)?{alias.group(1)}\b", r"\1", stripped, flags=re.I)
+
+        for rollup in self._available():
+            rewritten = self._rewrite(stripped, rollup)
+            if rewritten is not None:
+                self.routed[rollup['name']] = self.routed.get(rollup['name'], 0) + 1
+                return rewritten, rollup['name']
+        self.passed_through += 1
+        return sql, None
+
+
+if __name__ == "__main__":
+    from sql_backends import get_backend
+
+    parser = argparse.ArgumentParser(description="Refresh the ridership rollup tables")
+    parser.add_argument('--url', default=None,
+                        help="SQLAlchemy URL of the warehouse; defaults to the SQL_BACKEND engine")
+    parser.add_argument('--since', default=None, help="recompute buckets from this timestamp onwards")
+    parser.add_argument('--rebuild', action='store_true', help="drop and rebuild every rollup")
+    args = parser.parse_args()
+
+    if args.url:
+        engine = create_engine(args.url)
+    else:
+        engine = get_backend(project_id=os.getenv('PROJECT_ID'), dataset_id=os.getenv('DATASET_ID'),
+                             credentials_path=os.path.join(os.path.dirname(__file__),
+                                                           'GOOGLE_APPLICATION_CREDENTIALS.json')).create_engine()
+    Rollup_Manager(engine).refresh(since=args.since, rebuild=args.rebuild)
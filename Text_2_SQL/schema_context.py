@@ -0,0 +1,174 @@
+import os
+import re
+import json
+import math
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import lru_cache
+
+
+SCHEMA_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'table_schema.json')
+# table_schema.json entries by separator, keyed by the warehouse table they describe
+TABLES = {'bikeshare_data': 'table_1', 'stations_data': 'table_2'}
+
+STOPWORDS = {'a', 'an', 'and', 'are', 'by', 'did', 'do', 'each', 'for', 'how', 'in', 'is', 'many', 'of', 'on',
+             'or', 'per', 'the', 'to', 'was', 'were', 'what', 'where', 'which', 'with'}
+# Timestamp columns answer questions about periods even when their description does not say so
+TIME_TERMS = 'date time year month week day hour when'
+
+# Question currently being answered, so get_single_table_info can tailor the context to it
+current_question = ContextVar('current_question', default=None)
+
+
+def count_tokens(text):
+    """Rough token count (about four characters per token) used for the prompt budget"""
+    return len(text) // 4 + 1
+
+
+def _terms(text):
+    """Lower-case word terms with a crude plural strip; column names are split on underscores"""
+    words = re.findall(r'[a-z0-9]+', text.replace('_', ' ').lower())
+    return [w[:-1] if len(w) > 3 and w.endswith('s') else w for w in words if w not in STOPWORDS]
+
+
+@lru_cache(maxsize=None)
+def load_table_schema(schema_path=SCHEMA_PATH):
+    with open(schema_path, 'r') as f:
+        return json.load(f)
+
+
+class Schema_Context:
+    """Compact, token-budgeted schema prompts from table_schema.json, with per-question column retrieval"""
+    def __init__(self, schema_path=SCHEMA_PATH, token_budget=300, top_k=4, max_contexts=1024):
+        self.schema_path = schema_path
+        self.token_budget = token_budget
+        self.top_k = top_k
+        self.max_contexts = max_contexts
+        # (table, question) -> prompt, least recently used first; per instance, so it dies with it
+        self.contexts = OrderedDict()
+        self.lock = threading.Lock()
+        self.tables = {}
+        self._load(load_table_schema(schema_path))
+
+    def _load(self, schema):
+        entries = {entry['separator']: entry for entry in schema['tables']}
+        tables = {table: self._build(table, entries[separator])
+                  for table, separator in TABLES.items() if separator in entries}
+        with self.lock:
+            self.tables = tables
+            self.contexts.clear()
+
+    def reload(self):
+        """Re-read table_schema.json (after it was edited) and drop every cached prompt"""
+        load_table_schema.cache_clear()
+        self._load(load_table_schema(self.schema_path))
+
+    @staticmethod
+    def _column_types(create_statement):
+        """Column -> type from the CREATE TABLE statement (untyped columns map to '')"""
+        body = create_statement[create_statement.index('(') + 1:create_statement.rindex(')')]
+        types = {}
+        for column in body.split(','):
+            parts = column.split()
+            if parts:
+                types[parts[0]] = ' '.join(parts[1:])
+        return types
+
+    def _build(self, table, entry):
+        """Precompute the header, column list, per-column hint lines and the term index for one table"""
+        types = self._column_types(entry['schema'])
+        columns = [column['name'] for column in entry['columns']]
+        header = f"Table {table}: {entry['description']}\nColumns: " + \
+            ', '.join(f"{name} {types.get(name, '')}".strip() for name in columns)
+        hints, postings = {}, {}
+        for column in entry['columns']:
+            name = column['name']
+            synonyms = column.get('synonyms', [])
+            hints[name] = f"- {name}: {column['description']}" + \
+                (f" (also: {', '.join(synonyms)})" if synonyms else '')
+            words = [name, column['description']] + synonyms
+            if types.get(name) == 'timestamp':
+                words.append(TIME_TERMS)
+            for term in set(_terms(' '.join(words))):
+                postings.setdefault(term, set()).add(name)
+        # Rare terms (e.g. 'member') say more about a column than common ones; terms shared by
+        # most columns (e.g. 'trip') say nothing and are dropped
+        postings = {term: names for term, names in postings.items() if len(names) <= len(columns) // 2}
+        idf = {term: math.log(1 + len(columns) / len(names)) for term, names in postings.items()}
+        return {'header': header, 'hints': hints, 'postings': postings, 'idf': idf, 'columns': columns}
+
+    def relevant_columns(self, table, question):
+        """Columns of a table ranked by how well their name, description and synonyms match the question"""
+        info = self.tables[table]
+        scores = {}
+        for term in set(_terms(question)):
+            for name in info['postings'].get(term, ()):
+                scores[name] = scores.get(name, 0.0) + info['idf'][term]
+        # Ties go to the column listed first in the schema (Start_Time before End_Time)
+        ranked = sorted(scores, key=lambda name: (-scores[name], info['columns'].index(name)))
+        return ranked[:self.top_k]
+
+    def context(self, table, question=None):
+        """Schema prompt for a table: every column name, plus descriptions of the relevant ones within budget"""
+        key = (table, question)
+        with self.lock:
+            text = self.contexts.get(key)
+            if text is not None:
+                self.contexts.move_to_end(key)
+                return text
+        text = self._context(table, question)
+        with self.lock:
+            self.contexts[key] = text
+            while len(self.contexts) > self.max_contexts:
+                self.contexts.popitem(last=False)
+        return text
+
+    def _context(self, table, question):
+        info = self.tables[table]
+        text = info['header']
+        if question:
+            lines = []
+            for name in self.relevant_columns(table, question):
+                candidate = '\n'.join([text, 'Relevant columns:'] + lines + [info['hints'][name]])
+                if count_tokens(candidate) > self.token_budget:
+                    break
+                lines.append(info['hints'][name])
+            if lines:
+                text = '\n'.join([text, 'Relevant columns:'] + lines)
+        return text
+
+    def table_info(self, table):
+        """Drop-in for SQLDatabase.get_single_table_info, using the question in scope (no reflection)"""
+        return self.context(table, current_question.get())
+
+    def __contains__(self, table):
+        return table in self.tables
+
+
+@contextmanager
+def question_scope(question):
+    """Publish the question being answered to schema lookups made while answering it"""
+    token = current_question.set(question)
+    try:
+        yield
+    finally:
+        current_question.reset(token)
+
+
+class Schema_Query_Engine:
+    """Wrap a query engine so its schema lookups see the question being answered"""
+    def __init__(self, query_engine):
+        self.query_engine = query_engine
+
+    def query(self, question):
+        with question_scope(str(question)):
+            return self.query_engine.query(question)
+
+    async def aquery(self, question):
+        with question_scope(str(question)):
+            return await self.query_engine.aquery(question)
+
+    def __getattr__(self, name):
+        return getattr(self.query_engine, name)
@@ -0,0 +1,94 @@
+import os
+
+from sqlalchemy.engine import create_engine
+
+from sql_guard import BigQuery_Cost_Estimator, Static_Cost_Estimator
+
+
+DATA_PIPELINE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'Data_Pipeline')
+
+
+class BigQuery_Backend:
+    """The production warehouse: bikeshare_data in a BigQuery dataset"""
+    name = 'bigquery'
+    view_support = False
+
+    def __init__(self, project_id, dataset_id, credentials_path):
+        self.project_id = project_id
+        self.dataset_id = dataset_id
+        self.credentials_path = credentials_path
+
+    def create_engine(self):
+        return create_engine(f"bigquery://{self.project_id}/{self.dataset_id}",
+                             credentials_path=self.credentials_path)
+
+    def table(self, name):
+        """Fully qualified table name for hand-written SQL"""
+        return f"{self.project_id}.{self.dataset_id}.{name}"
+
+    def cost_estimator(self, engine):
+        """Dry runs report the bytes BigQuery would bill for a query"""
+        return BigQuery_Cost_Estimator(self.project_id, self.credentials_path)
+
+
+class DuckDB_Backend:
+    """Embedded DuckDB reading the Parquet output of the data pipeline in place, for offline runs and tests"""
+    name = 'duckdb'
+    view_support = True  # bikeshare_data is a view over the Parquet files, not a copy
+
+    def __init__(self, database_path=':memory:', dataset_path=None, stations_path=None):
+        """dataset_path is the month-partitioned directory or a single Parquet file"""
+        self.database_path = database_path
+        self.dataset_path = dataset_path or os.path.join(DATA_PIPELINE_DIR, 'bike_share_data')
+        self.stations_path = stations_path
+
+    def _source(self, path):
+        """read_parquet call for a partitioned directory or a single file/glob"""
+        path = os.path.abspath(path).replace("'", "''")
+        if os.path.isdir(path):
+            # ym_id is stored in the files; the month directories only group them, so the view keeps
+            # the same columns as the flat output
+            return f"read_parquet('{path}/**/*.parquet', hive_partitioning = false)"
+        return f"read_parquet('{path}')"
+
+    def setup_sql(self):
+        """Statements that expose the Parquet data under the warehouse table names"""
+        statements = [f"CREATE OR REPLACE VIEW bikeshare_data AS SELECT * FROM {self._source(self.dataset_path)}"]
+        if self.stations_path and os.path.exists(self.stations_path):
+            statements.append(f"CREATE OR REPLACE VIEW stations_data AS SELECT * FROM {self._source(self.stations_path)}")
+        return statements
+
+    def create_engine(self):
+        # Requires the duckdb-engine SQLAlchemy dialect
+        import duckdb
+        from duckdb_engine import ConnectionWrapper
+        from sqlalchemy import text
+        from sqlalchemy.pool import QueuePool
+
+        # One database instance, so an in-memory database is the same one for every query; each pooled
+        # connection is its own cursor on it, so concurrent executor threads never share a connection
+        database = duckdb.connect(self.database_path)
+        engine = create_engine("duckdb://", creator=lambda: ConnectionWrapper(database.cursor()), poolclass=QueuePool)
+        with engine.begin() as con:
+            for statement in self.setup_sql():
+                con.execute(text(statement))
+        return engine
+
+    def table(self, name):
+        return name
+
+    def cost_estimator(self, engine):
+        """No billing locally; the estimate still keeps accidental full scans of large exports in check"""
+        return Static_Cost_Estimator(engine)
+
+
+def get_backend(name=None, project_id=None, dataset_id=None, credentials_path=None):
+    """Backend selected by SQL_BACKEND ('bigquery' by default, or 'duckdb')"""
+    name = name or os.getenv('SQL_BACKEND', 'bigquery')
+    if name == 'duckdb':
+        return DuckDB_Backend(database_path=os.getenv('DUCKDB_PATH', ':memory:'),
+                              dataset_path=os.getenv('PARQUET_PATH'),
+                              stations_path=os.getenv('STATIONS_PATH'))
+    if name == 'bigquery':
+        return BigQuery_Backend(project_id, dataset_id, credentials_path)
+    raise ValueError(f"Unknown SQL backend: {name}")
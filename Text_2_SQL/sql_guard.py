@@ -0,0 +1,145 @@
+import re
+
+from sqlalchemy import text
+
+
+# Columns kept when the LLM writes SELECT * over the ride table
+DEFAULT_COLUMNS = ['Trip_Id', 'Trip_Duration', 'Start_Station_Id', 'Start_Time', 'End_Station_Id', 'End_Time',
+                   'User_Type']
+# Approximate stored width per column, used when no dry run is available
+COLUMN_BYTES = {'Trip_Id': 8, 'Trip_Duration': 8, 'Start_Station_Id': 8, 'Start_Time': 8, 'Start_Station_Name': 24,
+                'End_Station_Id': 8, 'End_Time': 8, 'End_Station_Name': 24, 'Bike_Id': 8, 'User_Type': 14,
+                'Model': 8, 'ym_id': 10}
+RECENT_FILTER = {
+    'bigquery': "Start_Time >= TIMESTAMP_SUB(CURRENT_TIMESTAMP(), INTERVAL {days} DAY)",
+    'duckdb': "Start_Time >= current_timestamp - INTERVAL {days} DAY",
+    'sqlite': "Start_Time >= datetime('now', '-{days} days')",
+}
+AGGREGATE = re.compile(r"\b(COUNT|SUM|AVG|MIN|MAX|APPROX_\w+|quantile\w*|median|STDDEV\w*)\s*\(|\bGROUP\s+BY\b|"
+                       r"\bDISTINCT\b", re.I)
+WRITE_STATEMENT = re.compile(r"\b(INSERT|UPDATE|DELETE|MERGE|DROP|CREATE|ALTER|TRUNCATE|GRANT)\b", re.I)
+# String literals are matched first, so '--' or '/*' inside one is never taken for a comment
+LITERAL_OR_COMMENT = re.compile(r"'(?:[^']|'')*'|--[^\n]*|/\*.*?\*/", re.S)
+# Trailing LIMIT n, LIMIT n OFFSET m or LIMIT m, n; the row count is the 'rows' group
+LIMIT_CLAUSE = re.compile(r"\bLIMIT\s+(?:\d+\s*,\s*)?(?P<rows>\d+)(?:\s+OFFSET\s+\d+)?\s*$", re.I)
+
+
+class SQL_Guard_Error(ValueError):
+    """Generated SQL refused before reaching the warehouse"""
+
+
+class BigQuery_Cost_Estimator:
+    """Bytes a query would bill, from a BigQuery dry run (no slots used, nothing charged)"""
+    def __init__(self, project_id, credentials_path=None):
+        self.project_id = project_id
+        self.credentials_path = credentials_path
+        self._client = None
+
+    def estimate(self, sql):
+        from google.cloud import bigquery
+        if self._client is None:
+            self._client = bigquery.Client.from_service_account_json(self.credentials_path, project=self.project_id) \
+                if self.credentials_path else bigquery.Client(project=self.project_id)
+        job = self._client.query(sql, job_config=bigquery.QueryJobConfig(dry_run=True, use_query_cache=False))
+        return job.total_bytes_processed
+
+
+class Static_Cost_Estimator:
+    """Columnar scan estimate: table rows times the width of every column the query touches"""
+    def __init__(self, engine=None, row_counts=None, column_bytes=COLUMN_BYTES):
+        """row_counts maps table name -> rows; missing tables are counted once through engine"""
+        self.engine = engine
+        self.row_counts = dict(row_counts or {})
+        self.column_bytes = column_bytes
+
+    def rows(self, table):
+        if table not in self.row_counts:
+            with self.engine.connect() as con:
+                self.row_counts[table] = con.execute(text(f"SELECT COUNT(*) FROM {table}")).scalar()
+        return self.row_counts[table]
+
+    def estimate(self, sql):
+        tables = re.findall(r"\b(?:FROM|JOIN)\s+`?((?:[\w-]+\.)*\w+)`?", sql, re.I)
+        if re.search(r"SELECT\s+(\w+\.)?\*", sql, re.I):
+            width = sum(self.column_bytes.values())
+        else:
+            # Rollup measures are as wide as an integer column
+            measures = r"\b(trips|total_duration|duration_trips|min_duration|max_duration|p\d\d_duration)\b"
+            width = sum(size for column, size in self.column_bytes.items() if re.search(rf"\b{column}\b", sql)) + \
+                8 * len(set(re.findall(measures, sql)))
+        return sum(self.rows(table.split('.')[-1]) for table in tables) * max(width, 8)
+
+
+class SQL_Guard:
+    """Validate generated SQL, bound unbounded scans and enforce a bytes-scanned budget before execution"""
+    def __init__(self, estimator=None, dialect='bigquery', table='bikeshare_data', max_bytes=10 * 1024**3,
+                 max_rows=1000, recent_days=None, default_columns=DEFAULT_COLUMNS):
+        """recent_days adds a Start_Time window to row-level scans that have no Start_Time filter"""
+        self.estimator = estimator
+        self.dialect = dialect
+        self.table = table
+        self.max_bytes = max_bytes
+        self.max_rows = max_rows
+        self.recent_days = recent_days
+        self.default_columns = default_columns
+        self.rejected = 0
+        self.rewritten = 0
+
+    def _strip(self, sql):
+        """Single statement without trailing semicolons or comments"""
+        sql = LITERAL_OR_COMMENT.sub(lambda m: m.group() if m.group().startswith("'") else " ", sql)
+        sql = sql.strip().rstrip(';').strip()
+        if ';' in re.sub(r"'[^']*'", "''", sql):
+            raise SQL_Guard_Error("Only a single SQL statement may be executed")
+        if not re.match(r"(SELECT|WITH)\b", sql, re.I) or WRITE_STATEMENT.search(re.sub(r"'[^']*'", "''", sql)):
+            raise SQL_Guard_Error("Only read-only SELECT queries may be executed")
+        return sql
+
+    def _insert_filter(self, sql, condition):
+        """AND a condition into the outer query's WHERE clause, creating one if needed"""
+        where = re.search(r"\bWHERE\b", sql, re.I)
+        if where:
+            tail = re.search(r"\b(GROUP\s+BY|ORDER\s+BY|LIMIT|HAVING)\b", sql[where.end():], re.I)
+            end = where.end() + tail.start() if tail else len(sql)
+            return f"{sql[:where.start()]}WHERE {condition} AND ({sql[where.end():end].strip()}) {sql[end:]}".strip()
+        tail = re.search(r"\b(GROUP\s+BY|ORDER\s+BY|LIMIT|HAVING)\b", sql, re.I)
+        end = tail.start() if tail else len(sql)
+        return f"{sql[:end].rstrip()} WHERE {condition} {sql[end:]}".strip()
+
+    def rewrite(self, sql):
+        """Return sql with projection pruning, a Start_Time window and a LIMIT applied where it scans raw rows"""
+        sql = self._strip(sql)
+        scans_rides = re.search(rf"\bFROM\s+`?(?:[\w-]+\.)*{self.table}`?", sql, re.I) and \
+            not re.search(r"\bJOIN\b|\(\s*SELECT", sql, re.I)
+        if not scans_rides or AGGREGATE.search(sql):
+            return sql  # aggregates return few rows; their cost is checked against the budget instead
+
+        sql = re.sub(r"^SELECT\s+\*", f"SELECT {', '.join(self.default_columns)}", sql, flags=re.I)
+        if self.recent_days and not re.search(r"\bWHERE\b.*\bStart_Time\b", sql, re.I | re.S):
+            sql = self._insert_filter(sql, RECENT_FILTER[self.dialect].format(days=int(self.recent_days)))
+        limit = LIMIT_CLAUSE.search(sql)
+        if limit is None:
+            sql = f"{sql} LIMIT {self.max_rows}"
+        elif int(limit.group('rows')) > self.max_rows:
+            sql = f"{sql[:limit.start('rows')]}{self.max_rows}{sql[limit.end('rows'):]}"  # any OFFSET is kept
+        return sql
+
+    def check(self, sql, route=None):
+        """Return the SQL to execute and its estimated bytes, or raise SQL_Guard_Error
+
+        route (e.g. a rollup router's sql -> sql) is applied after the rewrite, so pruning and the LIMIT
+        are decided on the ride table while the budget is checked against the table that actually runs.
+        """
+        guarded = self.rewrite(sql)
+        if guarded != sql.strip().rstrip(';').strip():
+            self.rewritten += 1
+            print(f"SQL guard rewrote query: {guarded}")
+        if route:
+            guarded = route(guarded)
+        estimated = self.estimator.estimate(guarded) if self.estimator else None
+        if estimated is not None and estimated > self.max_bytes:
+            self.rejected += 1
+            raise SQL_Guard_Error(f"Query would scan about {estimated / 1024**3:.2f} GB, over the "
+                                  f"{self.max_bytes / 1024**3:.2f} GB budget. Add a filter on Start_Time "
+                                  f"or aggregate the result.")
+        return guarded, estimated
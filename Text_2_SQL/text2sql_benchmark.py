@@ -0,0 +1,591 @@
+import io
+import os
+import re
+import sys
+import argparse
+import contextlib
+import json
+import hashlib
+import time
+import asyncio
+import subprocess
+import tempfile
+import tracemalloc
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import event, text
+from sqlalchemy.engine import create_engine
+from llama_index.core.llms import CustomLLM, CompletionResponse, LLMMetadata
+from llama_index.core.llms.callbacks import llm_completion_callback
+
+from async_query import Async_Query_Runner
+from query_cache import Query_Cache
+from rag_pipeline_call import RAGPipeline_call
+from rag_pipeline_init import RAGPipeline_init, routed_sql_database_class
+from rollups import Rollup_Manager, Query_Router
+from few_shot import Embedding_Cache, Few_Shot_Store
+from result_stream import Streaming_Query_Runner
+from sql_guard import SQL_Guard, SQL_Guard_Error, Static_Cost_Estimator
+
+
+QUESTIONS = {
+    "How many trips were taken in total?":
+        "SELECT COUNT(*) AS trips FROM bikeshare_data",
+    "What is the number of total trips taken in 2023 by month?":
+        "SELECT strftime('%m', Start_Time) AS month, COUNT(*) AS trips FROM bikeshare_data "
+        "WHERE Start_Time >= '2023-01-01' AND Start_Time < '2024-01-01' GROUP BY month ORDER BY month",
+    "How many trips did each user type take?":
+        "SELECT User_Type, COUNT(*) AS trips FROM bikeshare_data GROUP BY User_Type",
+    "What is the average trip duration by user type?":
+        "SELECT User_Type, AVG(Trip_Duration) AS avg_duration FROM bikeshare_data GROUP BY User_Type",
+    "What are the top 5 most popular starting stations?":
+        "SELECT Start_Station_Id, COUNT(*) AS trips FROM bikeshare_data GROUP BY Start_Station_Id "
+        "ORDER BY trips DESC LIMIT 5",
+    "Which hour of the day has the most trips?":
+        "SELECT strftime('%H', Start_Time) AS hour, COUNT(*) AS trips FROM bikeshare_data "
+        "GROUP BY hour ORDER BY trips DESC LIMIT 1",
+}
+# A question whose answer is the whole table, for the streaming benchmark
+LARGE_QUESTION = {"List every trip with its start time and duration.":
+                  "SELECT Trip_Id, Start_Time, Trip_Duration FROM bikeshare_data"}
+
+# Recurring workload: repeats of known questions and rewordings of them
+PARAPHRASES = {
+    "how many trips were taken in total": "How many trips were taken in total?",
+    "How many trips did each user type take": "How many trips did each user type take?",
+    "What was the average trip duration for each user type?": "What is the average trip duration by user type?",
+    "Which are the top 5 starting stations by popularity?": "What are the top 5 most popular starting stations?",
+}
+
+# Generated SQL the guard has to rewrite or refuse
+RISKY_QUESTIONS = {
+    "Show me the trips.": "SELECT * FROM bikeshare_data",
+    "List 5000 trips by casual members.": "SELECT Trip_Id, Start_Time FROM bikeshare_data "
+                                          "WHERE User_Type = 'casual member' LIMIT 5000",
+    "Delete the test trips.": "DELETE FROM bikeshare_data WHERE Trip_Duration < 60",
+    "Count trips, then drop the table.": "SELECT COUNT(*) FROM bikeshare_data; DROP TABLE bikeshare_data",
+    "Which bikes were used the most?": "SELECT Bike_Id, Start_Station_Name, End_Station_Name, COUNT(*) AS trips "
+                                       "FROM bikeshare_data GROUP BY 1, 2, 3 ORDER BY trips DESC",
+}
+
+# Modules that must not be imported until a client is actually used
+HEAVY_MODULES = ['vertexai', 'chromadb', 'llama_index', 'google.cloud.bigquery', 'google.cloud.storage',
+                 'google.oauth2', 'IPython', 'pandas']
+STARTUP_SCRIPT = """
+import sys, json, time
+start = time.perf_counter()
+import rag_pipeline_call
+import_s = time.perf_counter() - start
+start = time.perf_counter()
+first = rag_pipeline_call.RAGPipeline_init.shared()
+rag_pipeline_call.RAGPipeline_call()
+construct_s = time.perf_counter() - start
+assert rag_pipeline_call.RAGPipeline_init.shared() is first
+print(json.dumps({'import_s': import_s, 'construct_s': construct_s,
+                  'heavy': [m for m in %r if m in sys.modules]}))
+"""
+
+
+class Fake_LLM(CustomLLM):
+    """Deterministic stand-in for GoogleGenAI with a fixed per-call latency, usable by llama_index query engines"""
+    latency: float = 0.3
+    questions: dict = QUESTIONS
+    calls: int = 0
+
+    def __init__(self, latency=0.3, questions=QUESTIONS):
+        super().__init__(latency=latency, questions=questions)
+
+    @property
+    def metadata(self):
+        return LLMMetadata(model_name='fake-llm')
+
+    def _reply(self, prompt):
+        self.calls += 1
+        # 'Question:' in this repo's prompts, 'Query:' in llama_index's response synthesis prompt
+        question = re.findall(r"(?:^|\n)(?:Question|Query): ([^\n]*)", prompt)[-1]
+        if prompt.rstrip().endswith('SQLQuery:'):
+            return CompletionResponse(text=f"SQLQuery: {self.questions[question]}\nSQLResult: ")
+        return CompletionResponse(text=f"Answer to '{question}' from the query results.")
+
+    @llm_completion_callback()
+    def complete(self, prompt, formatted=False, **kwargs):
+        time.sleep(self.latency)
+        return self._reply(prompt)
+
+    @llm_completion_callback()
+    async def acomplete(self, prompt, formatted=False, **kwargs):
+        await asyncio.sleep(self.latency)
+        return self._reply(prompt)
+
+    @llm_completion_callback()
+    def stream_complete(self, prompt, formatted=False, **kwargs):
+        """First token after a quarter of the latency, the rest spread over the remainder"""
+        words = self._reply(prompt).text.split(' ')
+        time.sleep(self.latency / 4)
+        for i, word in enumerate(words):
+            if i:
+                time.sleep(self.latency * 0.75 / len(words))
+            yield CompletionResponse(text=' '.join(words[:i + 1]), delta=word if not i else ' ' + word)
+
+
+class Fake_Embedding:
+    """Deterministic hashed bag-of-words embedding, one call per batch like the Google embedding function"""
+    def __init__(self, dim=256, latency=0.05):
+        self.dim = dim
+        self.latency = latency
+        self.calls = 0
+
+    def __call__(self, texts):
+        time.sleep(self.latency)
+        self.calls += 1
+        vectors = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for i, t in enumerate(texts):
+            for word in t.lower().replace('?', '').split():
+                vectors[i, int(hashlib.md5(word.encode()).hexdigest(), 16) % self.dim] += 1
+        return vectors
+
+
+class Local_Backend:
+    """SQLite stand-in for BigQuery_Backend, so RAGPipeline_init connects the local warehouse as it would BigQuery"""
+    name = 'sqlite'
+    view_support = False
+
+    def __init__(self, engine, latency=0.2):
+        self.engine = engine
+        self.latency = latency
+
+    def create_engine(self):
+        return self.engine.execution_options(warehouse_latency=self.latency)
+
+    def table(self, name):
+        return name
+
+    def cost_estimator(self, engine):
+        return Static_Cost_Estimator(engine)
+
+
+def local_database(engine, latency=0.0, **kwargs):
+    """The shipped Routed_SQLDatabase over the local warehouse; kwargs are its router, schema_context and guard"""
+    return routed_sql_database_class()(engine.execution_options(warehouse_latency=latency), **kwargs)
+
+
+@contextlib.contextmanager
+def environment(**values):
+    """Set environment variables for the duration of the block, restoring the previous values after"""
+    saved = {name: os.environ.get(name) for name in values}
+    os.environ.update({name: str(value) for name, value in values.items()})
+    try:
+        yield
+    finally:
+        for name, value in saved.items():
+            if value is None:
+                os.environ.pop(name)
+            else:
+                os.environ[name] = value
+
+
+def local_pipeline(engine, llm, latency=0.2):
+    """RAGPipeline_init connected to the local warehouse with the fake LLM and embeddings
+
+    The database is built by sql_alchemy_connect as in production, so it reads the same settings
+    (USE_ROLLUPS, SQL_MAX_ROWS, ...); set them with environment() around this call.
+    """
+    pipeline = RAGPipeline_init(backend=Local_Backend(engine, latency=latency), llm=llm,
+                                embedding_function=Fake_Embedding(latency=0))
+    pipeline.sql_alchemy_connect()
+    return pipeline
+
+
+def make_rides(n=200000, seed=1947):
+    """Cleaned-schema ride table for the local warehouse"""
+    rng = np.random.default_rng(seed)
+    start = pd.Timestamp(2023, 1, 1) + pd.to_timedelta(rng.integers(0, 365 * 24 * 60, n), unit='min')
+    duration = rng.integers(60, 7200, n)
+    stations = rng.integers(7000, 7700, (2, n))
+    return pd.DataFrame({'Trip_Id': np.arange(10000000, 10000000 + n),
+                         'Trip_Duration': duration,
+                         'Start_Station_Id': stations[0],
+                         'Start_Time': start,
+                         'Start_Station_Name': [f'station {i}' for i in stations[0]],
+                         'End_Station_Id': stations[1],
+                         'End_Time': start + pd.to_timedelta(duration, unit='s'),
+                         'End_Station_Name': [f'station {i}' for i in stations[1]],
+                         'Bike_Id': rng.integers(1, 8000, n),
+                         'User_Type': rng.choice(['annual member', 'casual member'], n),
+                         'ym_id': start.strftime('%Y-%m-%d')})
+
+
+def local_warehouse(work_dir, rows=200000):
+    """SQLite file holding bikeshare_data, returned as an engine
+
+    Queries sleep for the engine's warehouse_latency execution option (see local_database), the network
+    round trip and queueing a real warehouse adds to every statement.
+    """
+    engine = create_engine(f"sqlite:///{os.path.join(work_dir, 'warehouse.db')}")
+    make_rides(rows).to_sql('bikeshare_data', engine, index=False)
+
+    @event.listens_for(engine, 'before_cursor_execute')
+    def warehouse_latency(con, cursor, statement, parameters, context, executemany):
+        if re.match(r"\s*(SELECT|WITH)\b", statement, re.I):
+            time.sleep(con.get_execution_options().get('warehouse_latency', 0))
+    return engine
+
+
+def benchmark_aquery_many(n_questions=60, concurrency=(1, 4, 16), llm_latency=0.3, sql_latency=0.2):
+    """Compare sequential and concurrent throughput of Async_Query_Runner on a fake LLM and SQLite"""
+    work_dir = tempfile.mkdtemp(prefix='text2sql_async_')
+    engine = local_warehouse(work_dir)
+    questions = [list(QUESTIONS)[i % len(QUESTIONS)] for i in range(n_questions)]
+    results = {}
+    for n in concurrency:
+        runner = Async_Query_Runner(Fake_LLM(latency=llm_latency), local_database(engine, latency=sql_latency),
+                                    concurrency=n, sql_concurrency=min(n, 8), timeout=30)
+        start = time.perf_counter()
+        answers = runner.query_many(questions)
+        elapsed = time.perf_counter() - start
+        print(f"concurrency={n}: ", end='')
+        runner.summary(answers, elapsed)
+
+        assert [a['question'] for a in answers] == questions, "Results came back out of order"
+        assert not any(a['error'] for a in answers), "Some questions failed"
+        results[n] = {'seconds': elapsed, 'answers': answers}
+
+    baseline = results[concurrency[0]]['answers']
+    for n in concurrency[1:]:
+        assert [a['rows'] for a in results[n]['answers']] == [a['rows'] for a in baseline], \
+            f"concurrency={n} returned different rows"
+    print(f"Speed-up at concurrency={concurrency[-1]}: "
+          f"{results[concurrency[0]]['seconds'] / results[concurrency[-1]]['seconds']:.1f}x")
+
+    # Per-request timeouts surface as errors without failing the batch
+    runner = Async_Query_Runner(Fake_LLM(latency=0.5), local_database(engine, latency=0.2), timeout=0.2)
+    assert all(a['error'] for a in runner.query_many(questions[:3])), "Timeouts were not reported"
+    engine.dispose()
+    shutil.rmtree(work_dir)
+    return results
+
+
+def benchmark_pipeline(n_questions=60, concurrency=8, llm_latency=0.3, sql_latency=0.1, rows=200000):
+    """End-to-end batches through the shipped pipeline on the fake LLM and local warehouse, one configuration per row
+
+    RAGPipeline_init connects the warehouse as in production (Routed_SQLDatabase with its guard and schema
+    context), then each row answers the corpus through RAGPipeline_call.aquery_many or through the query
+    engine chain built by llm_init. Reports queries per second, end-to-end p50/p95 latency and mean seconds
+    per stage (queue wait, prompt build, LLM, SQL, synthesis; query engine rows only report end to end), so
+    the effect of concurrency, rollups and caching can be compared on the same corpus.
+    """
+    work_dir = tempfile.mkdtemp(prefix='text2sql_pipeline_')
+    engine = local_warehouse(work_dir, rows=rows)
+    Rollup_Manager(engine).refresh(rebuild=True)
+    corpus = list(QUESTIONS) + list(PARAPHRASES)
+    questions = [corpus[i % len(corpus)] for i in range(n_questions)]
+    canned = {**QUESTIONS, **{p: QUESTIONS[q] for p, q in PARAPHRASES.items()}}
+    llm = Fake_LLM(latency=llm_latency, questions=canned)
+    # Few-shot reuse has its own benchmark; the ingestion state only feeds the query cache's watermark
+    settings = {'USE_FEW_SHOT': 0, 'INGESTION_STATE_PATH': os.path.join(work_dir, 'ingestion_state.json')}
+    with environment(USE_ROLLUPS=0, **settings):
+        scans = local_pipeline(engine, llm, latency=sql_latency)
+    with environment(USE_ROLLUPS=1, **settings):
+        rollups = local_pipeline(engine, llm, latency=sql_latency)
+        engines = {'query engine': rollups.llm_init(rollups.sql_alchemy_connect(), cache=False)[2],
+                   'query engine + cache': rollups.llm_init(rollups.sql_alchemy_connect())[2]}
+    calls = RAGPipeline_call()
+
+    configs = [('sequential', scans, {'concurrency': 1}),
+               (f'concurrency={concurrency}', scans, {'concurrency': concurrency}),
+               ('+ rollups', rollups, {'concurrency': concurrency}),
+               ('+ query cache', rollups, {'concurrency': concurrency, 'cache': Query_Cache(ttl=None)})]
+    report, rows_by_question = {}, {}
+    for name, pipeline, config in configs:
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):  # the shipped classes log every routed query
+            answers = asyncio.run(calls.aquery_many(questions, pipeline.llm, pipeline.sql_alchemy_connect(),
+                                                    verbose=False, sql_concurrency=min(config['concurrency'], 8),
+                                                    **config))
+        stats = Async_Query_Runner.summary(answers, time.perf_counter() - start, verbose=False)
+        assert not stats['errors'], [a['error'] for a in answers if a['error']]
+        assert [a['question'] for a in answers] == questions, "Results came back out of order"
+        for answer in answers:
+            assert sorted(rows_by_question.setdefault(answer['question'], answer['rows'])) == \
+                sorted(answer['rows']), f"{name} answered differently: {answer['question']}"
+        report[name] = stats
+
+    def timed_query(query_engine, question):
+        start = time.perf_counter()
+        response = query_engine.query(question)
+        return {'question': question, 'rows': response.metadata.get('result'), 'error': None,
+                'timings': {'total': time.perf_counter() - start}}
+
+    for name, query_engine in engines.items():
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()), ThreadPoolExecutor(max_workers=concurrency) as pool:
+            answers = list(pool.map(lambda question: timed_query(query_engine, question), questions))
+        for answer in answers:
+            assert sorted(answer['rows']) == sorted(rows_by_question[answer['question']]), \
+                f"{name} answered differently: {answer['question']}"
+        report[name] = Async_Query_Runner.summary(answers, time.perf_counter() - start, verbose=False)
+
+    stages = ['queue', 'prompt', 'generate_sql', 'execute', 'synthesize']
+    print(f"{'configuration':<22}{'q/s':>8}{'p50 s':>8}{'p95 s':>8}" + ''.join(f"{s:>14}" for s in stages))
+    for name, stats in report.items():
+        print(f"{name:<22}{stats['qps']:>8.2f}{stats['p50']:>8.3f}{stats['p95']:>8.3f}" +
+              ''.join(f"{stats['stages'].get(s, 0.0):>14.4f}" for s in stages))
+    engine.dispose()
+    shutil.rmtree(work_dir)
+    return report
+
+
+def benchmark_streaming(rows=200000, llm_latency=0.3, batch_size=10000):
+    """Time to first row and peak memory: materialized run_sql + synthesis vs Streaming_Query_Runner"""
+    work_dir = tempfile.mkdtemp(prefix='text2sql_stream_')
+    engine = local_warehouse(work_dir, rows=rows)
+    question, sql = next(iter(LARGE_QUESTION.items()))
+    llm = Fake_LLM(latency=llm_latency, questions=LARGE_QUESTION)
+    database = local_database(engine)
+
+    # Materialized path: nothing reaches the caller until every row is fetched and synthesized over
+    tracemalloc.start()
+    start = time.perf_counter()
+    generated = llm.complete(f"Question: {question}\nSQLQuery: ").text.split('SQLQuery: ')[1].split('\n')[0]
+    result, metadata = database.run_sql(generated)
+    prompt_chars = len(result)
+    llm.complete(f"Question: {question}\nSQL: {generated}\nSQL Response: {result}\nResponse: ")
+    materialized = {'first_row': time.perf_counter() - start, 'total': time.perf_counter() - start,
+                    'peak_mb': tracemalloc.get_traced_memory()[1] / 1e6, 'rows': len(metadata['result'])}
+    del result, metadata
+    tracemalloc.stop()
+
+    for arrow in (False, True):
+        tracemalloc.start()
+        runner = Streaming_Query_Runner(llm, database, batch_size=batch_size, arrow=arrow)
+        answer, streamed = [], 0
+        for kind, value in runner.stream(question):
+            if kind == 'rows':
+                streamed += value.num_rows if arrow else len(value)
+            elif kind == 'token':
+                answer.append(value)
+            elif kind == 'timings':
+                timings = value
+        timings['peak_mb'] = tracemalloc.get_traced_memory()[1] / 1e6
+        tracemalloc.stop()
+        print(f"{'arrow' if arrow else 'rows'} stream: first row {timings['first_row'] * 1000:.0f} ms "
+              f"(materialized {materialized['first_row'] * 1000:.0f} ms), first token "
+              f"{timings['first_token'] * 1000:.0f} ms, total {timings['total'] * 1000:.0f} ms, "
+              f"peak {timings['peak_mb']:.0f} MB (materialized {materialized['peak_mb']:.0f} MB)")
+        assert streamed == materialized['rows'] == rows, "Streaming lost rows"
+        assert ''.join(answer).startswith("Answer to"), "Answer tokens were not streamed"
+        assert timings['first_row'] < materialized['first_row'], "Streaming did not reach the first row sooner"
+    print(f"synthesis input: {prompt_chars / 1e6:.1f}M chars materialized, {timings['summary_chars']} chars streamed")
+    engine.dispose()
+    shutil.rmtree(work_dir)
+    return materialized, timings
+
+
+def benchmark_few_shot(repeats=5, llm_latency=0.3, sql_latency=0.05):
+    """LLM calls and wall time on a recurring workload with and without the few-shot store"""
+    work_dir = tempfile.mkdtemp(prefix='text2sql_few_shot_')
+    engine = local_warehouse(work_dir, rows=50000)
+    questions = (list(QUESTIONS) + list(PARAPHRASES)) * repeats
+    canned = {**QUESTIONS, **{p: QUESTIONS[q] for p, q in PARAPHRASES.items()}}
+
+    embed_fn = Fake_Embedding()
+    embeddings = Embedding_Cache(embed_fn)
+    store = Few_Shot_Store(os.path.join(work_dir, 'few_shot_store'), embed_fn=embeddings)
+    store.add(QUESTIONS.items())
+    assert embed_fn.calls == 1, "Store pairs were not embedded in one batch"
+    store.save()
+    store = Few_Shot_Store(store.path, embed_fn=embeddings)  # reload from disk
+    assert len(store.examples) == len(QUESTIONS)
+
+    results = {}
+    for name, few_shot in [('generate', None), ('few-shot', store)]:
+        llm = Fake_LLM(latency=llm_latency, questions=canned)
+        runner = Async_Query_Runner(llm, local_database(engine, latency=sql_latency), concurrency=1,
+                                    synthesize_response=False, few_shot=few_shot)
+        start = time.perf_counter()
+        answers = runner.query_many(questions)
+        elapsed = time.perf_counter() - start
+        assert not any(a['error'] for a in answers), [a['error'] for a in answers if a['error']]
+        results[name] = {'seconds': elapsed, 'llm_calls': llm.calls, 'answers': answers}
+        print(f"{name}: {len(questions)} questions in {elapsed:.2f}s, {llm.calls} LLM calls")
+
+    assert [a['rows'] for a in results['few-shot']['answers']] == \
+        [a['rows'] for a in results['generate']['answers']], "Reused SQL returned different rows"
+    prompts = [a for a in results['few-shot']['answers'] if a['timings']['few_shot'] != 'reused']
+    print(f"{store.reused} answers reused stored SQL, {len(prompts)} generated with examples; "
+          f"{embed_fn.calls} embedding calls for {len(questions)} lookups")
+    assert results['few-shot']['llm_calls'] < results['generate']['llm_calls']
+    assert embed_fn.calls <= 1 + len(set(questions)), "Question embeddings were not cached"
+    engine.dispose()
+    shutil.rmtree(work_dir)
+    return results
+
+
+# Aggregates a rollup must either answer exactly or leave to the ride table
+ROUTING_CASES = [
+    "SELECT COUNT(*) FROM bikeshare_data WHERE start_time >= '2023-03-15 10:30'",
+    "SELECT COUNT(*) FROM bikeshare_data WHERE \"Start_Time\" >= '2023-03-15 10:30'",
+    "SELECT COUNT(DISTINCT bike_id) FROM bikeshare_data",
+    "SELECT COUNT(DISTINCT \"Trip_Id\") FROM bikeshare_data",
+    "SELECT user_type, COUNT(*) FROM bikeshare_data GROUP BY user_type",
+    "SELECT COUNT(*) FROM bikeshare_data WHERE User_Type = 'nobody'",
+    "SELECT User_Type, AVG(Trip_Duration) FROM bikeshare_data GROUP BY User_Type",
+    "SELECT User_Type, AVG(\"trip_duration\") FROM bikeshare_data GROUP BY User_Type",
+    "SELECT COUNT(*) FROM bikeshare_data WHERE Start_Time >= '2023-03-01' AND Start_Time < '2023-04-01'",
+]
+
+
+def check_rollup_routing(rows=20000):
+    """Routed and raw SQL return the same rows, including lowercase or quoted columns and missing durations"""
+    work_dir = tempfile.mkdtemp(prefix='text2sql_rollups_')
+    engine = local_warehouse(work_dir, rows=rows)
+    with engine.begin() as con:
+        con.execute(text("UPDATE bikeshare_data SET Trip_Duration = NULL WHERE Trip_Id % 7 = 0"))
+    manager = Rollup_Manager(engine)
+    manager.refresh(rebuild=True)
+    router = Query_Router(manager)
+    with engine.connect() as con:
+        for sql in ROUTING_CASES + list(QUESTIONS.values()):
+            routed, rollup = router.route(sql)
+            expected = sorted(tuple(row) for row in con.execute(text(sql)))
+            actual = sorted(tuple(row) for row in con.execute(text(routed)))
+            assert len(actual) == len(expected) and all(
+                np.isclose(a, e) if isinstance(e, float) else a == e
+                for got, want in zip(actual, expected) for a, e in zip(got, want)), f"{rollup} answered differently: {sql}"
+    print(f"Rollup routing check passed (routed {router.routed}, passed through {router.passed_through})")
+    engine.dispose()
+    shutil.rmtree(work_dir)
+
+
+def check_sql_guard(max_rows=100, production_rows=2 * 10**8, max_gb=8):
+    """Offline check of SQL_Guard: rewrites and refusals on SQLite, and the byte budget at production table size"""
+    work_dir = tempfile.mkdtemp(prefix='text2sql_guard_')
+    engine = local_warehouse(work_dir, rows=20000)
+    guard = SQL_Guard(Static_Cost_Estimator(engine), dialect='sqlite', max_rows=max_rows)
+
+    start = time.perf_counter()
+    for _ in range(1000):
+        guard.rewrite(RISKY_QUESTIONS["Show me the trips."])
+    print(f"guard rewrite: {(time.perf_counter() - start) * 1000:.0f} us per query")
+
+    runner = Async_Query_Runner(Fake_LLM(latency=0, questions={**QUESTIONS, **RISKY_QUESTIONS}),
+                                local_database(engine), synthesize_response=False, guard=guard)
+    answers = {a['question']: a for a in runner.query_many(list(QUESTIONS) + list(RISKY_QUESTIONS))}
+    for question in QUESTIONS:
+        assert answers[question]['error'] is None, answers[question]['error']
+        assert answers[question]['sql'] == QUESTIONS[question], "Aggregate query was rewritten"
+    everything = answers["Show me the trips."]
+    assert 'SELECT *' not in everything['sql'] and everything['sql'].endswith(f"LIMIT {max_rows}")
+    assert len(everything['rows']) == max_rows and len(everything['rows'][0]) == 7
+    assert len(answers["List 5000 trips by casual members."]['rows']) == max_rows
+    assert 'read-only' in answers["Delete the test trips."]['error']
+    assert 'single SQL statement' in answers["Count trips, then drop the table."]['error']
+    # LIMIT ... OFFSET is clamped in place, and comment markers inside literals are not comments
+    paged = guard.rewrite("SELECT Trip_Id FROM bikeshare_data ORDER BY Trip_Id LIMIT 5000 OFFSET 5")
+    assert paged.endswith(f"LIMIT {max_rows} OFFSET 5"), paged
+    named = guard.rewrite("SELECT Trip_Id FROM bikeshare_data WHERE Start_Station_Name = 'a--b' /* note */")
+    assert "'a--b'" in named and 'note' not in named, named
+    with engine.connect() as con:
+        assert len(con.execute(text(paged)).fetchall()) == max_rows and not con.execute(text(named)).fetchall()
+
+    # Through a rollup router, as Routed_SQLDatabase runs it: the guard sees the ride table first
+    manager = Rollup_Manager(engine)
+    manager.refresh()
+    routed = local_database(engine, router=Query_Router(manager), guard=guard)
+    everything = routed.prepare_sql(RISKY_QUESTIONS["Show me the trips."])
+    assert 'bikeshare_data' in everything and 'SELECT *' not in everything, everything
+    assert everything.endswith(f"LIMIT {max_rows}") and len(routed.run_sql(everything)[1]['result']) == max_rows
+    for question in QUESTIONS:
+        sql = routed.prepare_sql(QUESTIONS[question])
+        assert sorted(routed.run_sql(sql)[1]['result']) == sorted(answers[question]['rows']), question
+    assert sum(routed.router.routed.values()) > 0, "No aggregate was routed to a rollup"
+
+    # Runners given the same guard as their database check each statement once, before routing
+    checks, check = [], guard.check
+    guard.check = lambda sql, route=None: checks.append(sql) or check(sql, route=route)
+    for database in (routed, local_database(engine, router=routed.router)):
+        checks.clear()
+        streamed = Streaming_Query_Runner(Fake_LLM(latency=0), database, guard=guard)
+        assert streamed.prepare(RISKY_QUESTIONS["Show me the trips."]) == everything and len(checks) == 1, checks
+        checks.clear()
+        runner = Async_Query_Runner(Fake_LLM(latency=0, questions={**QUESTIONS, **RISKY_QUESTIONS}), database,
+                                    synthesize_response=False, guard=guard)
+        batch = ["Show me the trips."] + list(QUESTIONS)
+        for answer in runner.query_many(batch):
+            expected = answers[answer['question']]['rows']
+            assert answer['error'] is None and sorted(answer['rows']) == sorted(expected), answer['question']
+        assert sorted(checks) == sorted(RISKY_QUESTIONS.get(q, QUESTIONS.get(q)) for q in batch), checks
+    del guard.check
+
+    # Mocked dry run at production size: LIMIT does not reduce the bytes a columnar scan bills
+    production = SQL_Guard(Static_Cost_Estimator(row_counts={'bikeshare_data': production_rows}),
+                           dialect='sqlite', max_rows=max_rows, max_bytes=max_gb * 1024**3)
+    for question in QUESTIONS:
+        production.check(QUESTIONS[question])
+    for question in ["Show me the trips.", "Which bikes were used the most?"]:
+        try:
+            production.check(RISKY_QUESTIONS[question])
+            raise AssertionError(f"Over-budget query was allowed: {question}")
+        except SQL_Guard_Error as e:
+            print(f"refused '{question}': {e}")
+
+    # Row-level scans without a Start_Time filter get a recent window when one is configured
+    windowed = SQL_Guard(dialect='bigquery', recent_days=30).rewrite(
+        "SELECT Trip_Id FROM bikeshare_data WHERE User_Type = 'casual member' ORDER BY Trip_Id")
+    assert windowed == ("SELECT Trip_Id FROM bikeshare_data WHERE Start_Time >= TIMESTAMP_SUB(CURRENT_TIMESTAMP(), "
+                        "INTERVAL 30 DAY) AND (User_Type = 'casual member') ORDER BY Trip_Id LIMIT 1000"), windowed
+    engine.dispose()
+    shutil.rmtree(work_dir)
+
+
+def benchmark_startup(runs=3, import_budget=1.0, construct_budget=0.05):
+    """Regression guard: importing and constructing the pipeline stays cheap and defers heavy clients"""
+    here = os.path.dirname(os.path.abspath(__file__))
+    timings = []
+    for _ in range(runs):
+        # A fresh interpreter each run, so nothing is already imported
+        output = subprocess.run([sys.executable, '-X', 'importtime', '-c', STARTUP_SCRIPT % HEAVY_MODULES],
+                                cwd=here, capture_output=True, text=True, check=True)
+        timings.append(json.loads(output.stdout.strip().splitlines()[-1]))
+
+    # -X importtime lines: "import time: self [us] | cumulative | imported package", nested names indented
+    imports = [line.split('|') for line in output.stderr.splitlines() if line.startswith('import time:')][1:]
+    nested = [(int(c), name.strip()) for _, c, name in imports if len(name) - len(name.lstrip()) in (3, 5)]
+    slowest = sorted(nested, reverse=True)[:5]
+    best = min(timings, key=lambda t: t['import_s'])
+    print(f"import: {best['import_s'] * 1000:.0f} ms, construct: {best['construct_s'] * 1000:.1f} ms")
+    print("slowest imports: " + ', '.join(f"{name} {us / 1000:.0f} ms" for us, name in slowest))
+
+    assert not best['heavy'], f"Heavy modules imported at startup: {best['heavy']}"
+    assert best['import_s'] < import_budget, f"Import took {best['import_s']:.2f}s (budget {import_budget}s)"
+    assert best['construct_s'] < construct_budget, f"Construction took {best['construct_s']:.3f}s"
+    return best
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Text_2_SQL benchmarks on a fake LLM and a local warehouse")
+    parser.add_argument('--suite', choices=['pipeline', 'startup', 'async', 'streaming', 'few_shot', 'guard', 'rollups',
+                                            'all'], default='pipeline')
+    parser.add_argument('--questions', type=int, default=60, help="questions per pipeline configuration")
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--llm-latency', type=float, default=0.3, help="seconds per fake LLM call")
+    parser.add_argument('--sql-latency', type=float, default=0.1, help="seconds of simulated warehouse latency")
+    args = parser.parse_args()
+
+    if args.suite in ('rollups', 'all'):
+        check_rollup_routing()
+    if args.suite in ('guard', 'all'):
+        check_sql_guard()
+    if args.suite in ('startup', 'all'):
+        benchmark_startup()
+    if args.suite in ('pipeline', 'all'):
+        benchmark_pipeline(args.questions, args.concurrency, args.llm_latency, args.sql_latency)
+    if args.suite in ('async', 'all'):
+        benchmark_aquery_many()
+    if args.suite in ('streaming', 'all'):
+        benchmark_streaming()
+    if args.suite in ('few_shot', 'all'):
+        benchmark_few_shot()
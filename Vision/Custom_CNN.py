@@ -19,7 +19,6 @@ from typing import Iterable, List
 from torch.utils.data import (DataLoader,)  # Gives easier dataset managment by creating mini batches etc.
 from tqdm import tqdm  # For nice progress bar!
 import kornia
-import matplotlib.pyplot as plt
 import os
 from PIL import Image
 from torchvision.datasets import ImageFolder
@@ -27,8 +26,6 @@ from torch.utils.data import Dataset, random_split, DataLoader
 import cv2
 from sklearn.model_selection import train_test_split
 from cv2 import COLOR_RGB2GRAY
-from sklearn.metrics import confusion_matrix, classification_report
-import seaborn as sns
 seed = torch.manual_seed(1947)
 
 DEVICE = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
@@ -62,7 +59,15 @@ transform = transforms.Compose([
 ])
 
 
-dataset = ImageFolder(path, transform=transform)
+# Decode/resize/crop every JPEG once into a memory-mapped tensor cache next to the dataset; it is
+# rebuilt automatically when the images or TARGET_SIZE change. Set to False for the PIL path above.
+USE_TENSOR_CACHE = True
+
+if USE_TENSOR_CACHE:
+    from tensor_cache import load_tensor_cache
+    dataset = load_tensor_cache(path, target_size=TARGET_SIZE)
+else:
+    dataset = ImageFolder(path, transform=transform)
 
 print(dataset)
 
@@ -120,97 +125,8 @@ print(dataset)
 loss_function = 'CE' # CE or FL
 
 
-class Project_CNN(nn.Module):
-    def __init__(self, loss_func = loss_function):
-        super().__init__()
-
-        self.loss_func = loss_func
-        #Layer = Conv - BatchNorm - ReLU - MaxPool
-
-
-        self.conv1 = nn.Conv2d(in_channels = 3, out_channels= 32, kernel_size=3, stride=1, padding=1)
-        self.bn1 = nn.BatchNorm2d(32)
-        self.relu1 = nn.ReLU()
-        self.pool1 = nn.MaxPool2d(kernel_size=2, stride=2)
-
-
-        self.conv2 = nn.Conv2d(32, 64, kernel_size=3, stride=1, padding=1)
-        self.bn2 = nn.BatchNorm2d(64)
-        self.relu2 = nn.ReLU()
-        self.pool2 = nn.MaxPool2d(kernel_size=2, stride=2)
-
-
-        self.conv3 = nn.Conv2d(64, 128, kernel_size=3, stride=1, padding=1)
-        self.bn3 = nn.BatchNorm2d(128)
-        self.relu3 = nn.ReLU()
-        self.pool3 = nn.MaxPool2d(kernel_size=2, stride=2)
-
-
-        self.conv4 = nn.Conv2d(128, 256, kernel_size=3, stride=1, padding=1)
-        self.bn4 = nn.BatchNorm2d(256)
-        self.relu4 = nn.ReLU()
-        self.pool4 = nn.MaxPool2d(kernel_size=2, stride=2)
-
-        self.conv5 = nn.Conv2d(256, 512, kernel_size=3, stride=1, padding=1)
-        self.bn5 = nn.BatchNorm2d(512)
-        self.relu5 = nn.ReLU()
-        self.pool5 = nn.MaxPool2d(kernel_size=2, stride=2)
-
-
-        self.dropout = nn.Dropout(0.5)
-
-        # Fully connected layer
-
-        self.fc = nn.Linear(128 * 4 * 4, 10)
-
-        if self.loss_func == 'CE':
-            pass
-        elif self.loss_func == 'FL':
-            self.softmax = nn.Softmax(dim=1)
-
-
-    def forward(self, x):
-        # Layer 1
-        x = self.conv1(x)
-        x = self.bn1(x)
-        x = self.relu1(x)
-        x = self.pool1(x)
-
-        # Layer 2
-        x = self.conv2(x)
-        x = self.bn2(x)
-        x = self.relu2(x)
-        x = self.pool2(x)
-
-        # Layer 3
-        x = self.conv3(x)
-        x = self.bn3(x)
-        x = self.relu3(x)
-        x = self.pool3(x)
-
-        # Layer 4
-        x = self.conv4(x)
-        x = self.bn4(x)
-        x = self.relu4(x)
-        x = self.pool4(x)
-
-        # Layer 5
-        x = self.conv5(x)
-        x = self.bn5(x)
-        x = self.relu5(x)
-        x = self.pool5(x)
-
-        x = self.dropout(x)
-
-
-        # Flatten and fully connected
-        x = x.view(x.size(0), -1)
-        x = self.fc(x)
-        if self.loss_func == 'CE':
-            pass
-        elif self.loss_func == 'FL':
-            x = self.softmax(x)
-        return x
+# Model definition lives in project_cnn.py so the export, server and benchmarks can import it
+from project_cnn import Project_CNN
 
 def data_split(data):
   
@@ -226,7 +142,13 @@ sample, label = train_datset[1]
 print(f"Sample shape: {sample.size()}")  # For transformed images
 print(f"Label: {label} ({dataset.classes[label]})")
 
-CNN = Project_CNN().to(DEVICE)
+CNN = Project_CNN(loss_function).to(DEVICE)
+
+# fp32, bf16 (autocast), channels_last, compile or a '+' combination, see execution_modes.py.
+# Conv+BN fusion ('fused') is for inference only and is skipped while training.
+from execution_modes import Execution_Mode
+execution_mode = Execution_Mode(os.getenv('CNN_EXECUTION_MODE', 'fp32'))
+CNN = execution_mode.prepare(CNN, training=True)
 
 optimizer = optim.Adam(CNN.parameters(), lr=0.001)
 
@@ -243,11 +165,25 @@ num_epochs = 10
 learning_rate = 0.001
 batch_size = 32
 
-train_loader = DataLoader(dataset=train_datset, batch_size=batch_size, shuffle=True)
-test_loader = DataLoader(dataset=test_dataset, batch_size=batch_size, shuffle=True)
+from data_loading import make_loader, loader_workers, Batch_Augment, Loader_Timer
+
+# Workers sized to the machine's cores, persistent across epochs, prefetching and pinned for CUDA;
+# validation gets a quarter of them, since its persistent workers stay alive while training runs
+train_loader = make_loader(train_datset, batch_size=batch_size, shuffle=True)
+test_loader = make_loader(test_dataset, batch_size=batch_size, shuffle=True, workers=max(1, loader_workers() // 4))
+
+# Flips, brightness/contrast and shifts on the whole batch as tensor ops, on DEVICE. Off by default so a run
+# trains on the same inputs as before; set CNN_AUGMENT=1 to turn it on
+augment = Batch_Augment().to(DEVICE) if os.getenv('CNN_AUGMENT', '0') == '1' else nn.Identity()
+train_timer = Loader_Timer(train_loader)
 
 history = {'train_loss': [], 'val_loss': [], 'train_acc': [], 'val_acc': []}
 
+from cnn_metrics import Confusion_Matrix
+
+val_metrics = Confusion_Matrix(len(dataset.classes), device=DEVICE)
+PLOT_EVERY = num_epochs  # epochs between confusion matrix plots, 0 to disable
+
 for epoch in range(num_epochs):
     CNN.train()
     running_loss = 0.0
@@ -255,21 +191,23 @@ for epoch in range(num_epochs):
     total = 0
     print(f"Epoch {epoch+1}/{num_epochs}")
     print()
-    for batch_idx, (data, targets) in enumerate(tqdm(train_loader)):
+    for batch_idx, (data, targets) in enumerate(tqdm(train_timer)):
         # Get data to cuda if possible
-        data = data.to(device=DEVICE)
-        targets = targets.to(device=DEVICE)
+        data = data.to(device=DEVICE, non_blocking=True)
+        targets = targets.to(device=DEVICE, non_blocking=True)
+        data = execution_mode.inputs(augment(data))
 
         # forward
-        scores = CNN(data)
-        if loss_function == 'CE':
-            loss = criterion(scores, targets)
-        elif loss_function == 'FL':
-            loss = kornia.losses.focal_loss(
-                                        pred=scores,               # Model predictions (logits)
-                                        target=targets,           # Ground truth labels
-                                        **kwargs_model
-                                        )
+        with execution_mode.autocast(DEVICE.type):
+            scores = CNN(data)
+            if loss_function == 'CE':
+                loss = criterion(scores, targets)
+            elif loss_function == 'FL':
+                loss = kornia.losses.focal_loss(
+                                            pred=scores,               # Model predictions (logits)
+                                            target=targets,           # Ground truth labels
+                                            **kwargs_model
+                                            )
 
         # backward
         optimizer.zero_grad()
@@ -282,6 +220,7 @@ for epoch in range(num_epochs):
         running_loss += loss.item()
         total += targets.size(0)
 
+    train_timer.report()  # share of the step spent waiting on the loader
     train_loss = running_loss / len(train_loader)
     train_acc = correct / total
     history['train_loss'].append(train_loss)
@@ -290,23 +229,21 @@ for epoch in range(num_epochs):
 
 
     CNN.eval()
-    val_loss = 0.0
-    correct = 0
-    total = 0
-    targets_append = []
-    preds_append = []
+    val_loss = torch.zeros((), device=DEVICE)
+    val_metrics.reset()
 
 
     with torch.no_grad():
         for data, targets in tqdm(test_loader, desc="Validation"):
-            data = data.to(device=DEVICE)
-            targets = targets.to(device=DEVICE)
+            data = data.to(device=DEVICE, non_blocking=True)
+            targets = targets.to(device=DEVICE, non_blocking=True)
 
-            scores = CNN(data)
+            with execution_mode.autocast(DEVICE.type):
+                scores = CNN(execution_mode.inputs(data))
 
-            # Calculate validation loss
-            loss = criterion(scores, targets)
-            val_loss += loss.item()
+                # Calculate validation loss (summed on the device, read once per epoch)
+                loss = criterion(scores, targets)
+            val_loss += loss
 
             # Calculate validation accuracy
             if loss_function == 'CE':
@@ -314,37 +251,28 @@ for epoch in range(num_epochs):
             elif loss_function == 'FL':
                 _, predictions = nn.Softmax(dim=1)(scores).max(1)
 
-            correct += (predictions == targets).sum().item()
-            total += targets.size(0)
-
-            targets_append.extend(targets) # changed this line
-            preds_append.extend(predictions) # added this line
+            # Confusion matrix counts via bincount on preallocated device tensors
+            val_metrics.update(targets, predictions)
 
-    val_loss /= len(test_loader)
-    val_acc = correct / total
+    val_loss = val_loss.item() / len(test_loader)
+    val_acc = val_metrics.compute()['accuracy']
     history['val_loss'].append(val_loss)
     history['val_acc'].append(val_acc)
 
 
     #data, targets = test_dataset
 
-    conf_matrix = confusion_matrix(torch.tensor(targets_append).cpu(), torch.tensor(preds_append).cpu())
     class_names = dataset.classes
 
-    # Plot confusion matrix
-    plt.figure(figsize=(12, 10))
-    sns.heatmap(conf_matrix, annot=True, fmt='d', cmap='Blues',
-                xticklabels=class_names, yticklabels=class_names)
-    plt.title('Confusion Matrix')
-    plt.ylabel('True Label')
-    plt.xlabel('Predicted Label')
-    plt.tight_layout()
-    plt.savefig('efficientnetb0_confusion_matrix.png')
-    plt.show()
+    # Plot confusion matrix on a background thread, only every PLOT_EVERY epochs and the last one
+    if PLOT_EVERY and ((epoch + 1) % PLOT_EVERY == 0 or epoch == num_epochs - 1):
+        val_metrics.plot_async(class_names, 'efficientnetb0_confusion_matrix.png')
 
     # Print classification report
     print("\nClassification Report:")
-    print(classification_report(torch.tensor(targets_append).cpu(), torch.tensor(preds_append).cpu(), target_names=class_names))
+    print(val_metrics.report(class_names))
+
+val_metrics.wait()
 
 def check_accuracy(loader, model):
     num_correct = 0
@@ -368,4 +296,8 @@ def check_accuracy(loader, model):
 print(f"Accuracy on training set: {check_accuracy(train_loader, CNN)*100:.2f}")
 print(f"Accuracy on test set: {check_accuracy(test_loader, CNN)*100:.2f}")
 
+# state_dict + TorchScript for cnn_server.py (python cnn_server.py --model-dir project_cnn_export --serve)
+from cnn_server import export_checkpoint
+export_checkpoint(getattr(CNN, '_orig_mod', CNN), dataset.classes, 'project_cnn_export', TARGET_SIZE)
+
 
@@ -24,8 +24,9 @@ torch.use_deterministic_algorithms(True) # Needed for reproducible results
 
 
 
-# Number of workers for dataloader
-workers = 2
+# Number of workers for dataloader, sized to the available cores
+from data_loading import loader_workers, make_loader
+workers = loader_workers()
 
 # Batch size during training
 batch_size = 128
@@ -59,8 +60,7 @@ beta1 = 0.2
 ngpu = 1
 
 # Create the dataloader
-dataloader = DataLoader(dataset, batch_size=batch_size,
-                                         shuffle=True, num_workers=workers)
+dataloader = make_loader(dataset, batch_size=batch_size, shuffle=True, workers=workers, seed=manualSeed)
 
 # Decide which device we want to run on
 DEVICE = torch.device("cuda:0" if (torch.cuda.is_available() and ngpu > 0) else "cpu")
@@ -0,0 +1,271 @@
+import io
+import os
+import json
+import time
+import queue
+import argparse
+import threading
+import tempfile
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+import torch
+from PIL import Image
+from torchvision import transforms
+
+from project_cnn import Project_CNN
+from execution_modes import fuse_conv_bn
+from tensor_cache import MEAN, STD
+
+
+def make_transform(target_size=(64, 64)):
+    """The preprocessing used for training in Custom_CNN.py"""
+    return transforms.Compose([transforms.Resize(target_size), transforms.CenterCrop(target_size),
+                               transforms.ToTensor(), transforms.Normalize(mean=MEAN, std=STD)])
+
+
+def export_checkpoint(model, classes, out_dir, target_size=(64, 64)):
+    """Save the state_dict (plus classes and input size) and a traced TorchScript of the Conv+BN fused model"""
+    os.makedirs(out_dir, exist_ok=True)
+    model = model.cpu().eval()
+    torch.save({'state_dict': model.state_dict(), 'classes': list(classes), 'loss_func': model.loss_func,
+                'target_size': list(target_size)}, os.path.join(out_dir, 'project_cnn.pt'))
+    with torch.no_grad():
+        traced = torch.jit.trace(fuse_conv_bn(model), torch.randn(1, 3, *target_size))
+    traced = torch.jit.freeze(traced)
+    traced.save(os.path.join(out_dir, 'project_cnn.ts'))
+    with open(os.path.join(out_dir, 'meta.json'), 'w') as f:
+        json.dump({'classes': list(classes), 'target_size': list(target_size), 'loss_func': model.loss_func}, f)
+    print(f"Exported Project_CNN to {out_dir}")
+
+
+def load_model(model_dir):
+    """TorchScript model when exported, otherwise Project_CNN rebuilt from the state_dict; plus its metadata"""
+    checkpoint_path = os.path.join(model_dir, 'project_cnn.pt')
+    script_path = os.path.join(model_dir, 'project_cnn.ts')
+    if os.path.exists(script_path):
+        with open(os.path.join(model_dir, 'meta.json'), 'r') as f:
+            meta = json.load(f)
+        return torch.jit.load(script_path, map_location='cpu').eval(), meta
+    checkpoint = torch.load(checkpoint_path, map_location='cpu')
+    model = Project_CNN(checkpoint['loss_func'])
+    model.load_state_dict(checkpoint['state_dict'])
+    return fuse_conv_bn(model), {'classes': checkpoint['classes'], 'target_size': checkpoint['target_size'],
+                                 'loss_func': checkpoint['loss_func']}
+
+
+class Batching_Server:
+    """Loads the model once and answers concurrent single-image requests in micro-batches
+
+    A request waits at most max_wait_ms for others to share its forward pass; decoding and resizing run
+    on a thread pool (PIL releases the GIL) while the batcher thread runs the model.
+    """
+    def __init__(self, model_dir, max_batch=32, max_wait_ms=5, preprocess_workers=None, threads=None):
+        self.model, meta = load_model(model_dir)
+        self.classes = meta['classes']
+        self.transform = make_transform(tuple(meta['target_size']))
+        self.softmax = meta.get('loss_func', 'CE') != 'FL'  # focal-loss models already end in a softmax
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000
+        if threads:
+            torch.set_num_threads(threads)
+        self.preprocess = ThreadPoolExecutor(max_workers=preprocess_workers or min(8, os.cpu_count() or 1))
+        self.requests = queue.Queue()
+        self.latencies = deque(maxlen=10000)
+        self.batch_sizes = deque(maxlen=10000)
+        self.stats_lock = threading.Lock()  # the batcher appends while /stats handlers read
+        self.completed = 0
+        self.started = time.perf_counter()
+        self.running = True
+        self.batcher = threading.Thread(target=self._serve, daemon=True)
+        self.batcher.start()
+        # Warm up: the first forward pass pays for allocator and kernel selection
+        self.predict(Image.new('RGB', tuple(meta['target_size']))).result()
+
+    def _load(self, image):
+        if isinstance(image, (bytes, bytearray)):
+            image = Image.open(io.BytesIO(image))
+        return self.transform(image.convert('RGB'))
+
+    def predict(self, image):
+        """Future resolving to {'label', 'class', 'probability'} for a PIL image or encoded image bytes"""
+        future = Future()
+        received = time.perf_counter()
+        tensor = self.preprocess.submit(self._load, image)
+        tensor.add_done_callback(lambda t: self.requests.put((t, future, received)))
+        return future
+
+    def _collect(self):
+        """Block for the first request, then take more until the batch is full or the deadline passes"""
+        batch = [self.requests.get()]
+        deadline = time.perf_counter() + self.max_wait
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.perf_counter()
+            try:
+                batch.append(self.requests.get(timeout=remaining) if remaining > 0 else self.requests.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _serve(self):
+        while self.running:
+            batch = self._collect()
+            ready = []
+            for tensor, future, received in batch:
+                if tensor.exception():
+                    future.set_exception(tensor.exception())
+                else:
+                    ready.append((tensor.result(), future, received))
+            if not ready:
+                continue
+            try:
+                with torch.inference_mode():
+                    scores = self.model(torch.stack([r[0] for r in ready]))
+                    probabilities = torch.softmax(scores, dim=1) if self.softmax else scores
+                confidence, labels = probabilities.max(1)
+            except Exception as e:
+                for _, future, _ in ready:
+                    future.set_exception(e)
+                continue
+            done = time.perf_counter()
+            for (_, future, received), label, p in zip(ready, labels.tolist(), confidence.tolist()):
+                future.set_result({'label': label, 'class': self.classes[label], 'probability': p})
+            with self.stats_lock:
+                self.latencies.extend(done - received for _, _, received in ready)
+                self.batch_sizes.append(len(ready))
+                self.completed += len(ready)
+
+    def stats(self):
+        """Latency percentiles (ms), throughput and mean batch size since start or the last reset"""
+        with self.stats_lock:
+            latencies, batch_sizes = list(self.latencies), list(self.batch_sizes)
+            completed, started = self.completed, self.started
+        latencies = np.array(latencies) * 1000
+        elapsed = time.perf_counter() - started
+        return {'requests': completed,
+                'throughput': completed / elapsed if elapsed else 0.0,
+                'p50_ms': float(np.percentile(latencies, 50)) if len(latencies) else None,
+                'p99_ms': float(np.percentile(latencies, 99)) if len(latencies) else None,
+                'mean_batch': float(np.mean(batch_sizes)) if batch_sizes else None}
+
+    def reset_stats(self):
+        with self.stats_lock:
+            self.latencies.clear()
+            self.batch_sizes.clear()
+            self.completed = 0
+            self.started = time.perf_counter()
+
+    def close(self):
+        self.running = False
+        self.requests.put((_closed(), Future(), time.perf_counter()))  # wake the batcher
+        self.batcher.join()
+        self.preprocess.shutdown()
+
+
+def _closed():
+    future = Future()
+    future.set_exception(RuntimeError("server closed"))
+    return future
+
+
+def make_http_server(server, host='127.0.0.1', port=8080):
+    """POST /predict with image bytes -> JSON prediction; GET /stats -> JSON counters"""
+    class Handler(BaseHTTPRequestHandler):
+        def _reply(self, code, body):
+            payload = json.dumps(body).encode()
+            self.send_response(code)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def do_POST(self):
+            if self.path != '/predict':
+                return self._reply(404, {'error': 'not found'})
+            image = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+            try:
+                self._reply(200, server.predict(image).result(timeout=30))
+            except Exception as e:
+                self._reply(400, {'error': str(e)})
+
+        def do_GET(self):
+            if self.path != '/stats':
+                return self._reply(404, {'error': 'not found'})
+            try:
+                self._reply(200, server.stats())
+            except Exception as e:
+                self._reply(500, {'error': str(e)})
+
+        def log_message(self, format, *args):
+            pass  # one line per request would dominate the benchmark
+
+    return ThreadingHTTPServer((host, port), Handler)
+
+
+def load_test(server, images, clients=16, requests_per_client=50, http_url=None):
+    """Closed-loop load: each client sends its next request as soon as the previous one is answered"""
+    import urllib.request
+    server.reset_stats()
+
+    def client(i):
+        for j in range(requests_per_client):
+            image = images[(i * requests_per_client + j) % len(images)]
+            if http_url:
+                urllib.request.urlopen(urllib.request.Request(http_url + '/predict', data=image)).read()
+            else:
+                server.predict(image).result()
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=clients) as pool:
+        list(pool.map(client, range(clients)))
+    elapsed = time.perf_counter() - start
+    stats = server.stats()
+    stats['throughput'] = clients * requests_per_client / elapsed
+    return stats
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Micro-batching Project_CNN inference server (CPU)")
+    parser.add_argument('--model-dir', help="directory written by export_checkpoint (default: untrained model)")
+    parser.add_argument('--serve', action='store_true', help="serve HTTP instead of running the load test")
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--max-batch', type=int, default=32)
+    parser.add_argument('--max-wait-ms', type=float, default=5)
+    parser.add_argument('--clients', type=int, default=16)
+    parser.add_argument('--http', action='store_true', help="load test through HTTP rather than the Python API")
+    args = parser.parse_args()
+
+    model_dir = args.model_dir
+    if model_dir is None:
+        torch.manual_seed(1947)
+        model_dir = tempfile.mkdtemp(prefix='project_cnn_')
+        export_checkpoint(Project_CNN(), [f"class {i}" for i in range(10)], model_dir)
+
+    if args.serve:
+        server = Batching_Server(model_dir, args.max_batch, args.max_wait_ms)
+        print(f"Serving on http://127.0.0.1:{args.port} (POST /predict, GET /stats)")
+        make_http_server(server, port=args.port).serve_forever()
+
+    # Encoded JPEGs of camera-sized images, as real clients would send
+    rng = np.random.default_rng(1947)
+    images = []
+    for _ in range(64):
+        buffer = io.BytesIO()
+        Image.fromarray(rng.integers(0, 256, (240, 320, 3), dtype=np.uint8)).save(buffer, format='JPEG')
+        images.append(buffer.getvalue())
+
+    for max_batch in (1, args.max_batch):
+        server = Batching_Server(model_dir, max_batch=max_batch, max_wait_ms=args.max_wait_ms)
+        http_url = None
+        if args.http:
+            http = make_http_server(server, port=0)
+            threading.Thread(target=http.serve_forever, daemon=True).start()
+            http_url = f"http://127.0.0.1:{http.server_address[1]}"
+        stats = load_test(server, images, clients=args.clients, http_url=http_url)
+        print(f"max_batch={max_batch}: {stats['throughput']:.0f} images/s, p50 {stats['p50_ms']:.1f} ms, "
+              f"p99 {stats['p99_ms']:.1f} ms, mean batch {stats['mean_batch']:.1f}")
+        if args.http:
+            http.shutdown()
+        server.close()
@@ -0,0 +1,102 @@
+import os
+import time
+import random
+
+import numpy as np
+import torch
+import torch.nn as nn
+from torch.utils.data import DataLoader
+
+
+def loader_workers(reserve=1):
+    """Worker processes for the cores this process may run on, leaving reserve cores for the training loop"""
+    try:
+        cores = len(os.sched_getaffinity(0))
+    except AttributeError:  # macOS / Windows
+        cores = os.cpu_count() or 1
+    return max(0, cores - reserve)
+
+
+def seed_worker(worker_id):
+    """Give every worker its own, reproducible numpy/random stream derived from the torch seed"""
+    seed = torch.initial_seed() % 2**32
+    np.random.seed(seed)
+    random.seed(seed)
+
+
+def make_loader(dataset, batch_size, shuffle=True, workers=None, prefetch_factor=4, pin_memory=None,
+                drop_last=False, seed=1947):
+    """DataLoader with workers sized to the machine, kept alive across epochs and prefetching ahead"""
+    workers = loader_workers() if workers is None else workers
+    kwargs = {}
+    if workers > 0:
+        # persistent workers skip re-forking (and re-opening the dataset) every epoch
+        kwargs = {'persistent_workers': True, 'prefetch_factor': prefetch_factor, 'worker_init_fn': seed_worker}
+    generator = torch.Generator()
+    generator.manual_seed(seed)
+    return DataLoader(dataset, batch_size=batch_size, shuffle=shuffle, num_workers=workers,
+                      pin_memory=torch.cuda.is_available() if pin_memory is None else pin_memory,
+                      drop_last=drop_last, generator=generator, **kwargs)
+
+
+class Batch_Augment(nn.Module):
+    """Random flips, brightness and contrast applied to a whole (N, C, H, W) batch with tensor ops
+
+    Runs on the device after the batch is loaded, instead of per image PIL transforms in the workers.
+    """
+    def __init__(self, flip=0.5, brightness=0.2, contrast=0.2, shift=4):
+        super().__init__()
+        self.flip = flip
+        self.brightness = brightness
+        self.contrast = contrast
+        self.shift = shift  # maximum random translation in pixels
+
+    def forward(self, x):
+        if not self.training:
+            return x
+        n = x.size(0)
+        flip = torch.rand(n, 1, 1, 1, device=x.device) < self.flip
+        x = torch.where(flip, x.flip(3), x)
+
+        mean = x.mean(dim=(1, 2, 3), keepdim=True)
+        contrast = 1 + (torch.rand(n, 1, 1, 1, device=x.device) * 2 - 1) * self.contrast
+        brightness = (torch.rand(n, 1, 1, 1, device=x.device) * 2 - 1) * self.brightness
+        x = (x - mean) * contrast + mean + brightness
+
+        if self.shift:
+            # One translation per batch keeps this a single pad + slice
+            dy, dx = torch.randint(-self.shift, self.shift + 1, (2,)).tolist()
+            padded = nn.functional.pad(x, (self.shift,) * 4, mode='replicate')
+            h, w = x.shape[2:]
+            x = padded[:, :, self.shift + dy:self.shift + dy + h, self.shift + dx:self.shift + dx + w]
+        return x
+
+
+class Loader_Timer:
+    """Wrap a DataLoader to measure how long each step waits for the next batch versus computing"""
+    def __init__(self, loader):
+        self.loader = loader
+        self.wait = 0.0
+        self.compute = 0.0
+        self.steps = 0
+
+    def __len__(self):
+        return len(self.loader)
+
+    def __iter__(self):
+        self.wait, self.compute, self.steps = 0.0, 0.0, 0
+        last = time.perf_counter()
+        for batch in self.loader:
+            now = time.perf_counter()
+            self.wait += now - last
+            yield batch
+            last = time.perf_counter()
+            self.compute += last - now
+            self.steps += 1
+
+    def report(self, name='train'):
+        total = self.wait + self.compute
+        if total:
+            print(f"{name}: {self.steps} steps, {self.wait:.1f}s waiting for data ({100 * self.wait / total:.0f}%), "
+                  f"{self.compute:.1f}s compute, {1000 * self.wait / max(self.steps, 1):.1f} ms wait/step")
+        return {'wait': self.wait, 'compute': self.compute, 'steps': self.steps}
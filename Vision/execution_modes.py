@@ -0,0 +1,130 @@
+import copy
+import time
+import argparse
+from contextlib import nullcontext
+
+import torch
+import torch.nn as nn
+from torch.nn.utils.fusion import fuse_conv_bn_eval
+
+
+MODES = ['fp32', 'channels_last', 'bf16', 'fused', 'compile', 'bf16+channels_last', 'fused+channels_last',
+         'fused+compile', 'bf16+fused+channels_last+compile']
+
+
+def fuse_conv_bn(model):
+    """Fold every BatchNorm2d that directly follows a Conv2d into the conv's weights (eval only)
+
+    Works on Project_CNN's convN/bnN attributes and on nn.Sequential stacks alike: the BatchNorm is
+    replaced by Identity, so the model's forward is unchanged.
+    """
+    model = copy.deepcopy(model).eval()
+    for parent in model.modules():
+        children = list(parent.named_children())
+        for (conv_name, conv), (bn_name, bn) in zip(children, children[1:]):
+            if isinstance(conv, nn.Conv2d) and isinstance(bn, nn.BatchNorm2d):
+                setattr(parent, conv_name, fuse_conv_bn_eval(conv, bn))
+                setattr(parent, bn_name, nn.Identity())
+    return model
+
+
+class Execution_Mode:
+    """How Project_CNN runs: any '+'-joined combination of bf16, channels_last, fused and compile ('fp32' = none)"""
+    def __init__(self, name='fp32', compile_mode='default'):
+        self.name = name
+        parts = set(name.split('+')) - {'fp32'}
+        unknown = parts - {'bf16', 'channels_last', 'fused', 'compile'}
+        if unknown:
+            raise ValueError(f"Unknown execution mode: {', '.join(sorted(unknown))}")
+        self.bf16 = 'bf16' in parts
+        self.channels_last = 'channels_last' in parts
+        self.fused = 'fused' in parts
+        self.compile = 'compile' in parts
+        self.compile_mode = compile_mode  # torch.compile mode: default, reduce-overhead or max-autotune
+
+    def prepare(self, model, training=False):
+        """Converted copy of the model for this mode; Conv+BN fusion only applies to inference"""
+        model = copy.deepcopy(model)
+        if self.fused and not training:
+            model = fuse_conv_bn(model)
+        if self.channels_last:
+            model = model.to(memory_format=torch.channels_last)
+        if self.compile:
+            model = torch.compile(model, mode=self.compile_mode)
+        return model
+
+    def inputs(self, x):
+        return x.contiguous(memory_format=torch.channels_last) if self.channels_last else x
+
+    def autocast(self, device_type='cpu'):
+        """bfloat16 autocast region for forward passes (and the loss), a no-op otherwise"""
+        return torch.autocast(device_type, dtype=torch.bfloat16) if self.bf16 else nullcontext()
+
+    def __repr__(self):
+        return f"Execution_Mode({self.name!r})"
+
+
+@torch.no_grad()
+def parity(model, mode, data, atol=1e-4, min_agreement=0.99):
+    """Compare a mode's predictions with the fp32 eager baseline on the same batch"""
+    model = model.eval()
+    baseline = model(data)
+    prepared = mode.prepare(model)
+    with mode.autocast(data.device.type):
+        scores = prepared(mode.inputs(data)).float()
+    agreement = (scores.argmax(1) == baseline.argmax(1)).float().mean().item()
+    max_diff = (scores - baseline).abs().max().item()
+    # bf16 keeps about 3 significant digits, so it is judged on top-1 agreement rather than logits
+    ok = agreement >= min_agreement and (mode.bf16 or max_diff <= atol * max(1.0, baseline.abs().max().item()))
+    return {'agreement': agreement, 'max_diff': max_diff, 'ok': ok}
+
+
+def images_per_second(model, mode, batch, steps=20, warmup=5, training=False):
+    """Throughput of forward (or forward + backward + step) passes for one mode"""
+    prepared = mode.prepare(model, training=training)
+    prepared.train(training)
+    x = mode.inputs(batch)
+    targets = torch.randint(0, 10, (batch.size(0),))
+    optimizer = torch.optim.Adam(prepared.parameters(), lr=0.001) if training else None
+    context = nullcontext() if training else torch.no_grad()
+    with context:
+        for step in range(warmup + steps):
+            if step == warmup:
+                start = time.perf_counter()
+            with mode.autocast(batch.device.type):
+                scores = prepared(x)
+                if training:
+                    loss = nn.functional.cross_entropy(scores.float(), targets)
+            if training:
+                optimizer.zero_grad()
+                loss.backward()
+                optimizer.step()
+    return steps * batch.size(0) / (time.perf_counter() - start)
+
+
+if __name__ == "__main__":
+    from project_cnn import Project_CNN
+
+    parser = argparse.ArgumentParser(description="Project_CNN images/sec and fp32 parity per execution mode (CPU)")
+    parser.add_argument('--modes', nargs='+', default=MODES)
+    parser.add_argument('--batch-size', type=int, default=64)
+    parser.add_argument('--steps', type=int, default=20)
+    args = parser.parse_args()
+
+    torch.manual_seed(1947)
+    model = Project_CNN().eval()
+    # Non-trivial BatchNorm statistics, so fusion is actually exercised
+    for module in model.modules():
+        if isinstance(module, nn.BatchNorm2d):
+            module.running_mean.uniform_(-0.5, 0.5)
+            module.running_var.uniform_(0.5, 2.0)
+    batch = torch.randn(args.batch_size, 3, 64, 64)
+
+    print(f"{'mode':<36}{'infer img/s':>12}{'train img/s':>12}{'top-1 agree':>12}{'max |diff|':>12}")
+    for name in args.modes:
+        mode = Execution_Mode(name)
+        check = parity(model, mode, batch)
+        infer = images_per_second(model, mode, batch, steps=args.steps)
+        train = images_per_second(copy.deepcopy(model), mode, batch, steps=args.steps // 2, training=True)
+        print(f"{name:<36}{infer:>12.0f}{train:>12.0f}{check['agreement']:>12.3f}{check['max_diff']:>12.2e}"
+              + ('' if check['ok'] else '  PARITY FAILED'))
@@ -0,0 +1,94 @@
+import torch.nn as nn
+
+
+class Project_CNN(nn.Module):
+    def __init__(self, loss_func = 'CE'):
+        super().__init__()
+
+        self.loss_func = loss_func
+        #Layer = Conv - BatchNorm - ReLU - MaxPool
+
+
+        self.conv1 = nn.Conv2d(in_channels = 3, out_channels= 32, kernel_size=3, stride=1, padding=1)
+        self.bn1 = nn.BatchNorm2d(32)
+        self.relu1 = nn.ReLU()
+        self.pool1 = nn.MaxPool2d(kernel_size=2, stride=2)
+
+
+        self.conv2 = nn.Conv2d(32, 64, kernel_size=3, stride=1, padding=1)
+        self.bn2 = nn.BatchNorm2d(64)
+        self.relu2 = nn.ReLU()
+        self.pool2 = nn.MaxPool2d(kernel_size=2, stride=2)
+
+
+        self.conv3 = nn.Conv2d(64, 128, kernel_size=3, stride=1, padding=1)
+        self.bn3 = nn.BatchNorm2d(128)
+        self.relu3 = nn.ReLU()
+        self.pool3 = nn.MaxPool2d(kernel_size=2, stride=2)
+
+
+        self.conv4 = nn.Conv2d(128, 256, kernel_size=3, stride=1, padding=1)
+        self.bn4 = nn.BatchNorm2d(256)
+        self.relu4 = nn.ReLU()
+        self.pool4 = nn.MaxPool2d(kernel_size=2, stride=2)
+
+        self.conv5 = nn.Conv2d(256, 512, kernel_size=3, stride=1, padding=1)
+        self.bn5 = nn.BatchNorm2d(512)
+        self.relu5 = nn.ReLU()
+        self.pool5 = nn.MaxPool2d(kernel_size=2, stride=2)
+
+
+        self.dropout = nn.Dropout(0.5)
+
+        # Fully connected layer
+
+        self.fc = nn.Linear(128 * 4 * 4, 10)
+
+        if self.loss_func == 'CE':
+            pass
+        elif self.loss_func == 'FL':
+            self.softmax = nn.Softmax(dim=1)
+
+
+    def forward(self, x):
+        # Layer 1
+        x = self.conv1(x)
+        x = self.bn1(x)
+        x = self.relu1(x)
+        x = self.pool1(x)
+
+        # Layer 2
+        x = self.conv2(x)
+        x = self.bn2(x)
+        x = self.relu2(x)
+        x = self.pool2(x)
+
+        # Layer 3
+        x = self.conv3(x)
+        x = self.bn3(x)
+        x = self.relu3(x)
+        x = self.pool3(x)
+
+        # Layer 4
+        x = self.conv4(x)
+        x = self.bn4(x)
+        x = self.relu4(x)
+        x = self.pool4(x)
+
+        # Layer 5
+        x = self.conv5(x)
+        x = self.bn5(x)
+        x = self.relu5(x)
+        x = self.pool5(x)
+
+        x = self.dropout(x)
+
+
+        # Flatten and fully connected
+        x = x.reshape(x.size(0), -1)  # channels_last activations cannot be .view()ed flat
+        x = self.fc(x)
+        if self.loss_func == 'CE':
+            pass
+        elif self.loss_func == 'FL':
+            x = self.softmax(x)
+        return x